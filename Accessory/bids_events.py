@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+#
+# bids_events.py
+#
+# Export rsvp_sweep.py runs as BIDS events files: one events.tsv and events.json per run
+# 1. Find runs: summary and stimlog files loose in Data, in pack_data.py session folders and in their zip archives
+# 2. Read a run: sweep rows and parameter block of the summary, the stimlog and the MRI pulses
+# 3. Events: sweeps, sets (targets apart) and target responses, built as column arrays
+# 4. Write events.tsv and the json sidecar
+# 5. Export a whole study in a process pool, skipping runs whose outputs are up to date
+#
+# Runs are named by their summary file, <sub>_run<N>_<mm-dd-yyyy>_hr.._min.._sec.._rsvp_sweep_summary.csv, and
+# written to <out>/sub-<sub>/ses-<yyyymmdd>/func/sub-<sub>_ses-<yyyymmdd>_task-rsvp_run-<N>_events.tsv (no ses
+# level with --no-session). A run found twice, e.g. in a session folder and in its zip, is read from the folder;
+# two runs with the same BIDS name (a restarted run) keep the later one.
+# Onsets are seconds from the reference MRI pulse (TR 0) when the run has a _pulses.csv, else from the start of
+# the run as in the summary and stimlog, which is the first pulse unless extended_start is on.
+# A target's response_time is its first hit; every hit is also a 'response' event, at the target onset plus the
+# RT logged. False positives are counted per sweep only.
+# The sidecar describes the columns and holds the parameters of the run: the block at the end of the summary, or
+# rsvp_params.txt for summaries without one.
+# Outputs are up to date when they are newer than the run's input files (a zip counts as one file).
+#
+# Example:
+#   python bids_events.py --out ../BIDS
+#   python bids_events.py ../Data/XX_10-19-2026_RSVP_pRF.zip --out ../BIDS --workers 4 --force
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import ast
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zipfile
+import numpy as np
+
+repo_path = dirname(dirname(abspath(getsourcefile(lambda:0))))
+sys.path.append(repo_path)
+import rsvp_design
+
+run_name = re.compile(r'^(?P<sub>.+)_run(?P<run>\d+)_(?P<month>\d\d)-(?P<day>\d\d)-(?P<year>\d{4})_hr(?P<hour>\d\d)_min(?P<minute>\d\d)_sec(?P<second>\d\d)_rsvp_sweep_summary$')
+suffixes = {'summary': '.csv', 'stimlog': '_stimlog.csv', 'pulses': '_pulses.csv'}
+columns = ['onset', 'duration', 'trial_type', 'sweep', 'direction', 'bar', 'bar_x', 'bar_y', 'images',
+           'target_image', 'target_slot', 'response_time', 'accuracy']
+column_info = {
+    'onset': {'Description': 'Onset from the reference MRI pulse, or from the start of the run without a pulse log', 'Units': 's'},
+    'duration': {'Description': 'Sweep duration, stimulus duration of a set, 0 for responses', 'Units': 's'},
+    'trial_type': {'Description': 'Kind of event',
+                   'Levels': {'sweep': 'A bar sweeping across the screen', 'set': 'Six distractor images on the bar',
+                              'target': 'Image set holding the target image', 'response': 'Key press scored as a hit'}},
+    'sweep': {'Description': 'Sweep number in the run, from 1'},
+    'direction': {'Description': 'Sweep direction',
+                  'Levels': {key: name for key, name in rsvp_design.type_names.items()}},
+    'bar': {'Description': 'Bar position in the sweep, from 1'},
+    'bar_x': {'Description': 'Horizontal bar centre, from the screen centre', 'Units': 'pixels'},
+    'bar_y': {'Description': 'Vertical bar centre, from the screen centre', 'Units': 'pixels'},
+    'images': {'Description': 'Stimulus numbers of the six bar slots, top or left first, separated by spaces; -1 for a slot without an image (checkerboard runs)'},
+    'target_image': {'Description': 'Stimulus number of the run\'s target'},
+    'target_slot': {'Description': 'Bar slot (1-6) holding the target'},
+    'response_time': {'Description': 'Time from target onset to the first hit, or of this response', 'Units': 's'},
+    'accuracy': {'Description': 'Hits as a percentage of targets in the sweep', 'Units': '%'}}
+
+
+# 1. Find runs
+# Sources are paths, or (zip path, member) for files in an archive; each run is a dict of its sources by kind
+def get_kind(name):
+    for kind in ['stimlog', 'pulses', 'summary']:
+        if name.endswith('_rsvp_sweep_summary' + suffixes[kind]):
+            return kind, name[0:-len(suffixes[kind])]
+    return None, None
+
+def find_runs(paths):
+    found = {}
+    def add(name, source):
+        kind, stem = get_kind(name)
+        if kind is None or run_name.match(stem) is None:
+            return
+        sources = found.setdefault(stem, {})
+        if kind not in sources or (not isinstance(source, tuple) and isinstance(sources[kind], tuple)):
+            sources[kind] = source                     # A folder copy wins over the zip archive
+    for path in paths:
+        if os.path.isfile(path):
+            walk = [(dirname(path), [], [os.path.basename(path)])]
+        else:
+            walk = os.walk(path)
+        for folder, subfolders, names in walk:
+            for name in names:
+                full = os.path.join(folder, name)
+                if name.endswith('.zip'):
+                    with zipfile.ZipFile(full) as archive:
+                        for member in archive.namelist():
+                            add(os.path.basename(member), (full, member))
+                else:
+                    add(name, full)
+    return {stem: sources for stem, sources in found.items() if 'summary' in sources}
+
+def open_source(source):
+    if isinstance(source, tuple):
+        archive = zipfile.ZipFile(source[0])
+        return io.TextIOWrapper(archive.open(source[1]), encoding = 'utf-8')
+    return open(source)
+
+def source_mtime(source):
+    return os.path.getmtime(source[0] if isinstance(source, tuple) else source)
+
+# BIDS labels and output files of a run
+def get_names(stem, out, session = True):
+    match = run_name.match(stem)
+    sub = re.sub('[^a-zA-Z0-9]', '', match.group('sub'))
+    ses = match.group('year') + match.group('month') + match.group('day')
+    prefix = 'sub-' + sub + ('_ses-' + ses if session else '') + '_task-rsvp_run-' + str(int(match.group('run')))
+    folder = os.path.join(out, 'sub-' + sub, 'ses-' + ses, 'func') if session else os.path.join(out, 'sub-' + sub, 'func')
+    return os.path.join(folder, prefix + '_events')
+
+
+# 2. Read a run
+# Sweep rows as column arrays, and the parameter block (key,value lines after the blank lines) as a dict of text
+def read_summary(source):
+    with open_source(source) as summary:
+        text = summary.read()
+    table, _, block = text.partition('\n\n')
+    sweeps = np.genfromtxt(io.StringIO(table), delimiter = ',', names = True, dtype = None, encoding = 'utf-8')
+    sweeps = np.atleast_1d(sweeps) if sweeps.size else sweeps.reshape(0)
+    params = {}
+    for line in block.splitlines():
+        if ',' in line:
+            key, value = line.split(',', 1)
+            params[key] = value
+    return sweeps, params
+
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+# Time of the reference pulse (TR 0) from the start of the run, fitted over all logged pulses
+def get_reference(source, tr):
+    with open_source(source) as pulse_file:
+        pulses = np.atleast_2d(np.loadtxt(pulse_file, delimiter = ',', skiprows = 1))
+    if pulses.size == 0:
+        return 0.0
+    return float(np.median(pulses[:, 1] - pulses[:, 2] * tr))
+
+
+# 3. Events
+# Column arrays of every event of the run; missing values are nan (numbers) or '' (text)
+def get_events(sweeps, sets, t_ref = 0.0):
+    n_sweeps = len(sweeps)
+    stim_dur = dict(zip(sweeps['Trial_Number'].astype(int), sweeps['Stim_Duration'].astype(float))) if n_sweeps else {}
+    events = {'onset': [sweeps['Sweep_Onset'].astype(float) - t_ref] if n_sweeps else [],
+              'duration': [sweeps['Sweep_Duration'].astype(float)] if n_sweeps else [],
+              'trial_type': [np.full(n_sweeps, 'sweep')],
+              'sweep': [sweeps['Trial_Number'].astype(int)] if n_sweeps else [],
+              'direction': [sweeps['Sweep_Direction'].astype(str)] if n_sweeps else [],
+              'bar': [np.full(n_sweeps, -1)],
+              'bar_x': [np.full(n_sweeps, np.nan)],
+              'bar_y': [np.full(n_sweeps, np.nan)],
+              'images': [np.full(n_sweeps, '')],
+              'target_image': [np.full(n_sweeps, -1)],
+              'target_slot': [np.full(n_sweeps, -1)],
+              'response_time': [np.full(n_sweeps, np.nan)],
+              'accuracy': [sweeps['Accuracy'].astype(float)] if n_sweeps else []}
+    if sets is not None and len(sets['trial']):
+        n = len(sets['trial'])
+        trial = sets['trial']
+        onset = sets['imageOnset']
+        new_trial = np.concatenate([[True], trial[1:] != trial[:-1]])
+        new_bar = new_trial | np.concatenate([[True], sets['barOnset'][1:] != sets['barOnset'][:-1]])
+        bar_count = np.cumsum(new_bar)
+        bar = bar_count - np.maximum.accumulate(np.where(new_trial, bar_count, 0)) + 1
+        targ_here = sets['targ_here']
+
+        # Hits of a row were scored against the last target shown in the same sweep
+        rows = np.arange(0, n)
+        last_targ = np.maximum.accumulate(np.where(targ_here, rows, -1))
+        last_targ[(last_targ < 0) | (trial[np.maximum(last_targ, 0)] != trial)] = -1
+        hit_rows, hit_rts = [], []
+        for row in np.flatnonzero(np.char.str_len(sets['RT']) > 0):
+            for rt in sets['RT'][row].split(','):
+                if rt.strip() and last_targ[row] >= 0:
+                    hit_rows.append(last_targ[row])
+                    hit_rts.append(float(rt))
+        hit_rows = np.array(hit_rows, dtype = int)
+        hit_rts = np.array(hit_rts, dtype = float)
+        first_rt = np.full(n, np.nan)
+        order = np.lexsort((hit_rts, hit_rows))
+        first = order[np.concatenate([[True], hit_rows[order][1:] != hit_rows[order][:-1]])] if len(order) else order
+        first_rt[hit_rows[first]] = hit_rts[first]
+
+        images = np.array([' '.join(row) for row in sets['img'].astype(str)])
+        set_dur = np.array([stim_dur.get(t, np.nan) for t in trial])
+        targ_img = np.where(targ_here, sets['targ_img'], -1)
+        targ_slot = np.where(targ_here, sets['targ_slot'] + 1, -1)
+        n_hits = len(hit_rows)
+        events['onset'] += [onset - t_ref, onset[hit_rows] + hit_rts - t_ref]
+        events['duration'] += [set_dur, np.zeros(n_hits)]
+        events['trial_type'] += [np.where(targ_here, 'target', 'set'), np.full(n_hits, 'response')]
+        events['sweep'] += [trial, trial[hit_rows]]
+        events['direction'] += [sets['direct'], sets['direct'][hit_rows]]
+        events['bar'] += [bar, bar[hit_rows]]
+        events['bar_x'] += [sets['x'].mean(axis = 1), sets['x'][hit_rows].mean(axis = 1)]
+        events['bar_y'] += [sets['y'].mean(axis = 1), sets['y'][hit_rows].mean(axis = 1)]
+        events['images'] += [images, np.full(n_hits, '')]
+        events['target_image'] += [targ_img, targ_img[hit_rows]]
+        events['target_slot'] += [targ_slot, targ_slot[hit_rows]]
+        events['response_time'] += [first_rt, hit_rts]
+        events['accuracy'] += [np.full(n, np.nan), np.full(n_hits, np.nan)]
+    events = {key: np.concatenate(values) if len(values) else np.zeros(0) for key, values in events.items()}
+    kind_order = np.select([events['trial_type'] == 'sweep', events['trial_type'] == 'response'], [0, 2], 1)
+    order = np.lexsort((kind_order, events['onset']))
+    return {key: values[order] for key, values in events.items()}
+
+
+# 4. Write events.tsv and the json sidecar
+# Numbers as text, n/a where missing (nan, negative codes or empty text)
+def format_column(values, fmt):
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), 'n/a', np.char.mod(fmt, values))
+    if values.dtype.kind in 'iu':
+        return np.where(values < 0, 'n/a', values.astype(str))
+    return np.where(values == '', 'n/a', values.astype(str))
+
+def write_events(prefix, events):
+    formats = {'onset': '%.4f', 'duration': '%.4f', 'bar_x': '%.1f', 'bar_y': '%.1f', 'response_time': '%.3f', 'accuracy': '%.2f'}
+    table = np.stack([format_column(events[key], formats.get(key, '%g')) for key in columns], axis = 1) if len(events['onset']) else None
+    with open(prefix + '.tsv', 'w') as out:
+        out.write('\t'.join(columns) + '\n')
+        if table is not None:
+            np.savetxt(out, table, fmt = '%s', delimiter = '\t')
+
+# json has no nan or inf; Tuples become lists
+def to_json(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return to_json(value.item())
+    return value
+
+def write_sidecar(prefix, params, params_source, t_ref, sources):
+    sidecar = dict(column_info)
+    sidecar['TaskName'] = 'rsvp'
+    sidecar['OnsetReference'] = 'reference MRI pulse (TR 0), %.4f s after the start of the run' % t_ref if 'pulses' in sources else 'start of the run'
+    sidecar['Parameters'] = to_json(params)
+    sidecar['ParametersSource'] = params_source
+    sidecar['SourceFiles'] = {kind: (os.path.basename(source[0]) + ':' + source[1] if isinstance(source, tuple) else os.path.basename(source)) for kind, source in sources.items()}
+    with open(prefix + '.json', 'w') as out:
+        json.dump(sidecar, out, indent = 2)
+        out.write('\n')
+
+
+# 5. Export a study
+def export_run(stem, sources, prefix, params_fn = None):
+    t0 = time.time()
+    sweeps, block = read_summary(sources['summary'])
+    if block:
+        params = {key: parse_value(value) for key, value in block.items()}
+        params_source = 'summary'
+    else:
+        params = rsvp_design.load_params(params_fn if params_fn is not None else os.path.join(repo_path, 'rsvp_params.txt'))
+        params_source = 'rsvp_params.txt'
+    sets = None
+    if 'stimlog' in sources:
+        with open_source(sources['stimlog']) as stim_log:
+            sets = rsvp_design.read_stimlog(stim_log)
+    t_ref = get_reference(sources['pulses'], float(params['tr'])) if 'pulses' in sources else 0.0
+    events = get_events(sweeps, sets, t_ref)
+    os.makedirs(dirname(prefix), exist_ok = True)
+    write_events(prefix, events)
+    write_sidecar(prefix, params, params_source, t_ref, sources)
+    kinds = events['trial_type']
+    return '%s: %i sweeps, %i sets, %i targets, %i responses -> %s (%.2f s)' % (stem, np.sum(kinds == 'sweep'), np.sum(kinds != 'sweep') - np.sum(kinds == 'response'),
+                                                                       np.sum(kinds == 'target'), np.sum(kinds == 'response'), os.path.basename(prefix) + '.tsv', time.time() - t0)
+
+def export_job(job):
+    return export_run(*job)
+
+def is_current(sources, prefix):
+    outputs = [prefix + '.tsv', prefix + '.json']
+    if not all([os.path.isfile(fn) for fn in outputs]):
+        return False
+    return min([os.path.getmtime(fn) for fn in outputs]) >= max([source_mtime(source) for source in sources.values()])
+
+def export_all(paths, out, session = True, workers = None, force = False, params_fn = None):
+    runs = find_runs(paths)
+    if len(runs) == 0:
+        raise Exception('Error: No rsvp_sweep summary files in %s' % ', '.join(paths))
+    # Runs with the same BIDS name: the later one is kept (names sort by time within a subject and run)
+    prefixes = {}
+    for stem in sorted(runs):
+        prefix = get_names(stem, out, session)
+        if prefix in prefixes:
+            print('%s replaces %s as %s' % (stem, prefixes[prefix], os.path.basename(prefix)))
+        prefixes[prefix] = stem
+    jobs = [(stem, runs[stem], prefix, params_fn) for prefix, stem in sorted(prefixes.items())
+            if force or not is_current(runs[stem], prefix)]
+    print('%i runs found, %i up to date, %i to export' % (len(prefixes), len(prefixes) - len(jobs), len(jobs)))
+    if len(jobs) == 0:
+        return
+    workers = min(len(jobs), workers if workers is not None else os.cpu_count() or 1)
+    if workers == 1:
+        reports = [export_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            reports = pool.map(export_job, jobs, chunksize = max(1, len(jobs) // (4 * workers)))
+        finally:
+            pool.close()
+            pool.join()
+    for report in reports:
+        print(report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Export rsvp_sweep.py runs as BIDS events.tsv files with json sidecars')
+    parser.add_argument('paths', nargs = '*', default = [os.path.join(repo_path, 'Data')], help = 'Data folders, session folders, zip archives or summary files; defaults to Data')
+    parser.add_argument('--out', required = True, help = 'BIDS dataset folder')
+    parser.add_argument('--no-session', action = 'store_true', help = 'No ses-<date> level in the output')
+    parser.add_argument('--workers', type = int, default = None, help = 'Runs exported at once; defaults to the number of CPUs')
+    parser.add_argument('--force', action = 'store_true', help = 'Export runs whose outputs are up to date too')
+    parser.add_argument('--params', default = None, help = 'Parameter file for summaries without a parameter block; defaults to rsvp_params.txt')
+    args = parser.parse_args()
+    t0 = time.time()
+    export_all(args.paths, args.out, session = not args.no_session, workers = args.workers, force = args.force, params_fn = args.params)
+    print('(%.2f s)' % (time.time() - t0))
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# eyelink_asc.py
+#
+# Read EyeLink ASCII exports (edf2asc) of rsvp_sweep.py sessions into numpy arrays, aligned to the stimlogs
+# 1. Stream an ASC file in fixed-size blocks: samples, fixations, saccades, blinks and messages as typed arrays
+# 2. Segment by the run, trial and xDAT messages rsvp_sweep.py sends
+# 3. Align each run to its stimlog: tracker time -> stimlog time, fitted on the sweep onsets
+# 4. Parse a whole session directory in a process pool; Save one npz per ASC file
+#
+# Each block of the file is split with regular expressions into sample lines (they start with a digit) and
+# event lines, and the samples of a block are read by np.loadtxt in one call, so memory is bounded by the block
+# size plus the arrays returned. Missing values ('.', e.g. in blinks) become nan.
+# Samples: time (ms, tracker clock), x, y and pupil as (n, eyes) arrays, eyes from the SAMPLES line (LEFT, RIGHT
+# or both); velocity and resolution columns are skipped.
+# Messages sent through psy_et.MessageDispatcher carry the queue delay as an offset ('MSG <time> <offset> <text>');
+# their time is the tracker time minus the offset, the time rsvp_sweep.py issued them.
+# One EDF holds every run of a session: 'run N' starts a run, 'trial N' a sweep; 'xDAT 1' marks the start of
+# sweep() and 'xDAT 2' the end of its loading period, one frame before the first sweep frame. Samples, fixations
+# and saccades are given the run and trial (0: none) they fall in.
+# The stimlog of run N is the *_run<N>_*_stimlog.csv whose name starts like the ASC file's (EDF names are the
+# subject name, or its first three letters, then _R<run>); with several, the one that fits best. The fit is
+# tracker seconds = offset + scale * stimlog seconds over the xDAT 2 message and first set onset of every sweep,
+# so stim_t of samples and events is in stimlog time (seconds from the start of the run), ready for
+# Accessory/stim_index.py queries. The residuals of the fit are printed.
+#
+# Example:
+#   edf2asc ../Data/XX_R1.edf
+#   python eyelink_asc.py ../Data/XX_R1.asc
+#   python eyelink_asc.py ../Data --workers 4
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import glob
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+block_size = 16 * 1024 * 1024            # Bytes of the file read at a time
+
+non_sample_line = re.compile(rb'^[^0-9\n][^\n]*\n?', re.M)
+event_line = re.compile(rb'^(?:MSG|EFIX|ESACC|EBLINK|SAMPLES|START|END)\b[^\n]*', re.M)
+missing = re.compile(rb'(?<=\t) *\.(?=[\t\n])')
+
+
+# 1. Stream an ASC file
+# Yields the lines of a file in blocks of whole lines, each about block_size bytes
+def read_blocks(filename, size = None):
+    size = block_size if size is None else size
+    with open(filename, 'rb') as asc:
+        rest = b''
+        while True:
+            data = asc.read(size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            yield data[0:cut].replace(b'\r', b'')
+        if rest:
+            yield rest.replace(b'\r', b'') + b'\n'
+
+def parse_samples(block, eyes):
+    samples = non_sample_line.sub(b'', block)
+    if not samples:
+        return np.zeros((0, 1 + 3 * eyes))
+    samples = missing.sub(b'nan', samples)
+    data = np.loadtxt(io.BytesIO(samples), delimiter = '\t', usecols = list(range(0, 1 + 3 * eyes)), ndmin = 2)
+    return data
+
+def to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+# Fixation, saccade and blink end events and messages of a block; Updates eyes from SAMPLES lines
+def parse_events(block, events, eyes):
+    for line in event_line.findall(block):
+        text = line.decode('utf-8', 'replace')
+        fields = text.split()
+        kind = fields[0]
+        if kind == 'MSG':
+            parts = text.split(None, 2)
+            stamp = to_float(parts[1]) if len(parts) > 1 else np.nan
+            text = parts[2] if len(parts) > 2 else ''
+            offset = re.match(r'^(-?\d+)\s+(.*)$', text)
+            if offset:                                          # 'MSG <time> <offset> <text>'
+                stamp -= int(offset.group(1))
+                text = offset.group(2)
+            events['msg'].append((stamp, text.strip()))
+        elif kind == 'EFIX' and len(fields) >= 8:
+            events['fix'].append([fields[1]] + [to_float(f) for f in fields[2:8]])
+        elif kind == 'ESACC' and len(fields) >= 11:
+            events['sacc'].append([fields[1]] + [to_float(f) for f in fields[2:11]])
+        elif kind == 'EBLINK' and len(fields) >= 5:
+            events['blink'].append([fields[1]] + [to_float(f) for f in fields[2:5]])
+        elif kind == 'SAMPLES':
+            eyes = 2 if ('LEFT' in fields and 'RIGHT' in fields) else 1
+    return eyes
+
+def event_arrays(rows, names):
+    if len(rows) == 0:
+        out = {'eye': np.zeros(0, dtype = 'U1')}
+        out.update({name: np.zeros(0) for name in names})
+        return out
+    out = {'eye': np.array([row[0] for row in rows], dtype = 'U1')}
+    values = np.array([row[1:] for row in rows], dtype = float)
+    out.update({name: values[:, k] for k, name in enumerate(names)})
+    return out
+
+# Whole file: samples, fix, sacc, blink and msg dicts of arrays
+def parse_asc(filename, size = None):
+    events = {'msg': [], 'fix': [], 'sacc': [], 'blink': []}
+    eyes = 1
+    blocks = []
+    for block in read_blocks(filename, size):
+        eyes = parse_events(block, events, eyes)
+        data = parse_samples(block, eyes)
+        if len(blocks) and blocks[-1].shape[1] != data.shape[1]:
+            raise Exception('Error: %s switches between monocular and binocular samples' % filename)
+        blocks.append(data)
+    data = np.concatenate(blocks) if blocks else np.zeros((0, 4))
+    eyes = (data.shape[1] - 1) // 3
+    samples = {'time': data[:, 0],
+               'x': data[:, 1:1 + 3 * eyes:3].astype(np.float32),
+               'y': data[:, 2:2 + 3 * eyes:3].astype(np.float32),
+               'pupil': data[:, 3:3 + 3 * eyes:3].astype(np.float32)}
+    msg = {'time': np.array([m[0] for m in events['msg']], dtype = float),
+           'text': np.array([m[1] for m in events['msg']], dtype = str)}
+    return {'samples': samples, 'msg': msg,
+            'fix': event_arrays(events['fix'], ['start', 'end', 'dur', 'x', 'y', 'pupil']),
+            'sacc': event_arrays(events['sacc'], ['start', 'end', 'dur', 'start_x', 'start_y', 'end_x', 'end_y', 'ampl', 'peak_vel']),
+            'blink': event_arrays(events['blink'], ['start', 'end', 'dur'])}
+
+
+# 2. Segment by run, trial and xDAT messages
+# Returns runs (number, start) and trials (run, trial, start, end, xdat1, xdat2), all in tracker ms
+def get_segments(msg, t_end = np.inf):
+    runs = {'run': [], 'start': []}
+    trials = {'run': [], 'trial': [], 'start': [], 'end': [], 'xdat1': [], 'xdat2': []}
+    run = 0
+    for stamp, text in zip(msg['time'], msg['text']):
+        words = text.split()
+        if len(words) == 2 and words[0] in ['run', 'trial', 'xDAT'] and words[1].isdigit():
+            if trials['start'] and np.isinf(trials['end'][-1]) and (words[0] in ['run', 'trial'] or words[1] == '111'):
+                trials['end'][-1] = stamp
+            if words[0] == 'run':
+                run = int(words[1])
+                runs['run'].append(run)
+                runs['start'].append(stamp)
+            elif words[0] == 'trial':
+                for key, value in zip(['run', 'trial', 'start', 'end', 'xdat1', 'xdat2'], [run, int(words[1]), stamp, np.inf, np.nan, np.nan]):
+                    trials[key].append(value)
+            elif words[1] in ['1', '2'] and trials['start']:
+                trials['xdat' + words[1]][-1] = stamp
+    if trials['start'] and np.isinf(trials['end'][-1]):
+        trials['end'][-1] = t_end
+    return ({key: np.array(runs[key]) for key in runs}, {key: np.array(trials[key]) for key in trials})
+
+# Run and trial of each time (0 where none); runs last until the next run starts
+def assign(times, runs, trials):
+    run_idx = np.searchsorted(runs['start'], times, side = 'right') - 1
+    run = np.where(run_idx >= 0, runs['run'][np.maximum(run_idx, 0)], 0) if len(runs['start']) else np.zeros(len(times), dtype = int)
+    trial = np.zeros(len(times), dtype = int)
+    if len(trials['start']):
+        trial_idx = np.maximum(np.searchsorted(trials['start'], times, side = 'right') - 1, 0)
+        inside = (times >= trials['start'][trial_idx]) & (times < trials['end'][trial_idx])
+        trial = np.where(inside, trials['trial'][trial_idx], 0)
+    return run, trial
+
+
+# 3. Align runs to stimlogs
+def find_stimlogs(asc_fn, run, stimlog_dir = None):
+    stimlog_dir = dirname(abspath(asc_fn)) if stimlog_dir is None else stimlog_dir
+    prefix = os.path.basename(asc_fn).split('_R')[0]
+    candidates = [fn for fn in glob.glob(os.path.join(stimlog_dir, '*_run*_*_stimlog.csv'))
+                  if re.search(r'_run0*%i_' % run, os.path.basename(fn))]                # Run numbers may be zero-padded
+    return [fn for fn in candidates if os.path.basename(fn).startswith(prefix)] or candidates
+
+# Offset and scale of tracker seconds = offset + scale * stimlog seconds, and the residuals in ms
+def fit_alignment(trials, run, sets):
+    in_run = trials['run'] == run
+    onsets = {t: sets['imageOnset'][sets['trial'] == t][0] for t in np.unique(sets['trial'])}
+    pairs = [(onsets[t], x / 1000) for t, x in zip(trials['trial'][in_run], trials['xdat2'][in_run]) if t in onsets and np.isfinite(x)]
+    if len(pairs) == 0:
+        return None
+    stim_t, tracker_t = np.array(pairs).T
+    if len(pairs) == 1:
+        offset, scale = tracker_t[0] - stim_t[0], 1.0
+    else:
+        scale, offset = np.polyfit(stim_t, tracker_t, 1)
+    return {'offset': offset, 'scale': scale, 'residual_ms': 1000 * (tracker_t - (offset + scale * stim_t)), 'n': len(pairs)}
+
+def align_runs(asc_fn, trials, runs, stimlog_dir = None):
+    alignments = {}
+    for run in runs['run']:
+        best = None
+        for stimlog in find_stimlogs(asc_fn, run, stimlog_dir):
+            fit = fit_alignment(trials, run, rsvp_design.read_stimlog(stimlog))
+            if fit is not None and (best is None or np.abs(fit['residual_ms']).max() < np.abs(best['residual_ms']).max()):
+                best = dict(fit, stimlog = stimlog)
+        if best is not None:
+            alignments[run] = best
+    return alignments
+
+# Stimlog seconds of tracker times in each run; nan for runs without a stimlog
+def to_stim_time(times, run, alignments):
+    stim_t = np.full(len(times), np.nan)
+    for r, fit in alignments.items():
+        stim_t[run == r] = (times[run == r] / 1000 - fit['offset']) / fit['scale']
+    return stim_t
+
+
+# 4. Session directories
+def process(asc_fn, stimlog_dir = None, out = None):
+    t0 = time.time()
+    data = parse_asc(asc_fn)
+    t_parse = time.time() - t0
+    samples = data['samples']
+    t_end = samples['time'][-1] + 1 if len(samples['time']) else np.inf
+    runs, trials = get_segments(data['msg'], t_end)
+    alignments = align_runs(asc_fn, trials, runs, stimlog_dir)
+    arrays = {}
+    for name, key in [('samples', 'time'), ('fix', 'start'), ('sacc', 'start'), ('blink', 'start'), ('msg', 'time')]:
+        group = data[name]
+        group['run'], group['trial'] = assign(group[key], runs, trials)
+        group['stim_t'] = to_stim_time(group[key], group['run'], alignments)
+        arrays.update({name + '_' + field: values for field, values in group.items()})
+    arrays.update({'run_' + key: values for key, values in runs.items()})
+    arrays.update({'trial_' + key: values for key, values in trials.items()})
+    for key in ['offset', 'scale']:
+        arrays['align_' + key] = np.array([alignments[r][key] if r in alignments else np.nan for r in runs['run']])
+    arrays['align_stimlog'] = np.array([os.path.basename(alignments[r]['stimlog']) if r in alignments else '' for r in runs['run']])
+    out = os.path.splitext(asc_fn)[0] + '_gaze.npz' if out is None else out
+    np.savez(out, **arrays)
+    lines = ['%s: %i samples (%.1f min), %i fixations, %i saccades, %i blinks, %i messages; parsed in %.2f s'
+             % (os.path.basename(asc_fn), len(samples['time']), (samples['time'][-1] - samples['time'][0]) / 60000 if len(samples['time']) else 0,
+                len(data['fix']['start']), len(data['sacc']['start']), len(data['blink']['start']), len(data['msg']['time']), t_parse)]
+    for r in runs['run']:
+        n_trials = np.sum(trials['run'] == r)
+        if r in alignments:
+            fit = alignments[r]
+            lines.append('  Run %i: %i sweeps, aligned to %s on %i onsets (residual max %.2f ms, clock ratio %.6f)'
+                         % (r, n_trials, os.path.basename(fit['stimlog']), fit['n'], np.abs(fit['residual_ms']).max(), fit['scale']))
+        else:
+            lines.append('  Run %i: %i sweeps, no matching stimlog' % (r, n_trials))
+    lines.append('  Saved %s' % out)
+    return '\n'.join(lines)
+
+def process_job(job):
+    return process(*job)
+
+def process_all(paths, stimlog_dir = None, workers = None):
+    asc_fns = []
+    for path in paths:
+        asc_fns += sorted(glob.glob(os.path.join(path, '*.asc'))) if os.path.isdir(path) else [path]
+    if len(asc_fns) == 0:
+        raise Exception('Error: No ASC files in %s' % ', '.join(paths))
+    jobs = [(asc_fn, stimlog_dir) for asc_fn in asc_fns]
+    workers = min(len(jobs), workers if workers is not None else os.cpu_count() or 1)
+    if workers == 1:
+        reports = [process_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            reports = pool.map(process_job, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    for report in reports:
+        print(report)
+
+# Arrays saved by process(), grouped again: samples, fix, sacc, blink, msg, run, trial and align dicts
+def load_gaze(filename):
+    data = np.load(filename)
+    groups = {}
+    for key in data.files:
+        group, field = key.split('_', 1)
+        groups.setdefault(group, {})[field] = data[key]
+    return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Read EyeLink ASC files of rsvp_sweep.py sessions, aligned to their stimlogs')
+    parser.add_argument('paths', nargs = '+', help = 'ASC files, or directories of them')
+    parser.add_argument('--stimlogs', default = None, help = 'Folder with the stimlogs; defaults to the folder of each ASC file')
+    parser.add_argument('--workers', type = int, default = None, help = 'Files parsed at once; defaults to the number of CPUs')
+    args = parser.parse_args()
+    t0 = time.time()
+    process_all(args.paths, stimlog_dir = args.stimlogs, workers = args.workers)
+    print('(%.2f s)' % (time.time() - t0))
@@ -17,12 +17,12 @@
 
 
 # 0. Import modules
-import math
 import platform 
 import sys
 sys.path.append("..")
 
 import psy_utility as psyut
+import rsvp_design
 
 
 # 1. Load experiment parameters from rsvp_params.txt
@@ -58,10 +58,7 @@ except:
 '''
 
 # 2. Configure remaining parameters
-
-trs_per_sweep = 1 + params['tr_per_bar'] * params['n_bars']
-total_trs = 1 + trs_per_sweep * params['n_trials']
-types = ['Left to Right', 'Top to Bottom', 'Right to Left', 'Bottom to Top']
+# The TR sequence itself comes from rsvp_design.get_run_timing so that offline tools use the same table
 filename = 'RSVP_pRF_MRI_timing'
 datafile = open(filename + '.csv', 'w')
 datafile.write('Time,TR,Program Stage,Sweep Number,Sweep Direction\n')
@@ -69,49 +66,15 @@ datafile.write('Time,TR,Program Stage,Sweep Number,Sweep Direction\n')
 
 # 3. Write experiment sequence to csv
 # - extended_start parameter causes the rsvp_sweep.py program to use an alternative startup sequence, which must be accounted for. All other structure is the same 
-if params['extended_start']:
-    tr_wait = math.ceil(9.5 / params['tr'])
-    datafile.write('-,-,Load program,-,-\n')
-    datafile.write('0,0,Get Ready! and wait for spacebar and MRI signal,-,-\n')
-    time = params['tr']
-    this_tr = 1
-    for i in list(range(1,tr_wait+1)):
-        if i == tr_wait:
-            datafile.write('%f,%i,Wait for MRI signal,-,-\n' %(time,this_tr))
-        else:
-            datafile.write('%f,%i,Fixate and Wait,-,-\n' %(time,this_tr))
-        time += params['tr']
-        this_tr += 1
-    for sweep in list(range(0,params['n_trials'])):
-        direc = types[sweep % 4]
-        datafile.write('%f,%i,Load stimuli,%i,%s\n' %(time,this_tr,sweep+1,direc))
-        time += params['tr']
-        this_tr += 1
-        step = 1   
-        for j in list(range(1,params['n_bars']+1)):
-            for k in list(range(0,params['tr_per_bar'])):
-                datafile.write('%f,%i,Step %i,%i,%s\n' %(time,this_tr,step,sweep+1,direc))
-                time += params['tr']
-                this_tr += 1
-            step += 1
-else:
-    datafile.write('-,-,Load and wait for MRI signal,-,-\n')
-    datafile.write('0,0,-,-,-\n')
-    datafile.write('%f,1,Get ready message,-,-\n' %params['tr'])
-    time = params['tr'] * 2
-    this_tr = 2
-    for sweep in list(range(0,params['n_trials'])):
-        direc = types[sweep % 4]
-        datafile.write('%f,%i,Load stimuli,%i,%s\n' %(time,this_tr,sweep+1,direc))
-        time += params['tr']
-        this_tr += 1
-        step = 1   
-        for j in list(range(1,params['n_bars']+1)):
-            for k in list(range(0,params['tr_per_bar'])):
-                datafile.write('%f,%i,Step %i,%i,%s\n' %(time,this_tr,step,sweep+1,direc))
-                time += params['tr']
-                this_tr += 1
-            step += 1
+for time, this_tr, stage, sweep, direc in rsvp_design.get_run_timing(params):
+    if time is None: time = '-'
+    elif this_tr == 0: time = '0'
+    else: time = '%f' % time
+    this_tr = '-' if this_tr is None else '%i' % this_tr
+    stage = '-' if stage is None else stage
+    sweep = '-' if sweep is None else '%i' % sweep
+    direc = '-' if direc is None else direc
+    datafile.write('%s,%s,%s,%s,%s\n' %(time,this_tr,stage,sweep,direc))
             
         
 # Clean up
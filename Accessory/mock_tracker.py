@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# mock_tracker.py
+#
+# Local stand-in for the EyeLink host, to check eyetracker messaging without hardware
+# 1. Mock tracker server: receive messages over UDP, record arrival times, reply after a simulated delay
+# 2. Mock tracker client: blocking sendMessage(message, time_offset), like io.devices.tracker
+# 3. Frame loop benchmark: synchronous sends vs psy_et.MessageDispatcher
+# 4. Simulated gaze samples; psy_et.GazeMonitor benchmark
+#
+# The benchmark sends 'xDAT'/'trial' style messages from a 60 Hz loop and reports
+#   - how long the presentation thread was blocked per message,
+#   - whether messages arrived in order,
+#   - the error between the time a message was issued and the time the tracker would date it
+#     (arrival time minus the offset in the message).
+#
+# The gaze benchmark streams simulated 500 Hz samples (fixation noise, saccades away from fixation
+# and blinks) through psy_et.GazeMonitor and prints per-bar fixation statistics.
+#
+# Example:
+#   python mock_tracker.py --messages 200 --latency 3 --jitter 5
+#   python mock_tracker.py --gaze 20
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+from collections import namedtuple
+import argparse
+import math
+import random
+import socket
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import psy_et
+
+clock = time.perf_counter
+
+
+# 1. Mock tracker server
+# Each datagram is '<offset>\t<message>'; the reply is sent after latency + jitter seconds
+class MockTrackerServer(object):
+    def __init__(self, latency = 0.003, jitter = 0.005, port = 0, seed = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.address = self.sock.getsockname()
+        self.received = []          # (arrival time, offset in ms, message)
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data, client = self.sock.recvfrom(4096)
+            if data == b'quit':
+                break
+            arrival = clock()
+            offset, message = data.decode().split('\t', 1)
+            self.received.append((arrival, int(offset), message))
+            time.sleep(self.latency + self.random.random() * self.jitter)
+            self.sock.sendto(b'ok', client)
+
+    def stop(self):
+        stopper = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        stopper.sendto(b'quit', self.address)
+        stopper.close()
+        self.thread.join()
+        self.sock.close()
+
+
+# 2. Mock tracker client
+class MockTracker(object):
+    def __init__(self, address):
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def sendMessage(self, message_contents, time_offset = None):
+        self.sock.sendto(('%i\t%s' % (time_offset or 0, message_contents)).encode(), self.address)
+        self.sock.recvfrom(16)
+
+    def close(self):
+        self.sock.close()
+
+
+# 3. Frame loop benchmark
+# Sends a message on every `every`-th frame of a 60 Hz loop; Returns presentation thread blocking times and the server log
+def run_loop(send, n_messages, every = 4, fps = 60):
+    issued = []
+    blocked = []
+    frame = 0
+    next_flip = clock()
+    while len(issued) < n_messages:
+        frame += 1
+        if frame % every == 0:
+            message = 'xDAT %i' % len(issued)
+            t0 = clock()
+            send(message)
+            blocked.append(clock() - t0)
+            issued.append((t0, message))
+        next_flip += 1 / fps
+        time.sleep(max(0, next_flip - clock()))
+    return issued, np.array(blocked)
+
+def check(name, issued, blocked, received):
+    messages = [msg for (arrival, offset, msg) in received]
+    in_order = messages == [msg for (t, msg) in issued]
+    dated = {msg: arrival - offset / 1000 for (arrival, offset, msg) in received}
+    error = np.array([dated[msg] - t for (t, msg) in issued if msg in dated]) * 1000
+    print('%s:' % name)
+    print('  Messages received: %i / %i, in order: %s' % (len(received), len(issued), in_order))
+    print('  Presentation thread blocked (ms): mean %.3f, max %.3f' % (blocked.mean() * 1000, blocked.max() * 1000))
+    print('  Timestamp error (ms): mean %.3f, max %.3f' % (error.mean(), np.abs(error).max()))
+    return in_order
+
+def benchmark(n_messages = 200, latency = 0.003, jitter = 0.005, seed = 0):
+    server = MockTrackerServer(latency = latency, jitter = jitter, seed = seed)
+    tracker = MockTracker(server.address)
+    issued, blocked = run_loop(tracker.sendMessage, n_messages)
+    sync_ok = check('Synchronous sendMessage', issued, blocked, server.received)
+
+    server.received = []
+    dispatcher = psy_et.MessageDispatcher(tracker, clock = clock)
+    issued, blocked = run_loop(dispatcher.send, n_messages)
+    dispatcher.stop()
+    async_ok = check('MessageDispatcher', issued, blocked, server.received)
+    dispatcher.print_stats()
+    tracker.close()
+    server.stop()
+    return sync_ok and async_ok
+
+
+# 4. Simulated gaze samples
+# getEvents() returns the samples a 500 Hz tracker would have produced since the last call, in pixels
+Sample = namedtuple('Sample', ['time', 'gaze_x', 'gaze_y'])
+
+class SimulatedGazeTracker(object):
+    def __init__(self, rate = 500, noise = 10, saccade_rate = 0.5, blink_rate = 0.2, ppd = 50, seed = None):
+        self.rate = rate
+        self.noise = noise                      # Fixation noise SD in pix
+        self.saccade_rate = saccade_rate        # Saccades away from fixation per second
+        self.blink_rate = blink_rate            # Blinks per second
+        self.ppd = ppd
+        self.random = random.Random(seed)
+        self.last = clock()
+        self.away_until = 0
+        self.away = (0, 0)
+        self.blink_until = 0
+
+    def getEvents(self, event_type = None):
+        now = clock()
+        n = int((now - self.last) * self.rate)
+        samples = []
+        for k in list(range(0, n)):
+            t = self.last + (k + 1) / self.rate
+            if self.random.random() < self.blink_rate / self.rate:
+                self.blink_until = t + 0.15
+            if self.random.random() < self.saccade_rate / self.rate:
+                angle = self.random.uniform(0, 2 * math.pi)
+                amp = self.random.uniform(1, 5) * self.ppd
+                self.away = (amp * math.cos(angle), amp * math.sin(angle))
+                self.away_until = t + self.random.uniform(0.1, 0.4)
+            if t < self.blink_until:
+                samples.append(Sample(t, float('nan'), float('nan')))
+                continue
+            x, y = self.away if t < self.away_until else (0, 0)
+            samples.append(Sample(t, x + self.random.gauss(0, self.noise), y + self.random.gauss(0, self.noise)))
+        self.last += n / self.rate
+        return samples
+
+def gaze_benchmark(duration = 20, bar_dur = 2.6, ppd = 50, tolerance = 1.5, seed = 0):
+    tracker = SimulatedGazeTracker(ppd = ppd, seed = seed)
+    monitor = psy_et.GazeMonitor(tracker)
+    monitor.start()
+    start = clock()
+    bar_start = start
+    bar = 1
+    while bar_start + bar_dur <= start + duration:
+        time.sleep(max(0, bar_start + bar_dur - clock()))
+        bar_end = clock()
+        stats = monitor.fixation_stats(bar_start, bar_end, ppd, tolerance)
+        print('Bar %2i: %4i samples, valid %5.1f%%, mean dev %.2f deg, max dev %.2f deg, within %.1f deg: %5.1f%%'
+              % (bar, stats['n_samples'], stats['valid_pct'], stats['mean_dev'], stats['max_dev'], tolerance, stats['within_pct']))
+        bar_start = bar_end
+        bar += 1
+    monitor.stop()
+    expected = int((clock() - start) * tracker.rate)
+    print('Captured %i of ~%i samples' % (monitor.count, expected))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark eyetracker messaging against a local mock tracker')
+    parser.add_argument('--messages', type = int, default = 200)
+    parser.add_argument('--latency', type = float, default = 3, help = 'Fixed tracker reply delay in ms')
+    parser.add_argument('--jitter', type = float, default = 5, help = 'Uniform random extra reply delay in ms')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--gaze', type = float, default = 0, help = 'Run the gaze monitor benchmark for this many seconds instead')
+    args = parser.parse_args()
+    if args.gaze > 0:
+        gaze_benchmark(duration = args.gaze, seed = args.seed)
+    elif not benchmark(args.messages, args.latency / 1000, args.jitter / 1000, args.seed):
+        sys.exit(1)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# operator_console.py
+#
+# Live view of a running rsvp_sweep.py for the operator, in its own process
+# 1. Wait for the experiment's status block (operator_console in rsvp_params.txt)
+# 2. Redraw the run state several times a second
+#
+# Reads the shared-memory block published by psy_status.StatusBoard; nothing here can slow the experiment down.
+# Start it in a second terminal before or during a run; it keeps a list of finished sweeps while it runs.
+#
+# Example:
+#   python operator_console.py
+#   python operator_console.py --rate 4
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import psy_status
+
+
+# 1. Wait for the status block
+def connect(name, wait = 1.0):
+    printed = False
+    while True:
+        try:
+            return psy_status.StatusReader(name)
+        except FileNotFoundError:
+            if not printed:
+                print('Waiting for rsvp_sweep.py (operator_console = True) ...')
+                printed = True
+            time.sleep(wait)
+
+
+# 2. Redraw the run state
+def format_status(status, sweeps, stale_after = 5.0):
+    age = time.time() - status['updated']
+    accuracy = 100 * status['correct'] / status['total'] if status['total'] else float('nan')
+    lines = ['RSVP sweep - run %i - %s%s' % (status['run'], status['state'], '   (no update for %.0f s)' % age if age > stale_after else ''),
+             '',
+             'Sweep      %i / %i   %s' % (status['trial'], status['n_trials'], status['direct']),
+             'Bar        %i / %i' % (status['bar'], status['n_bars']),
+             'Duration   %i ms (index %i)' % (status['stim_ms'], status['dur_idx']),
+             'Hits       %i / %i   (%s)' % (status['correct'], status['total'], '-' if math.isnan(accuracy) else '%.0f%%' % accuracy),
+             'False pos  %i' % status['false_pos'],
+             'Last RT    %s' % ('-' if math.isnan(status['last_rt']) else '%.0f ms' % (1000 * status['last_rt'])),
+             'Dropped    %i frames' % status['dropped'],
+             'Pulses     %i' % status['pulses'],
+             'Run time   %.1f s' % status['run_time'],
+             '']
+    if sweeps:
+        lines.append('Finished sweeps:')
+        for (run, trial, direct, stim_ms, accuracy) in sweeps[-12:]:
+            lines.append('  run %i sweep %2i  %s  %4i ms  %5.1f%%' % (run, trial, direct, stim_ms, accuracy))
+    return '\n'.join(lines)
+
+def run_console(name = psy_status.default_name, rate = 10.0):
+    if os.name == 'nt':
+        os.system('')                           # Turns on ANSI escape codes in the Windows console
+    reader = connect(name)
+    sweeps = []
+    last_key = None
+    try:
+        while True:
+            status = reader.read()
+            if status is not None:
+                # A sweep has finished when the state leaves 'sweep' with a new last_accuracy
+                key = (status['run'], status['trial'], status['last_accuracy'])
+                if status['state'] != 'sweep' and not math.isnan(status['last_accuracy']) and key != last_key and status['trial'] > 0:
+                    sweeps.append((status['run'], status['trial'], status['direct'], status['stim_ms'], status['last_accuracy']))
+                    last_key = key
+                sys.stdout.write('\033[H\033[J' + format_status(status, sweeps) + '\n')
+                sys.stdout.flush()
+                if status['state'] == 'done':
+                    break
+            time.sleep(1 / rate)
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Live operator view of a running rsvp_sweep.py')
+    parser.add_argument('--name', default = psy_status.default_name, help = 'Shared memory block name')
+    parser.add_argument('--rate', type = float, default = 10.0, help = 'Redraws per second')
+    args = parser.parse_args()
+    run_console(args.name, args.rate)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# preprocess_bold.py
+#
+# Out-of-core preprocessing of RSVP_pRF runs for pRF fitting
+# 1. Load experiment parameters; Get the TR count from the timing table
+# 2. Open runs as memory-mapped inputs; Check volume counts and sweep direction order
+# 3. Detrend, z-score and average runs block by block
+#
+# Inputs are .npy arrays of shape (n_voxels, n_volumes), such as synth_bold.py writes.
+# Only one block of voxels from every run is in memory at a time, so peak memory depends on
+# --block and the number of runs, not on the size of the brain.
+#
+# Example:
+#   python preprocess_bold.py --params ../rsvp_params.txt --skip 4 --out ../Data/XX_avg.npy run1.npy run2.npy
+#   python preprocess_bold.py --summary run1_summary.csv run2_summary.csv --out ../Data/XX_avg.npy run1.npy run2.npy
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+
+# 1. Load experiment parameters; Get the TR count from the timing table
+# Volumes kept per run: every TR in get_timing.py's table, optionally without the lead-in TRs
+# before the first sweep is loaded (2 TRs, or 1 + ceil(9.5 / tr) with extended_start)
+def get_volume_window(params, skip = 0, drop_lead = False):
+    n_trs = rsvp_design.get_n_trs(params)
+    first = 0
+    if drop_lead:
+        first = rsvp_design.get_lead_trs(params)
+    return skip + first, skip + n_trs
+
+
+# 2. Open runs as memory-mapped inputs; Check volume counts and sweep direction order
+def open_runs(run_filenames, first, last):
+    runs = []
+    for run_filename in run_filenames:
+        run = np.load(run_filename, mmap_mode = 'r')
+        if run.ndim != 2:
+            raise Exception('Error: %s should be a (n_voxels, n_volumes) array' % run_filename)
+        if run.shape[1] < last:
+            raise Exception('Error: %s has %i volumes, but the timing table needs %i' % (run_filename, run.shape[1], last))
+        if len(runs) > 0 and run.shape[0] != runs[0].shape[0]:
+            raise Exception('Error: %s has %i voxels, expected %i' % (run_filename, run.shape[0], runs[0].shape[0]))
+        runs.append(run)
+    return runs
+
+# Sweep directions in the order they were run, from the Sweep_Direction column of a summary file
+def get_direction_order(summary_filename):
+    order = []
+    with open(summary_filename) as summary:
+        header = summary.readline().rstrip('\n').split(',')
+        col = header.index('Sweep_Direction')
+        for line in summary:
+            if not line.strip():
+                break
+            order.append(line.split(',')[col])
+    return order
+
+def check_direction_order(params, summary_filenames):
+    expected = [rsvp_design.types[x % 4] for x in list(range(0, params['n_trials']))]
+    for summary_filename in summary_filenames:
+        order = get_direction_order(summary_filename)
+        if order != expected:
+            raise Exception('Error: %s ran %s, which cannot be averaged with %s' % (summary_filename, order, expected))
+
+
+# 3. Detrend, z-score and average runs block by block
+# Polynomial detrending is a projection onto the residual space of a Legendre basis, shared by every voxel.
+# The basis includes a constant, so detrended data have zero mean and dividing by the SD z-scores them.
+def get_detrend_projector(n_vols, order):
+    t = np.linspace(-1, 1, n_vols)
+    basis = np.polynomial.legendre.legvander(t, order)
+    return np.eye(n_vols) - basis @ np.linalg.pinv(basis)
+
+def preprocess(runs, out_filename, first, last, order = 2, block = 20000):
+    n_voxels = runs[0].shape[0]
+    n_vols = last - first
+    projector = get_detrend_projector(n_vols, order).T
+    out = np.lib.format.open_memmap(out_filename, mode = 'w+', dtype = np.float32, shape = (n_voxels, n_vols))
+    t0 = time.time()
+    for start in list(range(0, n_voxels, block)):
+        stop = min(start + block, n_voxels)
+        total = np.zeros((stop - start, n_vols))
+        for run in runs:
+            data = np.asarray(run[start:stop, first:last], dtype = np.float64) @ projector
+            sd = data.std(axis = 1, keepdims = True)
+            sd[sd == 0] = 1
+            total += data / sd
+        out[start:stop] = total / len(runs)
+    out.flush()
+    print('Averaged %i runs of %i voxels x %i volumes into %s (%.2f s)' % (len(runs), n_voxels, n_vols, out_filename, time.time() - t0))
+    del out
+    return out_filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Detrend, z-score and average RSVP_pRF runs out of core')
+    parser.add_argument('runs', nargs = '+', help = '.npy runs of shape (n_voxels, n_volumes)')
+    parser.add_argument('--params', default = '../rsvp_params.txt', help = 'rsvp_params.txt used for the runs')
+    parser.add_argument('--summary', nargs = '*', default = [], help = 'Summary csv of each run, to check the sweep direction order')
+    parser.add_argument('--out', required = True, help = 'Output .npy file')
+    parser.add_argument('--skip', type = int, default = 0, help = 'Volumes acquired before the first MRI pulse the experiment waits for')
+    parser.add_argument('--drop-lead', action = 'store_true', help = 'Drop the lead-in TRs before the first sweep')
+    parser.add_argument('--order', type = int, default = 2, help = 'Polynomial detrending order')
+    parser.add_argument('--block', type = int, default = 20000, help = 'Voxels processed per block')
+    args = parser.parse_args()
+    params = rsvp_design.load_params(args.params)
+    if args.summary:
+        check_direction_order(params, args.summary)
+    first, last = get_volume_window(params, skip = args.skip, drop_lead = args.drop_lead)
+    runs = open_runs(args.runs, first, last)
+    preprocess(runs, args.out, first, last, order = args.order, block = args.block)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# pulse_generator.py
+#
+# Local stand-in for the scanner trigger, to check MRI pulse logging and pulse-locked drift correction without a scanner
+# 1. Simulated pulse keyboard: pulses at a given TR, clock drift and jitter, read like the iohub keyboard
+# 2. Keypress generator: type the pulse key at a given TR and jitter, for running rsvp_sweep.py itself
+# 3. Drift correction benchmark: psy_input.InputPump + psy_timing.PulseLog against the simulated scanner
+#
+# The scanner sends its TTL pulses through a button box that types pulse_cue. Its clock runs slightly fast or slow
+# against the display computer's (--drift, in parts per million) and each keypress reaches the computer with some
+# jitter (--jitter, SD in ms). The benchmark plans bar onsets on the display computer's TR grid, as rsvp_sweep.py
+# does, and reports how far they fall from the scanner's pulses with and without pulse locking.
+#
+# Example:
+#   python pulse_generator.py --duration 120 --tr 1.3 --drift 200 --jitter 2
+#   python pulse_generator.py --keyboard --tr 1.3 --jitter 2 --key 5      (needs pynput; focus the experiment window)
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+from collections import namedtuple
+import argparse
+import random
+import sys
+import time
+import numpy as np
+try:
+    from pynput.keyboard import Controller
+except ImportError:
+    Controller = None
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import psy_input
+import psy_timing
+
+clock = time.perf_counter
+
+
+# 1. Simulated pulse keyboard
+# getPresses() returns the pulses that have arrived since the last call, like io.devices.keyboard.
+# true_times holds when the scanner sent each pulse, before the keypress jitter.
+Press = namedtuple('Press', ['key', 'time'])
+
+class SimulatedPulseKeyboard(object):
+    def __init__(self, tr = 1.3, key = '5', drift = 0, jitter = 0.002, miss_rate = 0, seed = None):
+        self.tr = tr * (1 + drift * 1e-6)       # Scanner TR on the display computer's clock
+        self.key = key
+        self.jitter = jitter
+        self.miss_rate = miss_rate
+        self.random = random.Random(seed)
+        self.start = clock()
+        self.true_times = []
+        self.next_pulse = 0
+
+    def getPresses(self, keys = None):
+        presses = []
+        now = clock()
+        while self.start + self.next_pulse * self.tr <= now:
+            t = self.start + self.next_pulse * self.tr
+            self.true_times.append(t)
+            self.next_pulse += 1
+            if self.random.random() < self.miss_rate:
+                continue
+            presses.append(Press(self.key, t + abs(self.random.gauss(0, self.jitter))))
+        if keys is not None:
+            presses = [press for press in presses if press.key in keys]
+        return presses
+
+
+# 2. Keypress generator
+def run_keyboard(tr = 1.3, key = '5', jitter = 0.002, n_pulses = 0, seed = None):
+    if Controller is None:
+        raise Exception('Error: Typing pulse keys needs the pynput package')
+    keyboard = Controller()
+    rand = random.Random(seed)
+    start = clock()
+    k = 0
+    print('Sending %s every %.3f s; Ctrl+C to stop' % (key, tr))
+    while n_pulses == 0 or k < n_pulses:
+        time.sleep(max(0, start + k * tr + abs(rand.gauss(0, jitter)) - clock()))
+        keyboard.press(key)
+        keyboard.release(key)
+        k += 1
+
+
+# 3. Drift correction benchmark
+# A 60 Hz loop polls the input pump every frame, logs pulses and, every tr_per_bar TRs, plans the next bar onset
+# on the display computer's TR grid. With pulse locking the onset is moved by PulseLog.correction() as in sweep().
+def benchmark(duration = 120, tr = 1.3, tr_per_bar = 2, drift = 200, jitter = 0.002, miss_rate = 0.02, fps = 60, seed = 0):
+    keyboard = SimulatedPulseKeyboard(tr = tr, drift = drift, jitter = jitter, miss_rate = miss_rate, seed = seed)
+    input_pump = psy_input.InputPump('1', pulse_key = '5', iokeyboard = keyboard)
+    pulse_log = psy_timing.PulseLog(tr)
+    pulse_log.set_reference(keyboard.start)
+    bar_dur = tr_per_bar * tr
+    shift = 0
+    bar = 1
+    errors = {'free': [], 'locked': []}
+    corrections = []
+    next_flip = clock()
+    while bar * bar_dur <= duration:
+        input_pump.poll()
+        for pulse_time in input_pump.read(psy_input.PULSE):
+            pulse_log.add(pulse_time)
+        planned = keyboard.start + bar * bar_dur
+        # Plan the next bar one frame before it is due, as sweep() does on the last frame of a bar
+        if clock() >= planned + shift - 1 / fps:
+            correction = pulse_log.correction(planned + shift)
+            if correction is not None and abs(correction) <= tr / 4:
+                shift += correction
+                corrections.append(correction)
+            scanner = keyboard.start + bar * tr_per_bar * keyboard.tr
+            errors['free'].append(planned - scanner)
+            errors['locked'].append(planned + shift - scanner)
+            bar += 1
+        next_flip += 1 / fps
+        time.sleep(max(0, next_flip - clock()))
+    summary = pulse_log.summary()
+    print('Pulses logged: %i of %i, missed: %i' % (summary['n_pulses'], len(keyboard.true_times), summary['missed']))
+    print('Scanner clock drift: %.1f ppm measured, %.1f ppm simulated' % (summary['drift_ppm'], drift))
+    for name in ['free', 'locked']:
+        error = np.array(errors[name]) * 1000
+        print('Bar onset - scanner pulse (ms), %-6s: mean %7.3f, last %7.3f, max |%.3f|' % (name, error.mean(), error[-1], np.abs(error).max()))
+    print('Corrections applied: %i, mean %.3f ms' % (len(corrections), np.mean(corrections) * 1000 if corrections else 0))
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Simulate MRI pulses to check pulse logging and pulse-locked drift correction')
+    parser.add_argument('--duration', type = float, default = 120, help = 'Simulated run length in s')
+    parser.add_argument('--tr', type = float, default = 1.3)
+    parser.add_argument('--tr-per-bar', type = int, default = 2)
+    parser.add_argument('--drift', type = float, default = 200, help = 'Scanner clock rate error in ppm; exaggerated so it shows in a short run')
+    parser.add_argument('--jitter', type = float, default = 2, help = 'SD of the keypress delay in ms')
+    parser.add_argument('--miss-rate', type = float, default = 0.02, help = 'Fraction of pulses that never arrive')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--keyboard', action = 'store_true', help = 'Type the pulse key instead of running the benchmark')
+    parser.add_argument('--key', default = '5', help = 'Key typed with --keyboard, i.e. pulse_cue')
+    parser.add_argument('--pulses', type = int, default = 0, help = 'Pulses typed with --keyboard; 0 runs until stopped')
+    args = parser.parse_args()
+    if args.keyboard:
+        run_keyboard(args.tr, args.key, args.jitter / 1000, args.pulses, args.seed)
+    else:
+        benchmark(args.duration, args.tr, args.tr_per_bar, args.drift, args.jitter / 1000, args.miss_rate, seed = args.seed)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# recover_journal.py
+#
+# Rebuild the summary and stimlog csv files of a run from its journal (save_journal in rsvp_params.txt)
+# 1. Read the journal up to the last intact record
+# 2. Rebuild the summary: sweep rows, then the parameter block
+# 3. Rebuild the stimlog
+#
+# A run that finished has an END record and its summary is rebuilt exactly as written. For a run that died,
+# the parameter block is rebuilt from the parameters journaled at the start of the run, with trial_onset and
+# trial_dur from the sweeps that finished, and a recovered line saying how the journal ended.
+#
+# Example:
+#   python recover_journal.py ../Data/XX_run1_10-19-2026_hr10_min00_sec00_rsvp_sweep_summary.journal
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import sys
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import psy_journal
+
+
+# 1. Read the journal
+def load(journal_filename):
+    records, clean = psy_journal.read_journal(journal_filename)
+    kinds = [kind for (kind, text) in records]
+    finished = psy_journal.END in kinds
+    print('%s: %i records, %s' % (journal_filename, len(records), 'finished run' if finished else 'run did not finish'))
+    if not clean:
+        print('  The last record was incomplete or damaged and was dropped')
+    return records, clean, finished
+
+
+# 2. Rebuild the summary
+def rebuild_summary(records, clean, finished):
+    text = ''.join([text for (kind, text) in records if kind == psy_journal.SUMMARY])
+    if finished:
+        return text
+    params = [text for (kind, text) in records if kind == psy_journal.PARAMS]
+    trials = [text.split(',') for (kind, text) in records if kind == psy_journal.TRIAL]
+    text += '\n\n\n'
+    if params:
+        text += params[-1]
+    text += 'trial_onset,' + str([float(onset) for (onset, dur) in trials]) + '\n'
+    text += 'trial_dur,' + str([float(dur) for (onset, dur) in trials]) + '\n'
+    text += 'recovered,' + ('run stopped after %i sweeps' % len(trials)) + ('' if clean else '; damaged last record dropped') + '\n'
+    return text
+
+
+# 3. Rebuild the stimlog
+def rebuild_stimlog(records):
+    return ''.join([text for (kind, text) in records if kind == psy_journal.STIMLOG])
+
+def recover(journal_filename, out_prefix = None):
+    records, clean, finished = load(journal_filename)
+    if out_prefix is None:
+        out_prefix = journal_filename[0:journal_filename.rfind('.')] + '_recovered'
+    with open(out_prefix + '.csv', 'w') as summary:
+        summary.write(rebuild_summary(records, clean, finished))
+    print('  Wrote %s.csv' % out_prefix)
+    stimlog = rebuild_stimlog(records)
+    if stimlog:
+        with open(out_prefix + '_stimlog.csv', 'w') as stim_log:
+            stim_log.write(stimlog)
+        print('  Wrote %s_stimlog.csv (%i sets)' % (out_prefix, stimlog.count('\n') - 1))
+    return finished
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Rebuild summary and stimlog csv files from run journals')
+    parser.add_argument('journals', nargs = '+', help = '<summary>.journal files written with save_journal')
+    parser.add_argument('--out', default = None, help = 'Output prefix; defaults to <summary>_recovered. Only with one journal')
+    args = parser.parse_args()
+    if args.out is not None and len(args.journals) > 1:
+        raise Exception('Error: --out can only be used with one journal')
+    for journal_filename in args.journals:
+        recover(journal_filename, args.out)
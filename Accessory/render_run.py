@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+#
+# render_run.py
+#
+# Render what the participant saw during a run of rsvp_sweep.py, offscreen and without psychopy, for QA
+# 1. Load the run: set onsets, durations, images and positions from a recorded stimlog or a seeded plan
+# 2. Frame states: which set, checkerboard phase, bore masks and feedback colour are on screen at each refresh
+# 3. Frame renderer: composite images or checkerboard bars, bore masks and fixation on the background with numpy
+# 4. Render chunks of the run in a process pool
+# 5. Join the chunks into a video (with ffmpeg) or keep them as a compressed frame archive
+#
+# Frames repeat for as long as a set is shown, so each chunk renders every distinct frame once and reuses it.
+# With ffmpeg on the PATH, an output ending in .mp4, .mkv or .avi is encoded in segments (one per chunk) that
+# are joined without re-encoding. Any other output is a folder of frame archives, chunk_<n>.npz, each holding
+# the distinct frames of the chunk, the frame -> distinct frame index and the number of its first frame;
+# read_archive() yields the frames of a whole archive in order.
+#
+# Feedback is shown at the onset of the last target set plus each RT in the stimlog (rsvp_sweep.py times RTs
+# from about that onset) for feedback_frames refreshes. A seeded plan draws images and targets like sweep()
+# but has no responses, so no feedback.
+#
+# With stim_mode = checkerboard the bar is drawn as the contrast-reversing checkerboard of rsvp_sweep.py, phase
+# counted in frames from the sweep onset, and only the target image is pasted on it; slots without an image are -1.
+#
+# Example:
+#   python render_run.py --params ../rsvp_params.txt --stimlog ../Data/XX_run1_..._stimlog.csv --out ../Data/XX_run1.mp4
+#   python render_run.py --params ../rsvp_params.txt --seed 3 --dur-idx 2 --scale 0.25 --out ../Data/plan_frames
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+from PIL import Image
+import argparse
+import glob
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+video_formats = ['.mp4', '.mkv', '.avi']
+
+
+# 1. Load the run
+# Returns a dict of set arrays (onset, dur, img (n, 6), x (n, 6), y (n, 6), trial, bar, sweep_onset), bar intervals
+# (bar_onset, bar_num) and feedback onsets, all in seconds from the start of the run
+# Image number -1 is a slot without an image (checkerboard runs)
+def load_stimlog(params, stimlog):
+    sets = rsvp_design.read_stimlog(stimlog)
+    onset = sets['imageOnset']
+    img = sets['img']
+    if params['stim_mode'] == 'checkerboard':
+        img = np.where(img == sets['targ_img'][:, None], img, -1)         # Stimlogs from before the -1 slots logged distractors
+    n = len(onset)
+    same_bar = (sets['barOnset'][1:] == sets['barOnset'][:-1]) & (sets['trial'][1:] == sets['trial'][:-1])
+    interval = np.diff(onset)
+    typical = np.median(interval[same_bar]) if same_bar.any() else params['tr']
+    dur = np.full(n, typical)
+    # Sets last stim_dur; the staircase changes it between sweeps, so take it per sweep from the set intervals
+    for trial in np.unique(sets['trial']):
+        in_trial = (sets['trial'][:-1] == trial) & same_bar
+        if in_trial.any():
+            dur[sets['trial'] == trial] = np.median(interval[in_trial])
+    bar = np.ones(n, dtype = int)
+    for s in list(range(1, n)):
+        if sets['trial'][s] == sets['trial'][s - 1]:
+            bar[s] = bar[s - 1] + (sets['barOnset'][s] != sets['barOnset'][s - 1])
+    feedback = []
+    last_targ = None
+    for s in list(range(0, n)):
+        if s > 0 and sets['trial'][s] != sets['trial'][s - 1]:
+            last_targ = None
+        if sets['targ_here'][s]:
+            last_targ = onset[s]
+        for rt in sets['RT'][s].split(','):
+            try:
+                feedback.append((onset[s] if last_targ is None else last_targ) + float(rt))
+            except ValueError:
+                pass
+    first = np.concatenate([[True], (sets['barOnset'][1:] != sets['barOnset'][:-1]) | (sets['trial'][1:] != sets['trial'][:-1])]) if n else np.zeros(0, dtype = bool)
+    return {'onset': onset, 'dur': dur, 'img': img, 'x': sets['x'], 'y': sets['y'], 'trial': sets['trial'], 'bar': bar,
+            'sweep_onset': get_sweep_onsets(sets['trial'], sets['barOnset']),
+            'bar_onset': sets['barOnset'][first], 'bar_num': bar[first], 'feedback': np.array(feedback)}
+
+# Onset of the first bar of each set's sweep
+def get_sweep_onsets(trial, bar_onset):
+    trials, first = np.unique(trial, return_index = True)
+    return bar_onset[first][np.searchsorted(trials, trial)]
+
+# Nominal set plan with images drawn as in sweep(): six distinct images not in the previous set, and the target
+# in a random slot with a 1 / targ_rate chance once targ_cooldown has passed (slots 1-4 on bore-masked bars).
+# Checkerboard sets keep only the target.
+def load_plan(params, n_images, dur_idx = 0, seed = 0, bore_mask = False):
+    plan = rsvp_design.get_set_plan(params, dur_idx)
+    rng = np.random.default_rng(seed)
+    targets = params['constrained_set'] if params['constrained_set'] else list(range(0, n_images))
+    targ = int(rng.choice(targets))
+    img = np.zeros(plan['img'].shape, dtype = int)
+    last_set = []
+    last_targ = -np.inf
+    for s in list(range(0, len(img))):
+        if s > 0 and plan['trial'][s] != plan['trial'][s - 1]:
+            last_set = []
+            last_targ = -np.inf
+        candidates = np.setdiff1d(np.arange(n_images), last_set + [targ])
+        img[s] = rng.choice(candidates, 6, replace = False)
+        if plan['t'][s] - last_targ > params['targ_cooldown'] and rng.integers(1, params['targ_rate'] + 1) == 1:
+            masked = bore_mask and plan['bar'][s] in [1, params['n_bars']]
+            img[s, rng.integers(1, 5) if masked else rng.integers(0, 6)] = targ
+            last_targ = plan['t'][s]
+        last_set = list(img[s])
+    if params['stim_mode'] == 'checkerboard':
+        img = np.where(img == targ, img, -1)
+    first = np.concatenate([[True], plan['barOnset'][1:] != plan['barOnset'][:-1]])
+    return {'onset': plan['imageOnset'], 'dur': plan['stim_dur'], 'img': img, 'x': plan['x'], 'y': plan['y'],
+            'trial': plan['trial'], 'bar': plan['bar'], 'sweep_onset': get_sweep_onsets(plan['trial'], plan['barOnset']),
+            'bar_onset': plan['barOnset'][first], 'bar_num': plan['bar'][first], 'feedback': np.zeros(0)}
+
+
+# 2. Frame states
+# State of frame k (shown from k / fps): 8 * (set + 1) + 4 * checkerboard phase + 2 * bore masks + feedback,
+# with set -1 between sets; the phase is always 0 outside checkerboard mode
+def get_frame_states(run, params, fps, bore_mask = False, feedback_frames = None):
+    bar_dur = params['tr_per_bar'] * params['tr']
+    if len(run['onset']):
+        end = max(run['onset'][-1] + run['dur'][-1], run['bar_onset'][-1] + bar_dur)
+    else:
+        end = 0
+    n_frames = int(math.ceil((end + rsvp_design.end_blank) * fps))
+    t = np.arange(n_frames) / fps
+    row = np.searchsorted(run['onset'], t, side = 'right') - 1
+    visible = (row >= 0) & (t < run['onset'][np.maximum(row, 0)] + run['dur'][np.maximum(row, 0)]) if len(run['onset']) else np.zeros(n_frames, dtype = bool)
+    row = np.where(visible, row, -1)
+    phase = np.zeros(n_frames, dtype = int)
+    if params['stim_mode'] == 'checkerboard' and len(run['onset']):
+        reversal_frames = rsvp_design.get_reversal_frames(fps, params['checker_hz'])
+        sweep_frame = np.floor((t - run['sweep_onset'][np.maximum(row, 0)]) * fps + 1e-6).astype(int)
+        phase = np.where(visible, (sweep_frame // reversal_frames) % 2, 0)
+    masked = np.zeros(n_frames, dtype = bool)
+    if bore_mask:
+        for onset, num in zip(run['bar_onset'], run['bar_num']):
+            if num == 1 or num == params['n_bars']:
+                masked |= (t >= onset) & (t < onset + bar_dur)
+    if feedback_frames is None:
+        feedback_frames = int(round(params['feedback_frames'] * fps / 60))
+    feedback = np.zeros(n_frames, dtype = bool)
+    if params['show_feedback']:
+        for onset in run['feedback']:
+            first = int(math.ceil(onset * fps))
+            feedback[max(first, 0):max(first + feedback_frames, 0)] = True
+    return 8 * (row + 1) + 4 * phase + 2 * masked + feedback
+
+
+# 3. Frame renderer
+# Psychopy rgb (-1 to 1) to 0-255
+def to_rgb255(color):
+    return np.array([int((c + 1) * 127.5) for c in color], dtype = np.float32)
+
+# Coverage of a shape on a size x size sprite, from inside(x, y) at ss x ss points per pixel; x, y in units of size, centred
+def get_coverage(size, inside, ss = 4):
+    coords = (np.arange(size * ss) + 0.5) / (size * ss) - 0.5
+    cover = inside(coords[None, :], coords[:, None]).astype(np.float32)
+    return cover.reshape(size, ss, size, ss).mean(axis = (1, 3))
+
+# Paste an (h, w, 3) patch, or blend an (h, w) alpha of one colour, into frame centred at pixel (cx, cy), clipped to the frame
+def paste(frame, patch, cx, cy, color = None):
+    h, w = patch.shape[0:2]
+    top = int(round(cy - h / 2))
+    left = int(round(cx - w / 2))
+    t0, l0 = max(0, -top), max(0, -left)
+    t1, l1 = min(h, frame.shape[0] - top), min(w, frame.shape[1] - left)
+    if t1 <= t0 or l1 <= l0:
+        return
+    region = frame[top + t0:top + t1, left + l0:left + l1]
+    if color is None:
+        region[...] = patch[t0:t1, l0:l1]
+    else:
+        alpha = patch[t0:t1, l0:l1, None]
+        region[...] = region * (1 - alpha) + color * alpha
+
+class FrameRenderer(object):
+    def __init__(self, params, image_fns, scale = 1.0):
+        self.params = params
+        self.image_fns = image_fns
+        self.scale = scale
+        self.width = int(round(params['screen_res'][0] * scale))
+        self.height = int(round(params['screen_res'][1] * scale))
+        self.image_px = max(1, int(round(params['image_h'] * scale)))
+        self.color = to_rgb255(params['background_color'])
+        self.fix_color = to_rgb255(params['fix_color'])
+        self.images = {}
+        # Fixation circle, cross (arms 0.2 wide, as psychopy's 'cross' vertices) and dot, drawn in that order
+        fix_px = max(1, int(round(params['image_h'] * params['fix_size'] / 100 * scale)))
+        self.circle = get_coverage(fix_px, lambda x, y: x ** 2 + y ** 2 <= 0.25)
+        self.cross = get_coverage(fix_px, lambda x, y: ((np.abs(x) <= 0.1) & (np.abs(y) <= 0.5)) | ((np.abs(y) <= 0.1) & (np.abs(x) <= 0.5)))
+        self.dot = get_coverage(fix_px, lambda x, y: x ** 2 + y ** 2 <= 0.25 / 16)
+        pos = rsvp_design.get_positions(params)
+        self.mask_pos = [self.to_pixels(pos['l_marg'], pos['t_marg']), self.to_pixels(pos['r_marg'], pos['t_marg'])]
+        self.mask = np.zeros((self.image_px, self.image_px, 3), dtype = np.float32) + self.color
+        # Checkerboard bars per orientation and phase; psychopy textures run bottom-up, frames top-down
+        self.checker = {}
+        if params['stim_mode'] == 'checkerboard':
+            bank = (rsvp_design.get_checker_bank(self.image_px, params['checker_count']) + 1) * 127.5
+            self.checker['V'] = [np.repeat(np.flipud(tex)[:, :, None], 3, axis = 2) for tex in bank]
+            self.checker['H'] = [np.repeat(np.flipud(tex.T)[:, :, None], 3, axis = 2) for tex in bank]
+
+    # Window pixel (column, row) of a position in psychopy pix units
+    def to_pixels(self, x, y):
+        return (self.width / 2 + x * self.scale, self.height / 2 - y * self.scale)
+
+    def get_image(self, idx):
+        if idx not in self.images:
+            image = Image.open(self.image_fns[idx]).convert('RGB')
+            if image.size != (self.image_px, self.image_px):
+                image = image.resize((self.image_px, self.image_px), Image.LANCZOS)
+            self.images[idx] = np.asarray(image, dtype = np.float32)
+        return self.images[idx]
+
+    def render(self, state, run):
+        row = state // 8 - 1
+        frame = np.empty((self.height, self.width, 3), dtype = np.float32)
+        frame[...] = self.color
+        if row >= 0:
+            if self.checker:
+                bar = self.checker['V' if np.ptp(run['x'][row]) == 0 else 'H'][(state // 4) % 2]      # Vertical bars for L2R and R2L
+                cx, cy = self.to_pixels(run['x'][row].mean(), run['y'][row].mean())
+                paste(frame, bar, cx, cy)
+            for slot in list(range(0, 6)):
+                if run['img'][row, slot] < 0:
+                    continue
+                cx, cy = self.to_pixels(run['x'][row, slot], run['y'][row, slot])
+                paste(frame, self.get_image(run['img'][row, slot]), cx, cy)
+        if state & 2:
+            for cx, cy in self.mask_pos:
+                paste(frame, self.mask, cx, cy)
+        cx, cy = self.to_pixels(0, 0)
+        paste(frame, self.circle, cx, cy, np.array([0, 128, 0], dtype = np.float32) if state & 1 else self.fix_color)
+        paste(frame, self.cross, cx, cy, self.color)
+        paste(frame, self.dot, cx, cy, self.fix_color)
+        return np.round(frame).astype(np.uint8)
+
+
+# 4. Render chunks of the run in a process pool
+# Each worker process keeps one renderer and its decoded images
+worker = {}
+
+def init_worker(params, image_fns, scale, run):
+    worker['renderer'] = FrameRenderer(params, image_fns, scale)
+    worker['run'] = run
+
+def render_chunk(job):
+    chunk, first, states, out, fps, video = job
+    renderer = worker['renderer']
+    distinct = {}
+    if video:
+        segment = '%s_chunk_%04i%s' % (out[0:out.rfind('.')], chunk, out[out.rfind('.'):])
+        encoder = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                                    '-s', '%ix%i' % (renderer.width, renderer.height), '-r', str(fps), '-i', '-',
+                                    '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p', segment],
+                                   stdin = subprocess.PIPE)
+        for state in states:
+            if state not in distinct:
+                distinct[state] = renderer.render(state, worker['run']).tobytes()
+            encoder.stdin.write(distinct[state])
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise Exception('Error: ffmpeg failed on chunk %i' % chunk)
+        return segment, len(distinct)
+    order = {}
+    for state in states:
+        if state not in order:
+            order[state] = len(order)
+    frames = np.stack([renderer.render(state, worker['run']) for state in order])
+    segment = os.path.join(out, 'chunk_%04i.npz' % chunk)
+    np.savez_compressed(segment, frames = frames, index = np.array([order[state] for state in states], dtype = np.int32),
+                        first = first, fps = fps)
+    return segment, len(order)
+
+def render(params, run, image_fns, out, fps, scale = 0.5, bore_mask = False, workers = None, chunk_dur = 10.0):
+    t0 = time.time()
+    states = get_frame_states(run, params, fps, bore_mask = bore_mask)
+    video = os.path.splitext(out)[1].lower() in video_formats
+    if video and shutil.which('ffmpeg') is None:
+        raise Exception('Error: Writing %s needs ffmpeg on the PATH; give a folder name to write a frame archive instead' % out)
+    if not video and not os.path.isdir(out):
+        os.makedirs(out)
+    chunk_frames = max(1, int(round(chunk_dur * fps)))
+    jobs = [(c, first, states[first:first + chunk_frames], out, fps, video)
+            for c, first in enumerate(list(range(0, len(states), chunk_frames)))]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = multiprocessing.Pool(workers, initializer = init_worker, initargs = (params, image_fns, scale, run))
+    try:
+        results = pool.map(render_chunk, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+    if video:
+        list_filename = out + '.segments.txt'
+        with open(list_filename, 'w') as segments:
+            for segment, n_distinct in results:
+                segments.write("file '%s'\n" % abspath(segment))
+        joined = subprocess.call(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_filename, '-c', 'copy', out])
+        if joined != 0:
+            raise Exception('Error: ffmpeg could not join the segments listed in %s' % list_filename)
+        for segment, n_distinct in results:
+            os.remove(segment)
+        os.remove(list_filename)
+    elapsed = time.time() - t0
+    run_dur = len(states) / fps
+    print('Rendered %i frames (%i distinct) of %.1f s at %ix%i to %s' % (len(states), sum([n for (segment, n) in results]), run_dur,
+          int(round(params['screen_res'][0] * scale)), int(round(params['screen_res'][1] * scale)), out))
+    print('  %.1f s with %i workers, %.1f%% of the run duration' % (elapsed, workers, 100 * elapsed / max(run_dur, 1e-9)))
+    return out
+
+
+# 5. Frame archives
+# Yields the frames of a frame archive folder in order
+def read_archive(archive):
+    for segment in sorted(glob.glob(os.path.join(archive, 'chunk_*.npz'))):
+        data = np.load(segment)
+        frames = data['frames']
+        for idx in data['index']:
+            yield frames[idx]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Render a run of rsvp_sweep.py offscreen to a video or frame archive')
+    parser.add_argument('--params', default = '../rsvp_params.txt', help = 'rsvp_params.txt used for the run')
+    parser.add_argument('--stimlog', default = None, help = 'Recorded stimlog to render; without it a seeded plan is rendered')
+    parser.add_argument('--stimuli', default = '../Stimuli', help = 'Stimuli folder used for the run')
+    parser.add_argument('--dur-idx', type = int, default = 0, help = 'Stimulus duration index for a seeded plan')
+    parser.add_argument('--seed', type = int, default = 0, help = 'Seed for the images and targets of a seeded plan')
+    parser.add_argument('--fps', type = float, default = None, help = 'Frames per second; defaults to refresh_rate')
+    parser.add_argument('--scale', type = float, default = 0.5, help = 'Output size relative to screen_res')
+    parser.add_argument('--no-bore-mask', action = 'store_true', help = 'Do not draw bore masks (behavioral runs never show them)')
+    parser.add_argument('--workers', type = int, default = None, help = 'Worker processes; defaults to the number of CPUs')
+    parser.add_argument('--chunk', type = float, default = 10.0, help = 'Seconds of the run rendered per job')
+    parser.add_argument('--out', required = True, help = 'Video file (.mp4, .mkv, .avi; needs ffmpeg) or frame archive folder')
+    args = parser.parse_args()
+    params = rsvp_design.load_params(args.params)
+    fps = args.fps if args.fps is not None else params.get('refresh_rate', 60)
+    image_fns = glob.glob(os.path.join(args.stimuli, '*.jpg'))          # Same order as rsvp_sweep.py loads them
+    if len(image_fns) == 0:
+        raise Exception('Error: There are no stimuli in %s' % args.stimuli)
+    bore_mask = params['bore_mask'] and not args.no_bore_mask
+    if args.stimlog is None:
+        run = load_plan(params, len(image_fns), dur_idx = args.dur_idx, seed = args.seed, bore_mask = bore_mask)
+    else:
+        run = load_stimlog(params, args.stimlog)
+    render(params, run, image_fns, args.out, fps, scale = args.scale, bore_mask = bore_mask, workers = args.workers, chunk_dur = args.chunk)
@@ -2,15 +2,17 @@
 
 # rsvp_stim_prep.py
 # /share/home/jeff/docs/imagery_docs/experiments/rsvp/
-# 
+#
 # Prepare stimuli for rsvp_sweep experiment
 # 1. Make stimuli directory if it doesn't exist
 # 2. Check for unprocessed stimuli directory
-# 3. Generate new_image template images for resizing
-# 4. Load all unprocessed images; Resize/reshape all images
+# 3. Load all unprocessed images; Composite them onto the background colour in batches
+# 4. Resize each batch to 200x200 and to the exact display sizes; Build a mip chain for each display size
+# 5. Equalize luminance across the library (optional): mean and RMS contrast, or luminance histograms
+# 6. Save all sizes
 
 # Created: 3/2/20
-# Updated: 3/2/20
+# Updated: 10/19/26
 # Jeff Kravitz
 # >------------------------------------------------------------<
 
@@ -21,18 +23,44 @@
 #       - stimuli that is no larger than 800x800 pix, and no smaller than 100x100 pix
 #       - stimuli that are pngs
 # - All images are reshaped into square .jpg files
+# - Stimuli/*.jpg are 200x200 as before. Stimuli/px<size>/*.jpg hold the same images at the exact pixel size
+#   rsvp_sweep.py shows them at (stim_bounds[1] / 6) for the stim_bounds in rsvp_params.txt and in extra_stim_bounds,
+#   and each of those halved down to min_mip_size (the mip chain). rsvp_sweep.py loads the folder that matches
+#   its stim_bounds, so images are not rescaled on every frame. Copy the whole Stimuli folder next to rsvp_sweep.py.
+# - Images are resized with a Lanczos-3 filter applied to a whole batch at once as two matrix products
+# - equalize = 'moments' gives every image the same alpha-weighted mean luminance and RMS contrast, 'histogram' the
+#   same luminance histogram (the library average), in the object pixels only: alpha weights every statistic, and
+#   the background colour is composited after. Each image's statistics come from one pass over the library in
+#   chunks on `workers` threads; they and the mapping for each image are cached in Stimuli/equalization.npz and
+#   reused while the source files, the method and the targets are unchanged. The mapping is applied to R, G and B
+#   alike, so hue is kept; pixels pushed past 0 or 255 are clipped, and the spread left after that is printed.
 
 
 # 0. Load modules
 from inspect import getsourcefile
-from os.path import abspath
+from os.path import abspath, dirname
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os.path
 import glob
+import sys
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import psy_utility as psyut
 
 
 # 0. Set parameters
 background_color = 'grey'   # Options: grey, white, black
+extra_stim_bounds = []      # Other stim_bounds heights (pix) to prepare exact sizes for, e.g. [720, 1080]
+min_mip_size = 16           # Smallest image in each mip chain
+batch_size = 32             # Images composited and resized at once
+equalize = 'none'           # Options: none, moments (mean luminance and RMS contrast), histogram (luminance histogram)
+target_mean = None          # Mean luminance (0-255) for moments; None for the library average
+target_rms = None           # RMS contrast (SD of luminance, 0-255) for moments; None for the library average
+workers = os.cpu_count()    # Threads loading and processing chunks of the library
+
 
 # 1. Make stimuli directory if it doesn't exist
 path = abspath(getsourcefile(lambda:0))
@@ -50,70 +78,213 @@ if not os.path.isdir(unproc_stimuli_path):
     raise Exception('There is no folder containing stimuli to process... \
                     please copy your stimuli folder to {}'.format(path))
 
+# Output sizes: 200 px, the exact size for each stim_bounds, and their mip chains
+params = psyut.get_params(params_filename = path + '../rsvp_params.txt')
+stim_heights = [int(params['stim_bounds'][1])] + extra_stim_bounds
+exact_sizes = sorted(set([int(round(h / 6)) for h in stim_heights]))
+sizes = set([200])
+for size in exact_sizes:
+    while size >= min_mip_size:
+        sizes.add(size)
+        size = size // 2
+sizes = sorted(sizes, reverse = True)
+print('Exact sizes: %s; All sizes: %s' % (exact_sizes, sizes))
+for size in sizes:
+    if not os.path.isdir(stimuli_path + '/px' + str(size)):
+        os.mkdir(stimuli_path + '/px' + str(size))
 
-# 3. Generate blank new_image template images for resizing/reshaping
+
+# 3. Load all unprocessed images; Composite them onto the background colour in batches
 if background_color == 'grey':
     color = (127,127,127)
 elif background_color == 'white':
     color = (255,255,255)
 elif background_color == 'black':
     color = (0,0,0)
-blank_200 = Image.new('RGBA', (200, 200), color)
-blank_300 = Image.new('RGBA', (300, 300), color)
-blank_400 = Image.new('RGBA', (400, 400), color)
-blank_500 = Image.new('RGBA', (500, 500), color)
-blank_600 = Image.new('RGBA', (600, 600), color)
-blank_700 = Image.new('RGBA', (700, 700), color)
-blank_800 = Image.new('RGBA', (800, 800), color)
 
+# Square canvas each image is centred on: the next 100 px step above its larger side, from 200 to 800
+def get_canvas_size(image_size):
+    for canvas in [200, 300, 400, 500, 600, 700]:
+        if image_size[0] <= canvas and image_size[1] <= canvas:
+            return canvas
+    return 800
+
+# Centre RGBA images on transparent canvas x canvas arrays (cropping anything larger)
+def place(images, canvas):
+    batch = np.zeros((len(images), canvas, canvas, 4), dtype = np.float32)
+    for n, image in enumerate(images):
+        data = np.asarray(image.convert('RGBA'), dtype = np.float32)
+        h, w = data.shape[0:2]
+        top = int(round((canvas - h) / 2))
+        left = int(round((canvas - w) / 2))
+        src_top, src_left = max(0, -top), max(0, -left)
+        dst_top, dst_left = max(0, top), max(0, left)
+        rows = min(h - src_top, canvas - dst_top)
+        cols = min(w - src_left, canvas - dst_left)
+        batch[n, dst_top:dst_top + rows, dst_left:dst_left + cols] = data[src_top:src_top + rows, src_left:src_left + cols]
+    return batch
+
+# Alpha-blend a placed batch onto the background colour
+def composite(batch):
+    alpha = batch[..., 3:4] / 255
+    return batch[..., 0:3] * alpha + np.array(color, dtype = np.float32) * (1 - alpha)
+
+
+# 4. Resize each batch; Build mip chains
+# Rows of the matrix hold Lanczos-3 weights from n_in input pixels to each of n_out output pixels
+def lanczos_matrix(n_in, n_out, a = 3):
+    scale = n_in / n_out
+    stretch = max(scale, 1)
+    centers = (np.arange(n_out) + 0.5) * scale - 0.5
+    x = (np.arange(n_in)[None, :] - centers[:, None]) / stretch
+    weights = np.where(np.abs(x) < a, np.sinc(x) * np.sinc(x / a), 0)
+    return (weights / weights.sum(axis = 1, keepdims = True)).astype(np.float32)
+
+def resize(batch, size):
+    weights = lanczos_matrix(batch.shape[1], size)
+    return np.einsum('ij,njkc,lk->nilc', weights, batch, weights, optimize = True)
+
+# Halve with a 2x2 box filter
+def halve(batch):
+    half = batch.shape[1] // 2
+    return batch[:, 0:half * 2, 0:half * 2].reshape(len(batch), half, 2, half, 2, 3).mean(axis = (2, 4))
+
+def make_sizes(batch):
+    out = {200: resize(batch, 200)}
+    for size in exact_sizes:
+        level = resize(batch, size)
+        while level.shape[1] >= min_mip_size:
+            out[level.shape[1]] = level
+            level = halve(level)
+    return out
+
+
+# 5. Equalize luminance
+lum_weights = np.array([0.299, 0.587, 0.114], dtype = np.float32)      # As PIL's convert('L')
+
+# Alpha-weighted mean and SD of luminance, and the 256-bin luminance histogram, of every image in a placed batch
+def get_stats(batch):
+    lum = batch[..., 0:3] @ lum_weights
+    weight = batch[..., 3] / 255
+    total = weight.sum(axis = (1, 2))
+    mean = (weight * lum).sum(axis = (1, 2)) / total
+    rms = np.sqrt((weight * (lum - mean[:, None, None]) ** 2).sum(axis = (1, 2)) / total)
+    bins = np.clip(np.round(lum), 0, 255).astype(int) + 256 * np.arange(len(batch))[:, None, None]
+    hist = np.bincount(bins.ravel(), weights = weight.ravel(), minlength = 256 * len(batch)).reshape(len(batch), 256)
+    return mean, rms, hist / total[:, None]
+
+# Mapping for each image: gain and offset of its luminance (moments), or a 256-entry lookup table (histogram)
+def get_mapping(method, mean, rms, hist):
+    if method == 'moments':
+        t_mean = mean.mean() if target_mean is None else target_mean
+        t_rms = rms.mean() if target_rms is None else target_rms
+        gain = t_rms / np.maximum(rms, 1e-6)
+        return np.stack([gain, t_mean - gain * mean], axis = 1)
+    target = np.cumsum(hist.mean(axis = 0)) - hist.mean(axis = 0) / 2         # Mid-bin cumulative histograms
+    cum = np.cumsum(hist, axis = 1) - hist / 2
+    return np.stack([np.interp(c, target, np.arange(256)) for c in cum])
 
-# 4. Load all unprocessed images; Resize/reshape all images
-all_images = glob.glob(unproc_stimuli_path + '/*')
+# Apply each image's mapping to R, G and B by the change it makes to luminance
+def apply_mapping(method, batch, mapping):
+    rgb = batch[..., 0:3]
+    lum = rgb @ lum_weights
+    if method == 'moments':
+        new_lum = mapping[:, 0, None, None] * lum + mapping[:, 1, None, None]
+    else:
+        low = np.clip(np.floor(lum), 0, 254).astype(int)
+        frac = lum - low
+        rows = np.arange(len(batch))[:, None, None]
+        new_lum = mapping[rows, low] * (1 - frac) + mapping[rows, low + 1] * frac
+    batch[..., 0:3] = np.clip(rgb + (new_lum - lum)[..., None], 0, 255)
+    return batch
+
+# Source file signatures the cache is checked against
+def get_signature(filename):
+    info = os.stat(filename)
+    return '%s:%i:%i' % (os.path.basename(filename), info.st_size, int(info.st_mtime))
+
+def load_equalization(cache_fn, signatures):
+    if not os.path.isfile(cache_fn):
+        return None
+    cache = np.load(cache_fn)
+    settings = np.array([np.nan if target_mean is None else target_mean, np.nan if target_rms is None else target_rms])
+    if (str(cache['method']) != equalize or list(cache['signatures']) != signatures or
+            not np.array_equal(cache['targets'], settings, equal_nan = True)):
+        return None
+    return {key: cache[key] for key in ['mean', 'rms', 'hist', 'mapping']}
+
+def save_equalization(cache_fn, signatures, equalization):
+    settings = np.array([np.nan if target_mean is None else target_mean, np.nan if target_rms is None else target_rms])
+    np.savez(cache_fn, method = equalize, signatures = np.array(signatures), targets = settings, **equalization)
+
+def print_spread(label, mean, rms):
+    print('%s mean luminance %.1f-%.1f (SD %.2f), RMS contrast %.1f-%.1f (SD %.2f)'
+          % (label, mean.min(), mean.max(), mean.std(), rms.min(), rms.max(), rms.std()))
+
+
+# 6. Save all sizes
+# Quality 85, or 50 for images over 8000 bytes per 200x200 px at 85 (as the second pass of the old script)
+def save(data, filename):
+    image = Image.fromarray(np.clip(np.round(data), 0, 255).astype(np.uint8), 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', optimize = True, quality = 85)
+    if buffer.tell() > 8000 * (data.shape[0] / 200) ** 2:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', optimize = True, quality = 50)
+    with open(filename, 'wb') as out:
+        out.write(buffer.getvalue())
+
+if equalize not in ['none', 'moments', 'histogram']:
+    raise Exception('Error: equalize must be none, moments or histogram')
+all_images = sorted(glob.glob(unproc_stimuli_path + '/*'))
+groups = {}
 for image in all_images:
     sep_loc = image.rfind('/')
     image_filename = image[sep_loc + 1:-4]
     old_image = Image.open(image)
-    if old_image.size[0] > 700 or old_image.size[1] > 700:
-        new_image = blank_800.copy()
-    elif old_image.size[0] > 600 or old_image.size[1] > 600:
-        new_image = blank_700.copy() 
-    elif old_image.size[0] > 500 or old_image.size[1] > 500:
-        new_image = blank_600.copy()
-    elif old_image.size[0] > 400 or old_image.size[1] > 400:
-        new_image = blank_500.copy()
-    elif old_image.size[0] > 300 or old_image.size[1] > 300:
-        new_image = blank_400.copy()
-    elif old_image.size[0] > 200 or old_image.size[1] > 200:
-        new_image = blank_300.copy()
+    groups.setdefault(get_canvas_size(old_image.size), []).append((image_filename, old_image))
+# Chunks of at most batch_size images of the same canvas size, with each image's row in the library arrays
+chunks = []
+row = 0
+for canvas in sorted(groups):
+    group = groups[canvas]
+    for start in list(range(0, len(group), batch_size)):
+        chunks.append((canvas, group[start:start + batch_size], row))
+        row += len(group[start:start + batch_size])
+pool = ThreadPoolExecutor(max_workers = workers)
+
+equalization = None
+if equalize != 'none':
+    cache_fn = stimuli_path + '/equalization.npz'
+    signatures = [get_signature(unproc_stimuli_path + '/' + os.path.basename(old_image.filename))
+                  for (canvas, chunk, first) in chunks for (name, old_image) in chunk]
+    equalization = load_equalization(cache_fn, signatures)
+    if equalization is None:
+        stats = list(pool.map(lambda job: get_stats(place([old_image for (name, old_image) in job[1]], job[0])), chunks))
+        mean, rms, hist = [np.concatenate([chunk_stats[k] for chunk_stats in stats]) for k in list(range(0, 3))]
+        equalization = {'mean': mean, 'rms': rms, 'hist': hist, 'mapping': get_mapping(equalize, mean, rms, hist)}
+        save_equalization(cache_fn, signatures, equalization)
     else:
-        new_image = blank_200.copy()
-    pos = []
-    pos.append(round((new_image.size[0] - old_image.size[0]) / 2))
-    pos.append(round((new_image.size[1] - old_image.size[1]) / 2))
-    #new_image.paste(old_image, (pos[0], pos[1]))
-    new_image.paste(old_image, (pos[0], pos[1]), old_image)
-    new_image.load()
-    final_image = Image.new("RGB", new_image.size, (127,127,127))
-    final_image.paste(new_image, mask = new_image.split()[3])
-    new_image = final_image.copy()
-    new_image = new_image.resize((200,200), Image.ANTIALIAS)
-    if os.stat(image).st_size > 65000:
-        quality = 85
-    elif os.stat(image).st_size > 35000:
-        quality = 85
-    else: quality = 85
-    
-    new_image.save(stimuli_path + '/' + image_filename + '.jpg', optimize = True, quality = quality)
-    del new_image, old_image
-    
-
-all_images = glob.glob(stimuli_path + '/*')
-for image in all_images:
-    sep_loc = image.rfind('/')
-    image_filename = image[sep_loc + 1:-4]
-    new_image = Image.open(image)
-    if os.stat(image).st_size > 8000:
-        quality = 50
-        new_image.save(stimuli_path + '/' + image_filename + '.jpg', optimize = True, quality = quality)
-    
-    
\ No newline at end of file
+        print('Equalization: cached in %s' % cache_fn)
+    print_spread('Before:', equalization['mean'], equalization['rms'])
+
+def process(job):
+    canvas, chunk, first = job
+    batch = place([old_image for (name, old_image) in chunk], canvas)
+    stats = None
+    if equalization is not None:
+        batch = apply_mapping(equalize, batch, equalization['mapping'][first:first + len(chunk)])
+        stats = get_stats(batch)
+    resized = make_sizes(composite(batch))
+    for n, (name, old_image) in enumerate(chunk):
+        save(resized[200][n], stimuli_path + '/' + name + '.jpg')
+        for size in sizes:
+            save(resized[size][n], stimuli_path + '/px' + str(size) + '/' + name + '.jpg')
+    return stats
+
+after = list(pool.map(process, chunks))
+pool.shutdown()
+for canvas in sorted(groups):
+    print('Canvas %i: %i images' % (canvas, len(groups[canvas])))
+if equalization is not None:
+    print_spread('After: ', np.concatenate([stats[0] for stats in after]), np.concatenate([stats[1] for stats in after]))
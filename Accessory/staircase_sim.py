@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# staircase_sim.py
+#
+# Simulate the stimulus duration staircase of rsvp_sweep.py for populations of virtual observers
+# 1. Target bank: counted and seen targets per sweep for every stimulus duration and direction
+# 2. Virtual observers: Weibull psychometric functions of stimulus duration
+# 3. Run the staircase for every observer at once, sweep by sweep
+# 4. Summarise final durations and trajectories for each n_trials, starting duration and threshold
+#
+# Each sweep draws its targets from simulations of sweep()'s target logic (rsvp_design.simulate_targets) at the
+# observer's current duration, and the observer hits each seen target with probability
+#   p(d) = (1 - lapse) * (1 - exp(-(d / threshold) ^ slope))
+# Accuracy is hits over counted targets, as in sweep(), and dur_idx moves by rsvp_design.update_staircase.
+# Thresholds vary across observers, log-normally around --threshold. Responses are assumed to fall in the response
+# window; false positives do not enter accuracy.
+# The target duration of an observer is the one where 100 * p(d) is closest to the middle of stair_lower and
+# stair_upper; a staircase has converged for an observer when it ends within one step of it.
+#
+# Example:
+#   python staircase_sim.py --params ../rsvp_params.txt --n-trials 8 16 32 --start-ms 150 300 --threshold 150 250
+#   python staircase_sim.py --params ../rsvp_params.txt --runs 4 --trajectory
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+
+# 1. Target bank
+# counted and seen, shape (n_durations, 4 directions, bank_size)
+def get_target_bank(params, bank_size = 2000, seed = 0, bore_mask = None):
+    fps = params.get('refresh_rate', 60)
+    n_durations = len(rsvp_design.get_frame_tables(fps, params['tr_per_bar'] * params['tr'])[0])
+    counted = np.zeros((n_durations, len(rsvp_design.types), bank_size), dtype = int)
+    seen = np.zeros((n_durations, len(rsvp_design.types), bank_size), dtype = int)
+    rngs = np.random.SeedSequence(seed).spawn(n_durations * len(rsvp_design.types))
+    for dur_idx in list(range(0, n_durations)):
+        for d, direct in enumerate(rsvp_design.types):
+            rng = np.random.default_rng(rngs[dur_idx * len(rsvp_design.types) + d])
+            sim = rsvp_design.simulate_targets(params, dur_idx, direct, bank_size, rng = rng, bore_mask = bore_mask)
+            counted[dur_idx, d] = sim['total']
+            seen[dur_idx, d] = sim['drawn'].sum(axis = 1)
+    return counted, seen
+
+
+# 2. Virtual observers
+def draw_thresholds(rng, n_observers, threshold, threshold_sd):
+    return threshold * np.exp(rng.normal(0, threshold_sd, n_observers))
+
+def hit_probability(stim_ms, thresholds, slope, lapse):
+    return (1 - lapse) * (1 - np.exp(-(stim_ms / thresholds) ** slope))
+
+# Index of the duration each observer's staircase should settle at
+def get_target_idx(params, time_list, thresholds, slope, lapse):
+    p = hit_probability(np.array(time_list)[None, :], thresholds[:, None], slope, lapse)
+    middle = (params['stair_lower'] + params['stair_upper']) / 2
+    return np.argmin(np.abs(100 * p - middle), axis = 1)
+
+
+# 3. Run the staircase
+# Returns the dur_idx of every observer before each sweep and after the last, shape (n_observers, n_sweeps + 1),
+# and the number of sweeps without a counted target
+def run_staircase(params, bank, time_list, start_idx, thresholds, slope, lapse, n_trials, runs = 1, rng = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    counted_bank, seen_bank = bank
+    n_observers = len(thresholds)
+    stim_ms = np.array(time_list, dtype = float)
+    dur_idx = np.full(n_observers, start_idx, dtype = int)
+    trajectory = [dur_idx]
+    no_target = 0
+    for run in list(range(0, runs)):
+        for x in list(range(0, n_trials)):
+            draw = rng.integers(0, counted_bank.shape[2], n_observers)
+            counted = counted_bank[dur_idx, x % 4, draw]
+            seen = seen_bank[dur_idx, x % 4, draw]
+            correct = rng.binomial(seen, hit_probability(stim_ms[dur_idx], thresholds, slope, lapse))
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                accuracy = np.where(counted > 0, 100 * correct / counted, np.nan)
+            no_target += np.sum(counted == 0)
+            dur_idx = rsvp_design.update_staircase(dur_idx, accuracy, len(time_list), params['stair_lower'], params['stair_upper'])
+            trajectory.append(dur_idx)
+    return np.stack(trajectory, axis = 1), no_target
+
+
+# 4. Summarise
+def summarise(params, bank, time_list, n_trials_list, start_ms_list, threshold_list, threshold_sd, slope, lapse,
+              n_observers, runs = 1, seed = 0, show_trajectory = False):
+    stim_ms = np.array(time_list)
+    print('%8s %8s %9s | %7s %13s %9s %8s %9s %9s' % ('n_trials', 'start_ms', 'threshold', 'final', 'final IQR', 'converged',
+                                                       'bias', 'at short', 'at long'))
+    seeds = np.random.SeedSequence(seed)
+    for n_trials in n_trials_list:
+        for start_ms in start_ms_list:
+            start_idx = int(np.argmin(np.abs(stim_ms - start_ms)))
+            for threshold in threshold_list:
+                rng = np.random.default_rng(seeds.spawn(1)[0])
+                thresholds = draw_thresholds(rng, n_observers, threshold, threshold_sd)
+                target_idx = get_target_idx(params, time_list, thresholds, slope, lapse)
+                trajectory, no_target = run_staircase(params, bank, time_list, start_idx, thresholds, slope, lapse, n_trials,
+                                                      runs = runs, rng = rng)
+                final = trajectory[:, -1]
+                error = final - target_idx
+                print('%8i %8i %9i | %5.0fms %5.0f-%5.0fms %8.1f%% %+8.2f %8.1f%% %8.1f%%'
+                      % (n_trials, stim_ms[start_idx], threshold, np.median(stim_ms[final]), np.percentile(stim_ms[final], 25),
+                         np.percentile(stim_ms[final], 75), 100 * np.mean(np.abs(error) <= 1), error.mean(),
+                         100 * np.mean(final == 0), 100 * np.mean(final == len(time_list) - 1)))
+                if no_target:
+                    print('  %i sweeps had no counted target (rsvp_sweep.py would stop with ZeroDivisionError)' % no_target)
+                if show_trajectory:
+                    ms = stim_ms[trajectory]
+                    print('  sweep  ' + ' '.join(['%6i' % k for k in list(range(0, trajectory.shape[1]))]))
+                    for q, name in [(10, '10%'), (50, 'median'), (90, '90%')]:
+                        print('  %-6s ' % name + ' '.join(['%6.0f' % v for v in np.percentile(ms, q, axis = 0)]))
+                    print('  |error|' + ' '.join(['%6.2f' % v for v in np.abs(trajectory - target_idx[:, None]).mean(axis = 0)]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Simulate the rsvp_sweep stimulus duration staircase for virtual observers')
+    parser.add_argument('--params', default = '../rsvp_params.txt', help = 'rsvp_params.txt to simulate')
+    parser.add_argument('--n-trials', type = int, nargs = '+', default = None, help = 'Sweeps per run; defaults to n_trials')
+    parser.add_argument('--runs', type = int, default = 1, help = 'Runs in the session; the staircase carries over between runs')
+    parser.add_argument('--start-ms', type = float, nargs = '+', default = None, help = 'Starting stimulus durations; defaults to the shortest')
+    parser.add_argument('--threshold', type = float, nargs = '+', default = [200], help = 'Median observer threshold (ms, Weibull scale)')
+    parser.add_argument('--threshold-sd', type = float, default = 0.3, help = 'SD of log thresholds across observers')
+    parser.add_argument('--slope', type = float, default = 3, help = 'Weibull slope')
+    parser.add_argument('--lapse', type = float, default = 0.05, help = 'Lapse rate')
+    parser.add_argument('--n-observers', type = int, default = 10000)
+    parser.add_argument('--bank', type = int, default = 2000, help = 'Simulated sweeps per duration and direction to draw targets from')
+    parser.add_argument('--behavioral', action = 'store_true', help = 'No bore masks, as outside the scanner')
+    parser.add_argument('--trajectory', action = 'store_true', help = 'Print stimulus duration percentiles after every sweep')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    params = rsvp_design.load_params(args.params)
+    time_list = rsvp_design.get_frame_tables(params.get('refresh_rate', 60), params['tr_per_bar'] * params['tr'])[2]
+    t0 = time.time()
+    bank = get_target_bank(params, bank_size = args.bank, seed = args.seed, bore_mask = params['bore_mask'] and not args.behavioral)
+    print('Target bank: %i durations x 4 directions x %i sweeps (%.2f s)' % (bank[0].shape[0], args.bank, time.time() - t0))
+    summarise(params, bank, time_list,
+              args.n_trials if args.n_trials is not None else [params['n_trials']],
+              args.start_ms if args.start_ms is not None else [time_list[0]],
+              args.threshold, args.threshold_sd, args.slope, args.lapse, args.n_observers,
+              runs = args.runs, seed = args.seed, show_trajectory = args.trajectory)
+    print('(%.2f s)' % (time.time() - t0))
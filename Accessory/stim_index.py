@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# stim_index.py
+#
+# Interval index of what rsvp_sweep.py had on screen, for looking up many timestamps at once
+# 1. Set intervals of one stimlog: start, end and all slot data of every set shown
+# 2. Build the index over many runs, sorted by run and start, and save it as arrays
+# 3. Query: the set on screen at each (run, t), by one vectorized binary search over all runs
+# 4. Read queries from and write answers to csv or npz
+#
+# A set is on screen from its imageOnset until the next set's onset or until it has lasted its sweep's stimulus
+# duration, whichever is first. The gap at the end of each bar and the time between sweeps fall between sets and
+# are blank (set -1). Stimulus durations come from the Stim_Duration column of the run's summary file
+# (<name>.csv next to <name>_stimlog.csv) or, without it, from the median interval between sets of the same bar.
+# Times are in seconds from the start of the run, as in the stimlog (barOnset, imageOnset); convert eyetracker or
+# response timestamps to that clock before querying.
+# Runs are numbered in the order their stimlogs are given to build; queries name a run by that number or by its
+# label, the stimlog file name without _stimlog.csv.
+#
+# Example:
+#   python stim_index.py build --out ../Data/XX_index.npz ../Data/XX_run*_stimlog.csv
+#   python stim_index.py query --index ../Data/XX_index.npz --times gaze.csv --out gaze_sets.csv
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+set_fields = ['trial', 'bar', 'direct', 'img', 'x', 'y', 'targ_here', 'targ_img', 'targ_slot']
+
+
+# 1. Set intervals of one stimlog
+# Stim_Duration of every sweep in a summary file, by trial number; The parameter block after the blank lines is skipped
+def read_stim_durations(summary_fn):
+    with open(summary_fn) as summary:
+        table = summary.read().partition('\n\n')[0]
+    data = np.genfromtxt(io.StringIO(table), delimiter = ',', names = True, dtype = None, encoding = 'utf-8')
+    data = np.atleast_1d(data)
+    return dict(zip(data['Trial_Number'].astype(int), data['Stim_Duration'].astype(float)))
+
+def get_intervals(stimlog_fn):
+    sets = rsvp_design.read_stimlog(stimlog_fn)
+    start = sets['imageOnset']
+    trial = sets['trial']
+    n = len(start)
+    same_trial = trial[1:] == trial[:-1]
+    same_bar = same_trial & (sets['barOnset'][1:] == sets['barOnset'][:-1])
+    summary_fn = stimlog_fn[0:-len('_stimlog.csv')] + '.csv' if stimlog_fn.endswith('_stimlog.csv') else None
+    durations = read_stim_durations(summary_fn) if summary_fn is not None and os.path.isfile(summary_fn) else {}
+    dur = np.full(n, np.inf)
+    interval = np.diff(start)
+    for t in np.unique(trial):
+        if t in durations:
+            dur[trial == t] = durations[t]
+        elif (same_bar & (trial[:-1] == t)).any():
+            dur[trial == t] = np.median(interval[same_bar & (trial[:-1] == t)])
+    next_start = np.concatenate([np.where(same_trial, start[1:], np.inf), [np.inf]]) if n else np.zeros(0)
+    end = np.minimum(start + dur, next_start)
+    end[~np.isfinite(end)] = start[~np.isfinite(end)]             # One-set sweep without a known duration: no interval
+    bar = np.ones(n, dtype = int)
+    for s in list(range(1, n)):
+        if same_trial[s - 1]:
+            bar[s] = bar[s - 1] + (sets['barOnset'][s] != sets['barOnset'][s - 1])
+    return {'start': start, 'end': end, 'trial': trial, 'bar': bar, 'direct': sets['direct'], 'img': sets['img'],
+            'x': sets['x'], 'y': sets['y'], 'targ_here': sets['targ_here'], 'targ_img': sets['targ_img'],
+            'targ_slot': sets['targ_slot']}
+
+
+# 2. Build the index
+def get_run_label(stimlog_fn):
+    name = os.path.basename(stimlog_fn)
+    return name[0:-len('_stimlog.csv')] if name.endswith('_stimlog.csv') else os.path.splitext(name)[0]
+
+def build_index(stimlog_fns):
+    runs = [get_intervals(fn) for fn in stimlog_fns]
+    index = {key: np.concatenate([run[key] for run in runs]) for key in ['start', 'end'] + set_fields}
+    index['run'] = np.concatenate([np.full(len(run['start']), r) for r, run in enumerate(runs)]).astype(int)
+    order = np.lexsort((index['start'], index['run']))
+    index = {key: index[key][order] for key in index}
+    index['labels'] = np.array([get_run_label(fn) for fn in stimlog_fns])
+    return index
+
+def save_index(index, out):
+    np.savez_compressed(out, **index)
+
+def load_index(filename):
+    data = np.load(filename)
+    return {key: data[key] for key in data.files}
+
+
+# 3. Query
+# Runs are laid end to end on one time axis, each `span` seconds long, so one searchsorted covers all of them
+def get_span(index):
+    return float(np.ceil(np.max(index['end'], initial = 0) + 1))
+
+# Set index on screen at each (run, t), or -1 when no set was
+def lookup(index, run, t):
+    run = np.asarray(run, dtype = int)
+    t = np.asarray(t, dtype = float)
+    span = get_span(index)
+    keys = index['run'] * span + index['start']
+    found = np.searchsorted(keys, run * span + t, side = 'right') - 1
+    safe = np.maximum(found, 0)
+    on = (found >= 0) & (index['run'][safe] == run) & (t >= index['start'][safe]) & (t < index['end'][safe])
+    return np.where(on, found, -1)
+
+# What was on screen at each (run, t): set, onset and all slot data; blank answers hold -1, nan, '' or False
+def query(index, run, t):
+    found = lookup(index, run, t)
+    on = found >= 0
+    safe = np.maximum(found, 0)
+    answer = {'set': found, 'onset': np.where(on, index['start'][safe], np.nan)}
+    for key in set_fields:
+        values = index[key][safe]
+        blank = {'f': np.nan, 'b': False, 'U': ''}.get(values.dtype.kind, -1)
+        mask = on.reshape(on.shape + (1,) * (values.ndim - 1))
+        answer[key] = np.where(mask, values, blank)
+    return answer
+
+
+# 4. Read queries; Write answers
+# Query csv: a header with run and t columns; run is a run number or label
+def read_queries(filename, index):
+    if filename.endswith('.npz'):
+        data = np.load(filename)
+        run, t = data['run'], data['t']
+    else:
+        data = np.genfromtxt(filename, delimiter = ',', names = True, dtype = None, encoding = 'utf-8')
+        data = np.atleast_1d(data)
+        run, t = data['run'], data['t'].astype(float)
+    if run.dtype.kind in 'iu':
+        return run, t
+    labels, inverse = np.unique(run.astype(str), return_inverse = True)
+    numbers = {label: r for r, label in enumerate(index['labels'])}
+    missing = [label for label in labels if label not in numbers and not label.isdigit()]
+    if missing:
+        raise Exception('Error: Runs %s are not in the index' % ', '.join(missing))
+    return np.array([numbers[label] if label in numbers else int(label) for label in labels])[inverse], t
+
+def write_answers(filename, run, t, answer):
+    if filename.endswith('.npz'):
+        np.savez_compressed(filename, run = run, t = t, **answer)
+        return
+    slots = ','.join(['i%i%s' % (s, c) for s in list(range(1, 7)) for c in ['img', 'x', 'y']])
+    columns = [run, t, answer['set'], answer['onset'], answer['trial'], answer['bar'], answer['direct']]
+    for s in list(range(0, 6)):
+        columns += [answer['img'][:, s], answer['x'][:, s], answer['y'][:, s]]
+    columns += [answer['targ_here'], answer['targ_img'], answer['targ_slot']]
+    with open(filename, 'w') as out:
+        out.write('run,t,set,onset,trial,bar,direct,' + slots + ',targ_here,targ_img,targ_slot\n')
+        np.savetxt(out, np.stack([np.asarray(c).astype(str) for c in columns], axis = 1), fmt = '%s', delimiter = ',')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Interval index of what rsvp_sweep.py had on screen')
+    commands = parser.add_subparsers(dest = 'command')
+    build_parser = commands.add_parser('build', help = 'Build an index from stimlogs')
+    build_parser.add_argument('stimlogs', nargs = '+', help = 'Stimlog files, one per run')
+    build_parser.add_argument('--out', required = True, help = 'Index file (.npz)')
+    query_parser = commands.add_parser('query', help = 'Look up timestamps in an index')
+    query_parser.add_argument('--index', required = True, help = 'Index file from build')
+    query_parser.add_argument('--times', required = True, help = 'csv with run and t columns, or npz with run and t arrays')
+    query_parser.add_argument('--out', required = True, help = 'Answers (.csv or .npz)')
+    args = parser.parse_args()
+    t0 = time.time()
+    if args.command == 'build':
+        index = build_index(args.stimlogs)
+        save_index(index, args.out)
+        for r, label in enumerate(index['labels']):
+            print('Run %i: %s, %i sets' % (r, label, np.sum(index['run'] == r)))
+        print('Index of %i sets saved to %s (%.2f s)' % (len(index['start']), args.out, time.time() - t0))
+    elif args.command == 'query':
+        index = load_index(args.index)
+        run, t = read_queries(args.times, index)
+        t1 = time.time()
+        answer = query(index, run, t)
+        t2 = time.time()
+        write_answers(args.out, run, t, answer)
+        print('%i timestamps, %i on a set; lookup %.3f s, total %.2f s' % (len(t), np.sum(answer['set'] >= 0), t2 - t1, time.time() - t0))
+    else:
+        parser.print_help()
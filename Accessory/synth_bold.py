@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# synth_bold.py
+#
+# Generate a synthetic BOLD dataset for benchmarking pRF analysis of RSVP_pRF runs
+# 1. Load design from rsvp_params.txt or a recorded stimlog
+# 2. Build the stimulus aperture on a visual field grid
+# 3. Convolve with the HRF and resample to the TR grid
+# 4. Draw ground-truth pRF parameters
+# 5. Write voxel timeseries chunk by chunk to a memory-mapped file
+#
+# Output (for --out synth):
+#   synth_bold.npy     float32 (n_voxels, n_trs) timeseries, written as a memory-mapped .npy
+#   synth_truth.npz    ground-truth pRF parameters per voxel (x, y, sigma in deg; amplitude, baseline, noise_sd)
+#   synth_design.npz   the aperture (n_trs, grid, grid), grid coordinates in deg, and the design settings
+#
+# Example:
+#   python synth_bold.py --params ../rsvp_params.txt --n-voxels 1000000 --out ../Data/synth
+#   python synth_bold.py --params ../rsvp_params.txt --stimlog ../Data/XX_run1_..._stimlog.csv --out ../Data/synth_run1
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import math
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+
+# 1. Load design from rsvp_params.txt or a recorded stimlog
+# Sets are shown for stim_dur and then replaced; the blank gap at the end of each bar is not covered.
+# For a stimlog, each set lasts until the next one in the same bar, capped at the typical set interval.
+def load_sets(params, stimlog = None, dur_idx = 0):
+    if stimlog is None:
+        sets = rsvp_design.get_set_plan(params, dur_idx)
+        return sets['imageOnset'], sets['stim_dur'], sets['x'], sets['y'], sets['bar']
+    sets = rsvp_design.read_stimlog(stimlog)
+    onset = sets['imageOnset']
+    same_bar = (sets['barOnset'][1:] == sets['barOnset'][:-1]) & (sets['trial'][1:] == sets['trial'][:-1])
+    interval = np.diff(onset)
+    typical = np.median(interval[same_bar]) if same_bar.any() else params['tr']
+    dur = np.full(len(onset), typical)
+    dur[:-1][same_bar] = np.minimum(interval[same_bar], typical)
+    return onset, dur, sets['x'], sets['y'], None
+
+
+# 2. Build the stimulus aperture on a visual field grid
+# Each set covers the six image squares; bore masks hide the top corner slots on the first and last bars
+def get_masks(params, x, y, grid = 40, bore_mask = False, bar_num = None):
+    image_h = params['image_h']
+    half_w = params['stim_bounds'][0] / 2
+    half_h = params['stim_bounds'][1] / 2
+    xs = (np.arange(grid) + 0.5) / grid * 2 * half_w - half_w
+    ys = half_h - (np.arange(grid) + 0.5) / grid * 2 * half_h
+    in_x = np.abs(xs[None, None, :] - x[:, :, None]) <= image_h / 2
+    in_y = np.abs(ys[None, None, :] - y[:, :, None]) <= image_h / 2
+    masks = np.zeros((len(x), grid, grid), dtype = bool)
+    for slot in list(range(0, 6)):
+        masks |= in_y[:, slot, :, None] & in_x[:, slot, None, :]
+    if bore_mask and bar_num is not None:
+        pos = rsvp_design.get_positions(params)
+        corner = np.zeros((grid, grid), dtype = bool)
+        for mask_x in [pos['l_marg'], pos['r_marg']]:
+            corner |= ((np.abs(ys - pos['t_marg']) <= image_h / 2)[:, None] &
+                       (np.abs(xs - mask_x) <= image_h / 2)[None, :])
+        masked = (bar_num == 1) | (bar_num == params['n_bars'])
+        masks[masked] &= ~corner
+    return masks, xs, ys
+
+# Fraction of each fine time bin that each grid point was covered
+def get_aperture(onset, dur, masks, n_bins, dt):
+    aperture = np.zeros((n_bins, masks.shape[1] * masks.shape[2]), dtype = np.float32)
+    flat = masks.reshape(len(masks), -1).astype(np.float32)
+    for s in list(range(0, len(onset))):
+        first = int(onset[s] // dt)
+        last = int(math.ceil((onset[s] + dur[s]) / dt))
+        for b in list(range(max(first, 0), min(last, n_bins))):
+            overlap = min(onset[s] + dur[s], (b + 1) * dt) - max(onset[s], b * dt)
+            if overlap > 0:
+                aperture[b] += flat[s] * (overlap / dt)
+    return aperture
+
+
+# 3. Convolve with the HRF and resample to the TR grid
+# SPM canonical double-gamma HRF, normalised to unit sum
+def get_hrf(dt, length = 32):
+    t = np.arange(0, length, dt)
+    hrf = t ** 5 * np.exp(-t) / math.gamma(6) - t ** 15 * np.exp(-t) / (6 * math.gamma(16))
+    return hrf / hrf.sum()
+
+def get_design_matrix(aperture, dt, oversample):
+    hrf = get_hrf(dt)
+    n = aperture.shape[0] + len(hrf) - 1
+    conv = np.fft.irfft(np.fft.rfft(aperture, n, axis = 0) * np.fft.rfft(hrf, n)[:, None], n, axis = 0)
+    conv = conv[0:aperture.shape[0]]
+    n_trs = aperture.shape[0] // oversample
+    return conv.reshape(n_trs, oversample, -1).mean(axis = 1).astype(np.float32)
+
+
+# 4. Draw ground-truth pRF parameters
+# Positions are uniform within the stimulus bounds (in deg), sizes are log-uniform
+def draw_truth(rng, n_voxels, params, sigma_range, amp_range, baseline, noise_range):
+    half_w = params['stim_bounds'][0] / 2 / params['ppd']
+    half_h = params['stim_bounds'][1] / 2 / params['ppd']
+    return {'x': rng.uniform(-half_w, half_w, n_voxels).astype(np.float32),
+            'y': rng.uniform(-half_h, half_h, n_voxels).astype(np.float32),
+            'sigma': np.exp(rng.uniform(math.log(sigma_range[0]), math.log(sigma_range[1]), n_voxels)).astype(np.float32),
+            'amplitude': rng.uniform(amp_range[0], amp_range[1], n_voxels).astype(np.float32),
+            'baseline': np.full(n_voxels, baseline, dtype = np.float32),
+            'noise_sd': rng.uniform(noise_range[0], noise_range[1], n_voxels).astype(np.float32)}
+
+# Gaussian pRF weights on the grid, normalised so that a full-field stimulus gives ~1; shape (grid * grid, n)
+def get_prf_weights(xs_deg, ys_deg, x, y, sigma):
+    gx = np.exp(-(xs_deg[:, None] - x[None, :]) ** 2 / (2 * sigma[None, :] ** 2))
+    gy = np.exp(-(ys_deg[:, None] - y[None, :]) ** 2 / (2 * sigma[None, :] ** 2))
+    cell = abs(xs_deg[1] - xs_deg[0]) * abs(ys_deg[1] - ys_deg[0])
+    weights = (gy[:, None, :] * gx[None, :, :]).reshape(len(ys_deg) * len(xs_deg), -1)
+    return weights * (cell / (2 * math.pi * sigma[None, :] ** 2))
+
+# Slow scanner drift: linear trend plus the first few discrete cosines, with random weights per voxel
+def get_drift(rng, n_trs, n_voxels, drift_sd, n_cos = 3):
+    t = np.arange(n_trs)
+    basis = [t / max(n_trs - 1, 1) - 0.5]
+    for k in list(range(1, n_cos + 1)):
+        basis.append(np.cos(math.pi * k * (t + 0.5) / n_trs))
+    basis = np.array(basis, dtype = np.float32)
+    weights = rng.normal(0, drift_sd, (len(basis), n_voxels)).astype(np.float32)
+    return basis.T @ weights
+
+
+# 5. Write voxel timeseries chunk by chunk to a memory-mapped file
+def generate(params, out, n_voxels, stimlog = None, dur_idx = 0, grid = 40, oversample = 10, chunk = 10000,
+             sigma_range = (0.5, 5), amp_range = (1, 5), baseline = 100, noise_range = (0.5, 2), drift_sd = 1, seed = 0):
+    t0 = time.time()
+    tr = params['tr']
+    n_trs = rsvp_design.get_n_trs(params)
+    dt = tr / oversample
+    onset, dur, x, y, bar_num = load_sets(params, stimlog = stimlog, dur_idx = dur_idx)
+    masks, xs, ys = get_masks(params, x, y, grid = grid, bore_mask = params['bore_mask'], bar_num = bar_num)
+    aperture = get_aperture(onset, dur, masks, n_trs * oversample, dt)
+    design = get_design_matrix(aperture, dt, oversample)
+    xs_deg = xs / params['ppd']
+    ys_deg = ys / params['ppd']
+    np.savez(out + '_design.npz',
+             aperture = aperture.reshape(n_trs, oversample, grid, grid).mean(axis = 1),
+             xs_deg = xs_deg, ys_deg = ys_deg, tr = tr, n_trs = n_trs, grid = grid,
+             source = 'params' if stimlog is None else stimlog)
+    print('Design: %i sets, %i TRs, %ix%i grid (%.2f s)' % (len(onset), n_trs, grid, grid, time.time() - t0))
+
+    seeds = np.random.SeedSequence(seed)
+    truth_seed, noise_seed = seeds.spawn(2)
+    truth = draw_truth(np.random.default_rng(truth_seed), n_voxels, params, sigma_range, amp_range, baseline, noise_range)
+    np.savez(out + '_truth.npz', seed = seed, **truth)
+
+    bold = np.lib.format.open_memmap(out + '_bold.npy', mode = 'w+', dtype = np.float32, shape = (n_voxels, n_trs))
+    chunk_seeds = noise_seed.spawn(int(math.ceil(n_voxels / chunk)))
+    t1 = time.time()
+    for c, start in enumerate(list(range(0, n_voxels, chunk))):
+        stop = min(start + chunk, n_voxels)
+        rng = np.random.default_rng(chunk_seeds[c])
+        weights = get_prf_weights(xs_deg, ys_deg, truth['x'][start:stop], truth['y'][start:stop], truth['sigma'][start:stop])
+        signal = (design @ weights) * truth['amplitude'][None, start:stop]
+        signal += truth['baseline'][None, start:stop]
+        signal += get_drift(rng, n_trs, stop - start, drift_sd)
+        signal += rng.standard_normal((n_trs, stop - start), dtype = np.float32) * truth['noise_sd'][None, start:stop]
+        bold[start:stop] = signal.T
+    bold.flush()
+    elapsed = time.time() - t1
+    print('Wrote %i voxels x %i TRs to %s (%.2f s, %.0f voxels/s)' % (n_voxels, n_trs, out + '_bold.npy', elapsed, n_voxels / max(elapsed, 1e-9)))
+    del bold
+    return out + '_bold.npy'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate synthetic BOLD timeseries for RSVP_pRF runs')
+    parser.add_argument('--params', default = '../rsvp_params.txt', help = 'rsvp_params.txt used for the run')
+    parser.add_argument('--stimlog', default = None, help = 'Recorded stimlog to take set onsets and positions from')
+    parser.add_argument('--dur-idx', type = int, default = 0, help = 'Stimulus duration index when designing from params')
+    parser.add_argument('--out', default = 'synth', help = 'Output prefix')
+    parser.add_argument('--n-voxels', type = int, default = 10000)
+    parser.add_argument('--chunk', type = int, default = 10000, help = 'Voxels generated per chunk')
+    parser.add_argument('--grid', type = int, default = 40, help = 'Visual field grid size')
+    parser.add_argument('--oversample', type = int, default = 10, help = 'Time bins per TR for HRF convolution')
+    parser.add_argument('--sigma', type = float, nargs = 2, default = [0.5, 5], help = 'pRF size range in deg (log-uniform)')
+    parser.add_argument('--amplitude', type = float, nargs = 2, default = [1, 5], help = 'Response amplitude range')
+    parser.add_argument('--baseline', type = float, default = 100)
+    parser.add_argument('--noise', type = float, nargs = 2, default = [0.5, 2], help = 'White noise SD range')
+    parser.add_argument('--drift', type = float, default = 1, help = 'SD of drift basis weights')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    params = rsvp_design.load_params(args.params)
+    generate(params, args.out, args.n_voxels, stimlog = args.stimlog, dur_idx = args.dur_idx, grid = args.grid,
+             oversample = args.oversample, chunk = args.chunk, sigma_range = args.sigma, amp_range = args.amplitude,
+             baseline = args.baseline, noise_range = args.noise, drift_sd = args.drift, seed = args.seed)
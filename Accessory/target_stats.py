@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# target_stats.py
+#
+# Monte Carlo statistics of the target presentation of rsvp_sweep.py, for choosing targ_rate and targ_cooldown
+# 1. Simulate many sweeps of every direction with rsvp_design.simulate_targets
+# 2. Summarise: targets per sweep, sweeps without a counted target, slot and bar coverage, inter-target intervals
+# 3. Compare targ_rate and targ_cooldown values, one line each
+#
+# Counted targets are sweep()'s `total`, which accuracy is divided by (a sweep with none raises ZeroDivisionError).
+# Seen targets are those in sets that reach the screen. sweep() generates two sets after the last one it draws
+# and only takes the target of one of them back out of `total`, so counted can exceed seen.
+# Masked targets are seen in a slot covered by a bore mask (first and last bar, top corner slots).
+#
+# Example:
+#   python target_stats.py --params ../rsvp_params.txt --dur-idx 0 --n-sweeps 20000
+#   python target_stats.py --params ../rsvp_params.txt --targ-rate 4 6 8 --targ-cooldown 1 1.5 2
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+from inspect import getsourcefile
+from os.path import abspath, dirname
+import argparse
+import sys
+import time
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(getsourcefile(lambda:0)))))
+import rsvp_design
+
+
+# 1. Simulate sweeps
+# Slots of each bar (n_bars, 6) that a bore mask covers, at least in part
+def get_masked_slots(params, direct):
+    pos = rsvp_design.get_positions(params)
+    bars = rsvp_design.get_bar_positions(params, direct)
+    covered = np.zeros(bars.shape[0:2], dtype = bool)
+    for mask_x in [pos['l_marg'], pos['r_marg']]:
+        covered |= (np.abs(bars[:, :, 0] - mask_x) < pos['image_h']) & (np.abs(bars[:, :, 1] - pos['t_marg']) < pos['image_h'])
+    covered[1:-1] = False
+    return covered
+
+# Simulated targets of n_sweeps sweeps per direction, with per-target set index, bar, slot and time pooled
+def simulate(params, dur_idx, n_sweeps, seed = 0, bore_mask = None):
+    if bore_mask is None:
+        bore_mask = params['bore_mask']
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(rsvp_design.types))]
+    out = {'counted': [], 'seen': [], 'bar': [], 'slot': [], 'masked': [], 'interval': []}
+    for direct, rng in zip(rsvp_design.types, rngs):
+        sim = rsvp_design.simulate_targets(params, dur_idx, direct, n_sweeps, rng = rng, bore_mask = bore_mask)
+        drawn = sim['drawn']
+        sweep_idx, set_idx = np.nonzero(drawn)
+        bar = sim['set_bar_num'][set_idx]
+        slot = sim['slot'][sweep_idx, set_idx]
+        covered = get_masked_slots(params, direct) if bore_mask else np.zeros((params['n_bars'], 6), dtype = bool)
+        onset = np.where(drawn, sim['set_timings'][None, :], np.nan)
+        # Intervals between consecutive seen targets of the same sweep
+        order = np.sort(onset, axis = 1)
+        interval = np.diff(order, axis = 1)
+        out['counted'].append(sim['total'])
+        out['seen'].append(drawn.sum(axis = 1))
+        out['bar'].append(bar)
+        out['slot'].append(slot)
+        out['masked'].append(covered[bar - 1, slot])
+        out['interval'].append(interval[np.isfinite(interval)])
+    return {key: np.concatenate(out[key]) for key in out}
+
+
+# 2. Summarise
+def print_report(params, dur_idx, stats):
+    timing = rsvp_design.get_sweep_timing(params, dur_idx)
+    n = len(stats['counted'])
+    print('Stim duration %i ms, %i sets per bar, targ_rate %i, targ_cooldown %.2f s, %i sweeps'
+          % (round(timing['stim_dur'] * 1000), timing['sets_per_bar'], params['targ_rate'], params['targ_cooldown'], n))
+    print('Targets per sweep:  counted mean %.2f (SD %.2f), seen mean %.2f (SD %.2f)'
+          % (stats['counted'].mean(), stats['counted'].std(), stats['seen'].mean(), stats['seen'].std()))
+    print('  Sweeps with no counted target: %.4f%%; counted > seen: %.2f%%'
+          % (100 * np.mean(stats['counted'] == 0), 100 * np.mean(stats['counted'] > stats['seen'])))
+    counts = np.bincount(stats['seen'])
+    print('  Seen per sweep:    ' + '  '.join(['%i: %.1f%%' % (k, 100 * c / n) for k, c in enumerate(counts) if c > 0]))
+    n_seen = max(len(stats['slot']), 1)
+    print('Slot coverage (% of seen targets): ' + '  '.join(['%i: %.1f' % (s, 100 * np.sum(stats['slot'] == s) / n_seen) for s in list(range(0, 6))]))
+    print('Bar coverage (% of seen targets):  ' + '  '.join(['%i: %.1f' % (b, 100 * np.sum(stats['bar'] == b) / n_seen) for b in list(range(1, params['n_bars'] + 1))]))
+    print('Seen targets under a bore mask: %i (%.3f%%)' % (stats['masked'].sum(), 100 * stats['masked'].sum() / n_seen))
+    interval = stats['interval']
+    if len(interval):
+        print('Inter-target interval (s): min %.3f, 5%% %.3f, median %.3f, 95%% %.3f; %.2f%% shorter than response_period (%.2f s)'
+              % (interval.min(), np.percentile(interval, 5), np.median(interval), np.percentile(interval, 95),
+                 100 * np.mean(interval < params['response_period']), params['response_period']))
+
+
+# 3. Compare targ_rate and targ_cooldown values
+def compare(params, dur_idx, n_sweeps, targ_rates, targ_cooldowns, seed = 0, bore_mask = None):
+    print('%9s %13s %9s %9s %10s %12s %10s %10s' % ('targ_rate', 'targ_cooldown', 'counted', 'seen', 'no targ %', 'counted>seen', 'ITI min', 'ITI 5%'))
+    for targ_rate in targ_rates:
+        for targ_cooldown in targ_cooldowns:
+            trial_params = dict(params, targ_rate = targ_rate, targ_cooldown = targ_cooldown)
+            stats = simulate(trial_params, dur_idx, n_sweeps, seed = seed, bore_mask = bore_mask)
+            interval = stats['interval'] if len(stats['interval']) else np.array([np.nan])
+            print('%9i %13.2f %9.2f %9.2f %10.4f %11.2f%% %10.3f %10.3f'
+                  % (targ_rate, targ_cooldown, stats['counted'].mean(), stats['seen'].mean(), 100 * np.mean(stats['counted'] == 0),
+                     100 * np.mean(stats['counted'] > stats['seen']), np.nanmin(interval), np.nanpercentile(interval, 5)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Monte Carlo statistics of the rsvp_sweep target presentation')
+    parser.add_argument('--params', default = '../rsvp_params.txt', help = 'rsvp_params.txt to simulate')
+    parser.add_argument('--dur-idx', type = int, default = 0, help = 'Stimulus duration index (the staircase position)')
+    parser.add_argument('--n-sweeps', type = int, default = 10000, help = 'Sweeps simulated per direction')
+    parser.add_argument('--targ-rate', type = int, nargs = '+', default = None, help = 'targ_rate values to compare')
+    parser.add_argument('--targ-cooldown', type = float, nargs = '+', default = None, help = 'targ_cooldown values to compare')
+    parser.add_argument('--behavioral', action = 'store_true', help = 'No bore masks, as outside the scanner')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    params = rsvp_design.load_params(args.params)
+    bore_mask = params['bore_mask'] and not args.behavioral
+    t0 = time.time()
+    if args.targ_rate is None and args.targ_cooldown is None:
+        print_report(params, args.dur_idx, simulate(params, args.dur_idx, args.n_sweeps, seed = args.seed, bore_mask = bore_mask))
+    else:
+        targ_rates = args.targ_rate if args.targ_rate is not None else [params['targ_rate']]
+        targ_cooldowns = args.targ_cooldown if args.targ_cooldown is not None else [params['targ_cooldown']]
+        compare(params, args.dur_idx, args.n_sweeps, targ_rates, targ_cooldowns, seed = args.seed, bore_mask = bore_mask)
+    print('(%.2f s)' % (time.time() - t0))
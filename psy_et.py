@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# psy_et.py
+#
+# Eyetracker messaging and gaze monitoring off the presentation thread
+# 1. Message dispatcher: timestamp messages locally, send them from a background thread
+# 2. Latency statistics
+# 3. Gaze monitor: stream samples into a fixed-size ring buffer from a background thread
+# 4. Fixation statistics over a time window
+#
+# EyeLink treats a leading integer in a message as a time offset in ms and dates the message
+# that much earlier than its arrival, so the EDF gets the time send() was called, not the
+# time the background thread got through to the tracker. iohub's EyeTracker.sendMessage
+# takes this offset as its time_offset argument.
+#
+# The iohub client connection is not thread-safe. When the presentation thread also talks to
+# iohub during sweeps (the iohub keyboard on mac/Linux), pass the same lock to the dispatcher and
+# to psy_input.InputPump; the presentation thread then waits at most for one message in flight.
+#
+# Accessory/mock_tracker.py runs the dispatcher against a local mock tracker to check latency and ordering,
+# and the gaze monitor against simulated 500 Hz samples.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import threading
+import time
+import numpy as np
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from psychopy.core import getTime
+except ImportError:
+    getTime = time.perf_counter
+
+
+# 1. Message dispatcher
+# tracker is anything with sendMessage(message, time_offset = ms), e.g. io.devices.tracker
+class MessageDispatcher(object):
+    def __init__(self, tracker, clock = getTime, lock = None):
+        self.tracker = tracker
+        self.clock = clock
+        self.lock = lock
+        self.queue = queue.Queue()
+        self.delays = []        # Seconds between send() and the start of the tracker call
+        self.durations = []     # Seconds each tracker call blocked for
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Called on the presentation thread; only stamps and queues the message
+    def send(self, message):
+        self.queue.put((message, self.clock()))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            message, stamp = item
+            start = self.clock()
+            offset = int(round((start - stamp) * 1000))
+            if self.lock is not None:
+                with self.lock:
+                    self.tracker.sendMessage(message, time_offset = offset)
+            else:
+                self.tracker.sendMessage(message, time_offset = offset)
+            self.delays.append(start - stamp)
+            self.durations.append(self.clock() - start)
+
+    # Send everything still queued, then stop the background thread
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+    # 2. Latency statistics
+    # Queue delay (written to the EDF as the offset) and blocking time of the tracker calls, in ms
+    def stats(self):
+        stats = {'n_messages': len(self.delays)}
+        for name, values in [('delay', self.delays), ('send', self.durations)]:
+            values = np.array(values) * 1000
+            if len(values) == 0:
+                values = np.zeros(1)
+            stats[name + '_mean_ms'] = values.mean()
+            stats[name + '_p95_ms'] = np.percentile(values, 95)
+            stats[name + '_max_ms'] = values.max()
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        print('Eyetracker messages: %i' % stats['n_messages'])
+        print('  Queue delay (ms):  mean %.2f, p95 %.2f, max %.2f' % (stats['delay_mean_ms'], stats['delay_p95_ms'], stats['delay_max_ms']))
+        print('  Send time (ms):    mean %.2f, p95 %.2f, max %.2f' % (stats['send_mean_ms'], stats['send_p95_ms'], stats['send_max_ms']))
+
+
+# 3. Gaze monitor
+# tracker is anything with getEvents(event_type = ...) returning samples with time, gaze_x and gaze_y,
+# e.g. io.devices.tracker with EventConstants.MONOCULAR_EYE_SAMPLE. Samples are copied into preallocated
+# arrays; size must cover the longest window asked for (500 Hz x 60 s by default).
+class GazeMonitor(object):
+    def __init__(self, tracker, event_type = None, size = 30000, interval = 0.02, lock = None):
+        self.tracker = tracker
+        self.event_type = event_type
+        self.size = size
+        self.interval = interval
+        self.lock = lock
+        self.times = np.zeros(size)
+        self.x = np.zeros(size)
+        self.y = np.zeros(size)
+        self.count = 0                          # Samples written since start()
+        self.buffer_lock = threading.Lock()     # Keeps readers from seeing a half-written batch
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _get_samples(self):
+        if self.lock is not None:
+            with self.lock:
+                return self.tracker.getEvents(event_type = self.event_type)
+        return self.tracker.getEvents(event_type = self.event_type)
+
+    # Each batch is read into arrays outside the lock, then written to the ring with at most two slice assignments
+    # per array (the part up to the end of the ring and the part wrapped to its start)
+    def _run(self):
+        while self.running:
+            samples = self._get_samples()
+            n = len(samples)
+            if n:
+                times = np.fromiter((sample.time for sample in samples), float, n)
+                x = np.fromiter((sample.gaze_x for sample in samples), float, n)
+                y = np.fromiter((sample.gaze_y for sample in samples), float, n)
+                if n > self.size:                       # Only the newest samples fit
+                    skipped = n - self.size
+                    times, x, y = times[skipped:], x[skipped:], y[skipped:]
+                else:
+                    skipped = 0
+                with self.buffer_lock:
+                    start = (self.count + skipped) % self.size
+                    first = min(n - skipped, self.size - start)
+                    for ring, batch in [(self.times, times), (self.x, x), (self.y, y)]:
+                        ring[start:start + first] = batch[0:first]
+                        ring[0:len(batch) - first] = batch[first:]
+                    self.count += n
+            time.sleep(self.interval)
+
+    # Copies of the samples with t0 <= time < t1 still in the buffer
+    def window(self, t0, t1):
+        with self.buffer_lock:
+            n = min(self.count, self.size)
+            idx = np.arange(self.count - n, self.count) % self.size
+            times = self.times[idx]
+            keep = (times >= t0) & (times < t1)
+            return times[keep], self.x[idx][keep], self.y[idx][keep]
+
+
+    # 4. Fixation statistics
+    # Gaze deviation from the fixation point (center, in gaze units) over [t0, t1), in deg.
+    # Samples with non-finite gaze (blinks, track loss) count as invalid.
+    def fixation_stats(self, t0, t1, ppd, tolerance, center = (0, 0)):
+        times, x, y = self.window(t0, t1)
+        valid = np.isfinite(x) & np.isfinite(y)
+        dev = np.hypot(x[valid] - center[0], y[valid] - center[1]) / ppd
+        stats = {'n_samples': len(times),
+                 'valid_pct': 100 * valid.mean() if len(times) else 0.0,
+                 'mean_dev': dev.mean() if len(dev) else float('nan'),
+                 'rms_dev': np.sqrt((dev ** 2).mean()) if len(dev) else float('nan'),
+                 'max_dev': dev.max() if len(dev) else float('nan'),
+                 'within_pct': 100 * (dev <= tolerance).mean() if len(dev) else 0.0}
+        return stats
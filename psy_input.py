@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# psy_input.py
+#
+# Single-poll keyboard input for psychopy frame loops
+# 1. Event kinds
+# 2. Input pump: drain all pending key events once per frame into a preallocated ring buffer
+# 3. Read events of one kind with their device timestamps
+#
+# Timestamps are in the psychopy.core.getTime() time base: iohub keyboard events carry the
+# time the key went down, and event.getKeys(timeStamped = True) the time pyglet received it.
+# Compare them with core.getTime() values taken around win.flip(), not with the poll time.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import numpy as np
+try:
+    from psychopy import event
+except ImportError:
+    event = None
+
+
+# 1. Event kinds
+RESPONSE = 0
+QUIT = 1
+PULSE = 2
+
+
+# 2. Input pump
+# One poll per frame for the response, escape and MRI pulse keys. Pass iokeyboard on mac/Linux;
+# without it the pump falls back to event.getKeys as used on Windows.
+# The ring buffer holds the last `size` events; readers that fall further behind lose the oldest ones.
+# lock guards the iohub connection when another thread also uses it (see psy_et.py).
+class InputPump(object):
+    def __init__(self, response_key, quit_key = 'escape', pulse_key = None, iokeyboard = None, lock = None, size = 256):
+        self.key_kinds = {response_key: RESPONSE, quit_key: QUIT}
+        if pulse_key is not None and pulse_key not in self.key_kinds:
+            self.key_kinds[pulse_key] = PULSE
+        self.key_list = list(self.key_kinds.keys())
+        self.iokeyboard = iokeyboard
+        self.lock = lock
+        self.size = size
+        self.kinds = np.zeros(size, dtype = np.int8)
+        self.times = np.zeros(size)
+        self.count = 0                  # Events written since the pump was created
+        self.cursors = [0, 0, 0]        # Position up to which each kind has been read
+        self.quit = False
+
+    # Drain all pending events; Returns the number of new events
+    def poll(self):
+        if self.iokeyboard is not None and self.lock is not None:
+            with self.lock:
+                presses = [(press.key, press.time) for press in self.iokeyboard.getPresses(keys = self.key_list)]
+        elif self.iokeyboard is not None:
+            presses = [(press.key, press.time) for press in self.iokeyboard.getPresses(keys = self.key_list)]
+        else:
+            presses = event.getKeys(keyList = self.key_list, timeStamped = True)
+        for key, key_time in presses:
+            kind = self.key_kinds[key]
+            i = self.count % self.size
+            self.kinds[i] = kind
+            self.times[i] = key_time
+            self.count += 1
+            if kind == QUIT:
+                self.quit = True
+        return len(presses)
+
+    # 3. Read events of one kind
+    # Timestamps of the events of this kind written since the last read
+    def read(self, kind):
+        start = max(self.cursors[kind], self.count - self.size)
+        self.cursors[kind] = self.count
+        if start == self.count:
+            return []
+        idx = np.arange(start, self.count) % self.size
+        return self.times[idx][self.kinds[idx] == kind].tolist()
+
+    # Drain and discard pending events of these kinds, e.g. presses made while a sweep was loading.
+    # MRI pulses are kept by default so none go missing from the pulse log.
+    def clear(self, kinds = (RESPONSE, QUIT)):
+        self.poll()
+        for kind in kinds:
+            self.cursors[kind] = self.count
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# psy_journal.py
+#
+# Crash-safe append-only journal of a run's output files
+# 1. Record kinds and format
+# 2. Journal: append records from a background thread, fsync them in groups
+# 3. Journaled file: write to a csv file and to the journal
+# 4. Read a journal back, up to the first incomplete or damaged record
+#
+# Every record is a header (payload length, kind, CRC32 of the payload) followed by the utf-8 payload.
+# A crash can only lose the records queued or written since the last sync (sync_interval seconds), and a
+# record cut off by power loss fails its length or CRC check and ends the journal there.
+# Accessory/recover_journal.py rebuilds the summary and stimlog csv files of a run from its journal.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import atexit
+import os
+import struct
+import threading
+import time
+import zlib
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# 1. Record kinds and format
+SUMMARY = 1         # Text written to the summary csv
+STIMLOG = 2         # Text written to the stimlog csv
+PARAMS = 3          # Parameters at the start of a run, one 'key,value' line each
+TRIAL = 4           # 'onset,duration' of a finished sweep
+END = 5             # The run finished and its files were closed
+record_header = struct.Struct('<IBI')
+
+
+# 2. Journal
+# write() only queues the record, so it is safe to call between frames
+class Journal(object):
+    def __init__(self, filename, sync_interval = 1.0):
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.file = open(filename, 'ab')
+        self.queue = queue.Queue()
+        self.syncs = 0
+        self.closed = False
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)         # Escape calls core.quit(), which still runs atexit
+
+    def write(self, kind, text):
+        self.queue.put((kind, text))
+
+    def _run(self):
+        last_sync = time.perf_counter()
+        dirty = False
+        running = True
+        while running:
+            try:
+                items = [self.queue.get(timeout = self.sync_interval)]
+            except queue.Empty:
+                items = []
+            while not self.queue.empty():
+                items.append(self.queue.get())
+            for item in items:
+                if item is None:
+                    running = False
+                    break
+                kind, text = item
+                payload = text.encode('utf-8')
+                self.file.write(record_header.pack(len(payload), kind, zlib.crc32(payload) & 0xffffffff) + payload)
+                dirty = True
+            if dirty and (not running or time.perf_counter() - last_sync >= self.sync_interval):
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.syncs += 1
+                last_sync = time.perf_counter()
+                dirty = False
+        self.file.close()
+
+    # Write and sync everything still queued, then stop the background thread
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+
+# 3. Journaled file
+# Stands in for an open csv file: every write goes to the file and, as a record of `kind`, to the journal
+class JournaledFile(object):
+    def __init__(self, file, journal, kind):
+        self.file = file
+        self.journal = journal
+        self.kind = kind
+
+    def write(self, text):
+        self.file.write(text)
+        self.journal.write(self.kind, text)
+
+    def close(self):
+        self.file.close()
+
+
+# 4. Read a journal
+# Returns the (kind, text) records and whether the journal ended cleanly at a record boundary
+def read_journal(filename):
+    with open(filename, 'rb') as journal:
+        data = journal.read()
+    records = []
+    pos = 0
+    while pos + record_header.size <= len(data):
+        length, kind, crc = record_header.unpack_from(data, pos)
+        start = pos + record_header.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return records, False
+        records.append((kind, payload.decode('utf-8')))
+        pos = start + length
+    return records, pos == len(data)
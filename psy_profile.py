@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# psy_profile.py
+#
+# Stage hooks for profiling psychopy frame loops
+# 1. Hooks: named stages of a frame loop, and the collectors subscribed to them
+# 2. Stage timer: wall time histograms per stage
+# 3. Sweep profiler: cProfile or a sampling profiler limited to one sweep
+# 4. Set up hooks from the profile param
+#
+# The loop under test wraps each stage in
+#     if prof: hooks.begin('draw')
+#     ...
+#     if prof: hooks.end()
+# with prof = hooks.active taken once per sweep, so a run with nothing subscribed pays one local bool test per stage.
+# Collectors get every stage's wall time, plus the start and end of each sweep; begin() and end() leave the time
+# collectors spend out of the stage times.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import cProfile
+import collections
+import pstats
+import sys
+import threading
+import time
+import numpy as np
+
+clock = time.perf_counter
+
+# Stages of sweep() and the run loop of rsvp_sweep.py, in frame order
+stages = ['set generation', 'image assignment', 'input polling', 'edge check', 'draw', 'deferred', 'wait', 'flip', 'log write', 'staircase update']
+
+
+# 1. Hooks
+# Collectors implement any of sweep_start(trial), stage(name, duration, trial), sweep_end(trial) and report(prefix)
+class Collector(object):
+    def sweep_start(self, trial):
+        pass
+
+    def stage(self, name, duration, trial):
+        pass
+
+    def sweep_end(self, trial):
+        pass
+
+    def report(self, prefix = None):
+        pass
+
+class Hooks(object):
+    def __init__(self):
+        self.collectors = []
+        self.active = False
+        self.trial = 0
+        self.current = None             # Stage running now, for sampling profilers
+        self.t_begin = None
+
+    def subscribe(self, collector):
+        self.collectors.append(collector)
+        self.active = True
+
+    def unsubscribe(self, collector):
+        self.collectors.remove(collector)
+        self.active = len(self.collectors) > 0
+
+    def sweep_start(self, trial):
+        self.trial = trial
+        for collector in self.collectors:
+            collector.sweep_start(trial)
+
+    def sweep_end(self):
+        for collector in self.collectors:
+            collector.sweep_end(self.trial)
+
+    def begin(self, name):
+        self.current = name
+        self.t_begin = clock()
+
+    def end(self):
+        duration = clock() - self.t_begin
+        for collector in self.collectors:
+            collector.stage(self.current, duration, self.trial)
+        self.current = None
+
+    def report(self, prefix = None):
+        for collector in self.collectors:
+            collector.report(prefix)
+
+
+# 2. Stage timer
+# Wall times per stage, summarised against the frame period and saved as histograms on log-spaced bins
+class StageTimer(Collector):
+    def __init__(self, frame_period = 1 / 60, bins = np.logspace(-6, -1, 51)):
+        self.frame_period = frame_period
+        self.bins = bins
+        self.times = collections.defaultdict(list)
+
+    def stage(self, name, duration, trial):
+        self.times[name].append(duration)
+
+    def summary(self):
+        rows = []
+        for name in sorted(self.times, key = lambda name: stages.index(name) if name in stages else len(stages)):
+            times = np.array(self.times[name]) * 1000
+            rows.append({'stage': name, 'count': len(times), 'mean_ms': times.mean(), 'median_ms': np.median(times),
+                         'p95_ms': np.percentile(times, 95), 'p99_ms': np.percentile(times, 99), 'max_ms': times.max(),
+                         'budget_pct': 100 * times.mean() / (1000 * self.frame_period)})
+        return rows
+
+    def report(self, prefix = None):
+        print('Stage wall time (ms); budget = mean as %% of a %.2f ms frame:' % (1000 * self.frame_period))
+        print('  %-18s %8s %8s %8s %8s %8s %8s %8s' % ('stage', 'count', 'mean', 'median', 'p95', 'p99', 'max', 'budget'))
+        for row in self.summary():
+            print('  %-18s %8i %8.3f %8.3f %8.3f %8.3f %8.3f %7.1f%%' % (row['stage'], row['count'], row['mean_ms'], row['median_ms'],
+                                                                       row['p95_ms'], row['p99_ms'], row['max_ms'], row['budget_pct']))
+        if prefix is not None:
+            profile_file = open(prefix + '_profile.csv', 'w')
+            profile_file.write('stage,count,mean_ms,median_ms,p95_ms,p99_ms,max_ms,' +
+                               ','.join(['le_%gms' % (1000 * edge) for edge in self.bins[1:]]) + ',over\n')
+            for row in self.summary():
+                counts = np.histogram(self.times[row['stage']], bins = np.concatenate([self.bins, [np.inf]]))[0]
+                counts[0] += np.sum(np.array(self.times[row['stage']]) < self.bins[0])
+                profile_file.write('%s,%i,%f,%f,%f,%f,%f,%s\n' % (row['stage'], row['count'], row['mean_ms'], row['median_ms'],
+                                                                  row['p95_ms'], row['p99_ms'], row['max_ms'], ','.join([str(c) for c in counts])))
+            profile_file.close()
+
+
+# 3. Sweep profiler
+# mode 'cprofile' runs cProfile over sweep `trial`; mode 'sample' samples the stack of the thread running the sweep
+# every `interval` seconds from a background thread, which perturbs the sweep less than cProfile's per-call tracing
+class SweepProfiler(Collector):
+    def __init__(self, trial, mode = 'cprofile', interval = 0.001, hooks = None, n_top = 25):
+        if mode not in ['cprofile', 'sample']:
+            raise Exception('Error: Profiler mode must be cprofile or sample, not %s' % mode)
+        self.trial = trial
+        self.mode = mode
+        self.interval = interval
+        self.hooks = hooks
+        self.n_top = n_top
+        self.profile = None
+        self.samples = collections.Counter()
+        self.stage_samples = collections.Counter()
+        self.sampling = False
+        self.thread = None
+
+    def sweep_start(self, trial):
+        if trial != self.trial:
+            return
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampling = True
+            self.thread = threading.Thread(target = self._sample, args = (threading.get_ident(),))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _sample(self, thread_id):
+        while self.sampling:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self.samples['%s:%i(%s)' % (code.co_filename, frame.f_lineno, code.co_name)] += 1
+                if self.hooks is not None:
+                    self.stage_samples[self.hooks.current] += 1
+            time.sleep(self.interval)
+
+    def sweep_end(self, trial):
+        if trial != self.trial:
+            return
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            self.sampling = False
+            self.thread.join()
+
+    def report(self, prefix = None):
+        if self.mode == 'cprofile':
+            if self.profile is None:
+                return
+            print('cProfile of sweep %i:' % self.trial)
+            pstats.Stats(self.profile).sort_stats('cumulative').print_stats(self.n_top)
+            if prefix is not None:
+                self.profile.dump_stats(prefix + '_sweep%i.prof' % self.trial)
+            return
+        n = sum(self.samples.values())
+        if n == 0:
+            return
+        print('Sampled sweep %i every %.1f ms: %i samples' % (self.trial, 1000 * self.interval, n))
+        if self.stage_samples:
+            print('  By stage: ' + ', '.join(['%s %.1f%%' % (name if name is not None else 'between stages', 100 * count / n)
+                                              for name, count in self.stage_samples.most_common()]))
+        for line, count in self.samples.most_common(self.n_top):
+            print('  %6.2f%%  %s' % (100 * count / n, line))
+        if prefix is not None:
+            sample_file = open(prefix + '_sweep%i_samples.csv' % self.trial, 'w')
+            sample_file.write('line,samples\n')
+            for line, count in self.samples.most_common():
+                sample_file.write('"%s",%i\n' % (line, count))
+            sample_file.close()
+
+
+# 4. Set up hooks from the profile param
+# Items: stages, cprofile:N or sample:N (N = sweep number); an empty list subscribes nothing
+def get_hooks(profile, frame_period = 1 / 60):
+    hooks = Hooks()
+    for item in profile:
+        item = item.strip()
+        if item == '':
+            continue
+        if item == 'stages':
+            hooks.subscribe(StageTimer(frame_period = frame_period))
+        elif ':' in item and item.split(':')[0] in ['cprofile', 'sample'] and item.split(':')[1].isdigit():
+            hooks.subscribe(SweepProfiler(int(item.split(':')[1]), mode = item.split(':')[0], hooks = hooks))
+        else:
+            raise Exception('Error: Unknown profile item %s; use stages, cprofile:N or sample:N' % item)
+    return hooks
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# psy_status.py
+#
+# Live run state in shared memory, for an operator console in another process
+# 1. Layout of the status block
+# 2. Status board: the experiment publishes its state
+# 3. Status reader: the console reads consistent snapshots
+#
+# The block is written by one process only and never locked. A sequence number before the fields is odd while
+# they are being written: publish() bumps it, packs every field in one struct.pack_into and bumps it again, and
+# a reader retries until it sees the same even number before and after copying the block.
+# Accessory/operator_console.py displays the block.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import struct
+import time
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+default_name = 'rsvp_sweep_status'
+
+
+# 1. Layout
+# (name, struct format, initial value); strings are utf-8, cut or padded to their length
+fields = [('state', '12s', 'startup'),           # startup, waiting, sweep, between (sweeps), done
+          ('run', 'i', 0),
+          ('trial', 'i', 0),
+          ('n_trials', 'i', 0),
+          ('bar', 'i', 0),
+          ('n_bars', 'i', 0),
+          ('direct', '4s', ''),
+          ('dur_idx', 'i', 0),
+          ('stim_ms', 'i', 0),
+          ('correct', 'i', 0),                  # Hits in the current sweep
+          ('total', 'i', 0),                    # Targets counted so far in the current sweep
+          ('false_pos', 'i', 0),
+          ('dropped', 'i', 0),                  # Dropped frames in the run
+          ('last_rt', 'd', float('nan')),       # Seconds
+          ('last_accuracy', 'd', float('nan')), # Accuracy of the last finished sweep, in %
+          ('pulses', 'i', 0),
+          ('run_time', 'd', 0.0),               # Seconds since the start of the run
+          ('updated', 'd', 0.0)]                # time.time() of the last update
+header = struct.Struct('<Q')
+layout = struct.Struct('<' + ''.join([fmt for (name, fmt, value) in fields]))
+names = [name for (name, fmt, value) in fields]
+text_fields = [name for (name, fmt, value) in fields if fmt.endswith('s')]
+size = header.size + layout.size
+
+
+# 2. Status board
+class StatusBoard(object):
+    def __init__(self, name = default_name):
+        if shared_memory is None:
+            raise Exception('Error: The status board needs Python 3.8 or later (multiprocessing.shared_memory)')
+        try:
+            self.shm = shared_memory.SharedMemory(name = name, create = True, size = size)
+        except FileExistsError:                 # Left over from a run that died; take it over
+            self.shm = shared_memory.SharedMemory(name = name)
+            if self.shm.size < size:
+                raise Exception('Error: Shared memory block %s exists with a different layout' % name)
+        self.seq = 0
+        self.values = {name: value for (name, fmt, value) in fields}
+        self.publish()
+
+    # Update some fields and write the whole block
+    def publish(self, **values):
+        self.values.update(values)
+        self.values['updated'] = time.time()
+        packed = [self.values[name].encode('utf-8') if name in text_fields else self.values[name] for name in names]
+        buf = self.shm.buf
+        self.seq += 1
+        header.pack_into(buf, 0, self.seq)
+        layout.pack_into(buf, header.size, *packed)
+        self.seq += 1
+        header.pack_into(buf, 0, self.seq)
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# 3. Status reader
+class StatusReader(object):
+    def __init__(self, name = default_name):
+        if shared_memory is None:
+            raise Exception('Error: The status reader needs Python 3.8 or later (multiprocessing.shared_memory)')
+        self.shm = shared_memory.SharedMemory(name = name)
+        try:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')     # Only the experiment may remove the block
+        except (AttributeError, KeyError):
+            pass
+
+    # Consistent snapshot as a dict, or None if the block kept changing for `tries` attempts
+    def read(self, tries = 100):
+        buf = self.shm.buf
+        for attempt in list(range(0, tries)):
+            before = header.unpack_from(buf, 0)[0]
+            if before % 2 == 1:
+                continue
+            data = bytes(buf[header.size:size])
+            if header.unpack_from(buf, 0)[0] == before:
+                values = dict(zip(names, layout.unpack(data)))
+                for name in text_fields:
+                    values[name] = values[name].rstrip(b'\0').decode('utf-8', 'replace')
+                return values
+        return None
+
+    def close(self):
+        self.shm.close()
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# psy_timing.py
+#
+# Frame scheduling on flip timestamps for psychopy frame loops
+# 1. Frame scheduler: plan frames from a start time, date every flip, count dropped frames
+# 2. Low-CPU waits until a planned time
+# 3. Refresh rate: measure the display and match it to a supported rate (60, 100, 120 or 144 Hz)
+# 4. Scanner pulse log: TR grid from MRI pulses, drift corrections for planned onsets
+# 5. Startup phases: where the time before the first frame goes
+# 6. Real-time mode: garbage collection held off during sweeps, process priority, CPU affinity, locked memory
+# 7. Frame jitter: flip interval statistics of scheduled frames
+# 8. Slack scheduler: deferrable work run in the time left before each flip, earliest deadline first
+#
+# Frame n of a schedule is due at t0 + n * period. The first flip fixes t0 to the refresh it landed on,
+# rounded to whole frames from the planned start, so the schedule keeps the display's refresh phase
+# and a late first flip counts as dropped frames instead of shifting the schedule.
+# period starts at 1 / fps from the one-off measurement and is then re-estimated from the intervals between
+# the flips of each schedule (total time over total refreshes), so an error in the measured rate does not build
+# up over a sweep as phantom dropped or held frames.
+# After each flip, `frame` is the index of the refresh the flip landed on; callers skip drawing
+# frames with an index at or below it and so catch up on drops instead of drifting.
+#
+# Flip timestamps come from win.flip(), which dates the swap on psychopy.logging.defaultClock
+# (psychopy.core.monotonicClock). They are in that clock's time base, not time.time() or core.getTime().
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import ctypes
+import ctypes.util
+import gc
+import heapq
+import os
+import platform
+import time
+import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    from psychopy import core
+    default_clock = core.monotonicClock
+except ImportError:
+    core = None
+    default_clock = None
+
+
+# 1. Frame scheduler
+class FrameScheduler(object):
+    def __init__(self, win, fps, clock = default_clock, fit_after = 30):
+        self.win = win
+        self.fps = fps
+        self.period = 1 / fps
+        self.clock = clock
+        self.fit_after = fit_after      # Refreshes timed before the fitted period replaces 1 / fps
+        self.fit_time = 0.0             # Seconds and refreshes between flips of the same schedule
+        self.fit_frames = 0
+        self.t0 = 0
+        self.frame = -1
+        self.dropped = 0                # Frames dropped since the scheduler was created
+        self.flips = 0                  # Flips since the scheduler was created
+        self.last_flip = None
+        self.flip_log = None            # Set to a list to append every flip timestamp to it
+
+    def now(self):
+        return self.clock.getTime()
+
+    # Plan frame 0 of a new schedule at t_plan; Nothing has been flipped in it yet
+    def start(self, t_plan):
+        self.t0 = t_plan
+        self.frame = -1
+
+    # Planned time of a frame of the current schedule
+    def time_of(self, frame):
+        return self.t0 + frame * self.period
+
+    # Flip the window; Returns the flip timestamp
+    def flip(self):
+        t = self.win.flip()
+        if t is None:
+            t = self.now()
+        if self.frame < 0:
+            self.t0 = t - round((t - self.t0) / self.period) * self.period
+        elif self.last_flip is not None:
+            self.fit(t - self.last_flip)
+        frame = max(self.frame + 1, int(round((t - self.t0) / self.period)))
+        self.dropped += frame - self.frame - 1
+        self.frame = frame
+        self.flips += 1
+        self.last_flip = t
+        if self.flip_log is not None:
+            self.flip_log.append(t)
+        return t
+
+    # Add the interval dt since the last flip to the period estimate; t0 moves so the last flipped frame keeps its time
+    def fit(self, dt):
+        n = int(round(dt / self.period))
+        if n < 1:
+            return
+        self.fit_time += dt
+        self.fit_frames += n
+        if self.fit_frames >= self.fit_after:
+            period = self.fit_time / self.fit_frames
+            self.t0 += self.frame * (self.period - period)
+            self.period = period
+
+    # Move the rest of the schedule by dt seconds. Later: frames are held until they are due.
+    # Earlier: frames whose new time has passed are skipped without counting as dropped.
+    def shift(self, dt):
+        self.t0 += dt
+        if self.last_flip is not None and self.frame >= 0:
+            self.frame = max(0, int(round((self.last_flip - self.t0) / self.period)))
+
+    # Hold a frame that is more than one refresh early, so its flip lands on its planned refresh
+    def pace(self, frame):
+        self.wait_until(self.time_of(frame) - self.period)
+
+
+    # 2. Low-CPU waits
+    # Sleep until t, spinning only for the last `hog` seconds
+    def wait_until(self, t, hog = 0.002):
+        remaining = t - self.now()
+        if remaining <= 0:
+            return
+        if core is not None:
+            core.wait(remaining, hogCPUperiod = hog)
+        else:
+            time.sleep(remaining)
+
+
+# 3. Refresh rate
+# Nominal rates the frame and stimulus duration tables can be built for
+supported_rates = [60, 100, 120, 144]
+
+# Measured refresh rate of the window and the nearest supported rate, or None if no supported rate is within
+# tolerance Hz. The measurement averages n_identical consecutive frame intervals that agree within 1 ms.
+def measure_refresh_rate(win, rates = supported_rates, tolerance = 2, n_identical = 60, n_max_frames = 360):
+    measured = win.getActualFrameRate(nIdentical = n_identical, nMaxFrames = n_max_frames, nWarmUpFrames = 20, threshold = 1)
+    if measured is None:
+        return None, None
+    nominal = min(rates, key = lambda rate: abs(rate - measured))
+    if abs(nominal - measured) > tolerance:
+        return None, measured
+    return nominal, measured
+
+
+# 4. Scanner pulse log
+# Pulse times (same clock as the frame scheduler) and their TR index counted from a reference pulse.
+# The predicted time of a TR is the mean over the last n_recent pulses of pulse time + whole TRs to it,
+# which follows clock drift between the scanner and this computer without passing on the jitter of one pulse.
+class PulseLog(object):
+    def __init__(self, tr, n_recent = 4, max_age = 3):
+        self.tr = tr
+        self.n_recent = n_recent
+        self.max_age = max_age          # TRs after the latest pulse beyond which pulses count as stopped
+        self.ref = None
+        self.times = []
+
+    # Time of the pulse that starts the TR grid (TR 0)
+    def set_reference(self, t):
+        self.ref = t
+
+    def add(self, t):
+        self.times.append(t)
+
+    def index_of(self, t):
+        return int(round((t - self.ref) / self.tr))
+
+    # Pulse-predicted time of the TR grid point nearest t_planned minus t_planned, or None without recent pulses
+    def correction(self, t_planned):
+        if self.ref is None or len(self.times) == 0:
+            return None
+        if t_planned - self.times[-1] > self.max_age * self.tr:
+            return None
+        n = self.index_of(t_planned)
+        recent = self.times[-self.n_recent:]
+        predicted = sum([t + (n - self.index_of(t)) * self.tr for t in recent]) / len(recent)
+        return predicted - t_planned
+
+    # Pulses counted, TRs without a pulse between the first and last one, and the scanner TR
+    # measured from the pulses relative to the nominal TR, in parts per million
+    def summary(self):
+        if self.ref is None or len(self.times) < 2:
+            return {'n_pulses': len(self.times), 'missed': 0, 'drift_ppm': float('nan')}
+        idx = [self.index_of(t) for t in self.times]
+        slope = np.polyfit(idx, self.times, 1)[0]
+        return {'n_pulses': len(self.times),
+                'missed': idx[-1] - idx[0] + 1 - len(set(idx)),
+                'drift_ppm': (slope / self.tr - 1) * 1e6}
+
+
+# 5. Startup phases
+# Wall time between successive marks, from `start` (e.g. a time.perf_counter() taken before the heavy imports)
+class PhaseTimer(object):
+    def __init__(self, start = None):
+        if start is None:
+            start = time.perf_counter()
+        self.start = start
+        self.last = start
+        self.phases = []                # (name, seconds)
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.start
+
+    def print_phases(self):
+        print('Startup phases (s):')
+        for name, duration in self.phases:
+            print('  %-24s %7.3f' % (name, duration))
+        print('  %-24s %7.3f' % ('total', self.total()))
+
+
+# 6. Real-time mode
+# enter() raises the process priority (psychopy's core.rush), pins the process to `cores` and locks its memory pages,
+# as far as the OS and the user's permissions allow; status says what took effect. sweep_start() collects garbage
+# and then freezes and disables the cyclic garbage collector, so it cannot pause a frame; call it in the static
+# period before a sweep. sweep_end() turns the collector back on. Reference counting still frees most objects.
+class RealTimeMode(object):
+    def __init__(self, cores = None, priority = True, lock_memory = True):
+        self.cores = cores
+        self.priority = priority
+        self.lock_memory = lock_memory
+        self.status = {}
+        self.old_affinity = None
+        self.libc = None
+        self.gc_pauses = []             # Seconds spent collecting before each sweep
+
+    def enter(self):
+        if self.priority:
+            if core is not None:
+                self.status['priority'] = 'raised' if core.rush(True) else 'not supported'
+            else:
+                try:
+                    os.nice(-10)
+                    self.status['priority'] = 'nice -10'
+                except (AttributeError, OSError) as error:
+                    self.status['priority'] = 'failed (%s)' % error
+        if self.cores:
+            try:
+                if hasattr(os, 'sched_setaffinity'):
+                    self.old_affinity = os.sched_getaffinity(0)
+                    os.sched_setaffinity(0, self.cores)
+                elif psutil is not None:
+                    self.old_affinity = psutil.Process().cpu_affinity()
+                    psutil.Process().cpu_affinity(list(self.cores))
+                else:
+                    raise OSError('needs psutil on this OS')
+                self.status['affinity'] = 'cores ' + ','.join([str(c) for c in self.cores])
+            except (AttributeError, OSError, ValueError) as error:
+                self.status['affinity'] = 'failed (%s)' % error
+        if self.lock_memory:
+            self.status['memory'] = self._lock()
+        return self.status
+
+    # mlockall() on Linux and macOS. Pages mapped later are only locked too (MCL_FUTURE) when the locked memory
+    # limit is unlimited, since past the limit new allocations would fail.
+    def _lock(self):
+        if platform.system() == 'Windows':
+            return 'not supported on Windows'
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return 'failed (no libc)'
+        self.libc = ctypes.CDLL(libc_name, use_errno = True)
+        flags = 1                       # MCL_CURRENT
+        if resource is not None and resource.getrlimit(resource.RLIMIT_MEMLOCK)[0] == resource.RLIM_INFINITY:
+            flags |= 2                  # MCL_FUTURE
+        if self.libc.mlockall(flags) != 0:
+            self.libc = None
+            return 'failed (%s)' % os.strerror(ctypes.get_errno())
+        return 'locked' + (' (current and future pages)' if flags & 2 else ' (current pages)')
+
+    def exit(self):
+        self.sweep_end()
+        if self.priority and core is not None:
+            core.rush(False)
+        if self.old_affinity is not None:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, self.old_affinity)
+            else:
+                psutil.Process().cpu_affinity(self.old_affinity)
+            self.old_affinity = None
+        if self.libc is not None:
+            self.libc.munlockall()
+            self.libc = None
+
+    def sweep_start(self):
+        t = time.perf_counter()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        gc.disable()
+        self.gc_pauses.append(time.perf_counter() - t)
+
+    def sweep_end(self):
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        gc.enable()
+
+
+# 7. Frame jitter
+# Flip interval statistics from a list of flip timestamps, against a frame period
+def jitter_stats(flip_times, period):
+    intervals = np.diff(np.array(flip_times))
+    if len(intervals) == 0:
+        return {'n': 0, 'sd_ms': float('nan'), 'max_ms': float('nan'), 'p99_ms': float('nan'), 'late': 0}
+    return {'n': len(intervals),
+            'sd_ms': float(1000 * intervals.std()),
+            'max_ms': float(1000 * intervals.max()),
+            'p99_ms': float(1000 * np.percentile(intervals, 99)),
+            'late': int(np.sum(intervals > 1.5 * period))}
+
+# Flip n_frames scheduled frames, calling draw() before each, and return their jitter statistics
+def measure_jitter(scheduler, n_frames = 300, draw = None):
+    flip_times = []
+    scheduler.start(scheduler.now() + scheduler.period)
+    for frame in list(range(0, n_frames)):
+        if draw is not None:
+            draw()
+        scheduler.pace(frame)
+        flip_times.append(scheduler.flip())
+    return jitter_stats(flip_times, scheduler.period)
+
+
+# 8. Slack scheduler
+# Jobs are submitted with a deadline frame of the current schedule: they run at the latest in the run() call of that
+# frame. run(frame), called after a frame is drawn and before it is flipped, runs queued jobs in deadline order
+# while the next one's expected cost fits in the time left until `margin` before the frame's flip, and runs jobs that
+# are due whatever time is left. Costs are learnt per job name (the longest recent duration), so work moves to frames
+# with spare time and only lands on a busy frame when its deadline leaves no other choice.
+class SlackScheduler(object):
+    def __init__(self, scheduler, margin = 0.003, decay = 0.95):
+        self.scheduler = scheduler
+        self.margin = margin
+        self.decay = decay
+        self.queue = []
+        self.seq = 0
+        self.cost = {}
+        self.counts = {}                # name: [run in slack, run at deadline, overran the margin]
+
+    def submit(self, deadline, name, func, *args, **kwargs):
+        heapq.heappush(self.queue, (deadline, self.seq, name, func, args, kwargs))
+        self.seq += 1
+
+    def _run_next(self, due, t_limit = None):
+        deadline, seq, name, func, args, kwargs = heapq.heappop(self.queue)
+        start = self.scheduler.now()
+        func(*args, **kwargs)
+        end = self.scheduler.now()
+        self.cost[name] = max(end - start, self.cost.get(name, 0) * self.decay)
+        counts = self.counts.setdefault(name, [0, 0, 0])
+        counts[1 if due else 0] += 1
+        if t_limit is not None and end > t_limit:
+            counts[2] += 1
+
+    def run(self, frame):
+        t_limit = self.scheduler.time_of(frame) - self.margin
+        while self.queue:
+            deadline, seq, name = self.queue[0][0:3]
+            due = deadline <= frame
+            if not due and self.scheduler.now() + self.cost.get(name, 0) > t_limit:
+                break
+            self._run_next(due, t_limit)
+
+    # Run everything still queued, in deadline order
+    def flush(self):
+        while self.queue:
+            self._run_next(True)
+
+    def stats(self):
+        return {name: {'slack': c[0], 'deadline': c[1], 'overran': c[2], 'cost_ms': round(1000 * self.cost[name], 3)}
+                for name, c in self.counts.items()}
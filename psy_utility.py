@@ -7,6 +7,7 @@
 # 2. Enter session info
 # 3. Check for Data folders; Initialize data file
 # 4. Setup eyetracker configuration info to pass into the main experiment script
+# 5. Run slow startup work in the background
 #
 # Created: 12/13/21
 # Updated: 12/15/21
@@ -17,12 +18,18 @@
 
 
 # 0. Load modules
-from psychopy import gui
+# psychopy is only needed for the dialogs, so offline tools can still use get_params without it
+try:
+    from psychopy import gui
+except ImportError:
+    gui = None
 from datetime import datetime
 from os.path import abspath
 from inspect import getsourcefile
 import os.path
 import platform
+import threading
+import time
 
 
 # 1. Load experiment parameters from exp_params.txt
@@ -210,3 +217,30 @@ def config_et(params, edf_filename, mac):
     
     return tracker_config
 
+
+# 5. Run slow startup work in the background
+# Starts fn(*args) on a daemon thread, e.g. while a dialog is open; result() waits for it and re-raises its error
+class BackgroundTask(object):
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+        self.value = None
+        self.error = None
+        self.duration = None            # Seconds fn ran for
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.value = self.fn(*self.args)
+        except Exception as error:
+            self.error = error
+        self.duration = time.perf_counter() - start
+
+    def result(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+#
+# rsvp_design.py
+#
+# Reconstruct the design of rsvp_sweep.py from rsvp_params.txt or a recorded stimlog, without psychopy
+# 1. Load experiment parameters from rsvp_params.txt
+# 2. Frame and stimulus duration tables
+# 3. Sweep and run timing
+# 4. Bar positions
+# 5. Nominal set plan
+# 6. Read stimlog files
+# 7. Target presentation: the set schedule of sweep() and a vectorized simulation of its target logic
+# 8. Staircase: the stimulus duration rule applied after each sweep
+# 9. Checkerboard bars: contrast-reversing texture bank for stim_mode = checkerboard
+# 10. Static overlay: fixation target and bore masks rasterized into one texture
+#
+# Everything here mirrors the arithmetic in rsvp_sweep.py and Accessory/get_timing.py,
+# so offline tools (synthetic data, preprocessing, simulators) agree with what the experiment does.
+#
+# Created: 10/19/26
+# Curtis Lab
+# New York University
+# >------------------------------------------------------------<
+
+
+# 0. Load modules
+import math
+import numpy as np
+import psy_utility as psyut
+
+
+types = ['L2R', 'T2B', 'R2L', 'B2T']
+type_names = {'L2R': 'Left to Right', 'T2B': 'Top to Bottom', 'R2L': 'Right to Left', 'B2T': 'Bottom to Top'}
+end_blank = 13          # Blank screen at the end of a run, in seconds
+stimlog_header = 'trial,barOnset,imageOnset,direct,i1img,i1x,i1y,i2img,i2x,i2y,i3img,i3x,i3y,i4img,i4x,i4y,i5img,i5x,i5y,i6img,i6x,i6y,t,targ_here,targ_img,targ_slot,RT\n'
+
+
+# 1. Load experiment parameters from rsvp_params.txt
+# Same list processing and geometry as sections 1 and 4 of rsvp_sweep.py
+def load_params(params_filename = 'rsvp_params.txt'):
+    params = psyut.get_params(params_filename = params_filename)
+    params['screen_res'] = [int(i) for i in params['screen_res']]
+    params['stim_bounds'] = [int(j) for j in params['stim_bounds']]
+    if params['constrained_set'] == ['']: params['constrained_set'] = []
+    else: params['constrained_set'] = [int(k) for k in params['constrained_set']]
+    params['background_color'] = [int(l) for l in params['background_color']]
+    params['text_color'] = [int(m) for m in params['text_color']]
+    params['fix_color'] = [int(n) for n in params['fix_color']]
+    params['image_h'] = params['stim_bounds'][1] / 6
+    params['screen_width'] = params['screen_height'] * params['screen_res'][0] / params['screen_res'][1]
+    params['screen_h_deg'] = 180 / math.pi * np.arctan(params['screen_height'] / (2 * params['view_dist']))
+    params['screen_w_deg'] = 180 / math.pi * np.arctan(params['screen_width'] / (2 * params['view_dist']))
+    params['ppd'] = params['screen_res'][1] / params['screen_h_deg']
+    return params
+
+
+# 2. Frame and stimulus duration tables
+# Bar b of a sweep starts on flip bar_frames[b] after the sweep onset; the last entry ends the sweep
+def get_bar_frames(bar_dur, n_bars, frame_rate):
+    return [int(round(b * bar_dur * frame_rate)) for b in list(range(0, n_bars + 1))]
+
+# frames_per_set[i] frames per set gives set_list[i] sets per bar and a duration of time_list[i] ms, 150 to 600 ms.
+# The tables come from the nominal fps only, so a display runs the same design every run. set_list counts the sets
+# that fit in bar_dur * fps less bar_margin frames, for bars built from a measured rate that come out a frame short
+# (check_frame_tables confirms they fit); sweep() generates no more than set_list[i] sets in any bar.
+bar_margin = 1
+
+def get_frame_tables(fps, bar_dur):
+    sweep_rate = bar_dur * fps - bar_margin
+    frames_per_set = []
+    set_list = []
+    time_list = []
+    min_frames_per_set = math.ceil(150 * fps / 1000)
+    max_frames_per_set = math.floor(600 * fps / 1000)
+    for i in list(range(min_frames_per_set, max_frames_per_set + 1)):
+        frames_per_set.append(i)
+        set_list.append(math.trunc(sweep_rate / i))
+        time_list.append(math.trunc(i * 1000 / fps))
+    return frames_per_set, set_list, time_list
+
+# Stimulus durations whose sets do not fit in the shortest bar built from the measured frame_rate:
+# [(dur_idx, bar frames, frames needed)]; sweep() would cut the last sets of those bars short
+def check_frame_tables(params, fps, frame_rate):
+    bar_dur = params['tr_per_bar'] * params['tr']
+    frames_per_set, set_list, time_list = get_frame_tables(fps, bar_dur)
+    shortest = int(min(np.diff(get_bar_frames(bar_dur, params['n_bars'], frame_rate))))
+    return [(i, shortest, set_list[i] * frames_per_set[i]) for i in list(range(0, len(frames_per_set)))
+            if set_list[i] * frames_per_set[i] > shortest]
+
+
+# 3. Sweep and run timing
+# Set onsets within one sweep, exactly as computed at the top of sweep()
+# fps defaults to the refresh_rate param, or 60 Hz for params files from before it existed
+def get_sweep_timing(params, dur_idx, fps = None):
+    if fps is None:
+        fps = params.get('refresh_rate', 60)
+    bar_dur = params['tr_per_bar'] * params['tr']
+    frames_per_set, set_list, time_list = get_frame_tables(fps, bar_dur)
+    sets_per_bar = set_list[dur_idx]
+    stim_dur = time_list[dur_idx] / 1000
+    total_sets = sets_per_bar * params['n_bars']
+    gap = bar_dur - (stim_dur * sets_per_bar)
+    set_timings = [0, stim_dur]
+    set_bar_num = [1, 1]
+    y = 1
+    for i in list(range(2, total_sets + 2)):
+        x = set_timings[i - 1] + stim_dur
+        if i % sets_per_bar == 0:
+            x += gap
+            y += 1
+        set_timings.append(x)
+        set_bar_num.append(y)
+    return {'refresh_rate': frames_per_set[dur_idx],
+            'sets_per_bar': sets_per_bar,
+            'stim_dur': stim_dur,
+            'total_sets': total_sets,
+            'set_timings': set_timings,
+            'set_bar_num': set_bar_num,
+            'sweep_dur': set_timings[-2]}
+
+# Planned onset of sweep x (from 0) in seconds from TR 0, as tOnset in the run loop of rsvp_sweep.py:
+# tRunStart + tr + x * (tr + n_bars * bar_dur). TR 0 is the reference pulse of the pulse log, the first MRI pulse
+# after the Get ready screen; tRunStart is the next pulse (1 TR later), or with extended_start the first pulse
+# after the 9.5 s wait, ceil(9.5 / tr) TRs later.
+def get_sweep_onset(params, x):
+    tr = params['tr']
+    run_start = math.ceil(9.5 / tr) * tr if params['extended_start'] else tr
+    return run_start + tr + x * (tr + params['n_bars'] * params['tr_per_bar'] * tr)
+
+# Number of TRs before the first sweep is loaded (TR 0 is the first MRI pulse)
+def get_lead_trs(params):
+    if params['extended_start']:
+        return 1 + math.ceil(9.5 / params['tr'])
+    return 2
+
+# Rows of (time, tr, stage, sweep, direction) matching Accessory/get_timing.py; None stands for '-'
+def get_run_timing(params):
+    tr = params['tr']
+    rows = []
+    if params['extended_start']:
+        tr_wait = math.ceil(9.5 / tr)
+        rows.append((None, None, 'Load program', None, None))
+        rows.append((0, 0, 'Get Ready! and wait for spacebar and MRI signal', None, None))
+        for i in list(range(1, tr_wait + 1)):
+            if i == tr_wait:
+                rows.append((i * tr, i, 'Wait for MRI signal', None, None))
+            else:
+                rows.append((i * tr, i, 'Fixate and Wait', None, None))
+    else:
+        rows.append((None, None, 'Load and wait for MRI signal', None, None))
+        rows.append((0, 0, None, None, None))
+        rows.append((tr, 1, 'Get ready message', None, None))
+    this_tr = get_lead_trs(params)
+    for sweep in list(range(0, params['n_trials'])):
+        direc = type_names[types[sweep % 4]]
+        rows.append((this_tr * tr, this_tr, 'Load stimuli', sweep + 1, direc))
+        this_tr += 1
+        for step in list(range(1, params['n_bars'] + 1)):
+            for k in list(range(0, params['tr_per_bar'])):
+                rows.append((this_tr * tr, this_tr, 'Step %i' % step, sweep + 1, direc))
+                this_tr += 1
+    return rows
+
+# Total number of TRs in the timing table
+def get_n_trs(params):
+    return get_lead_trs(params) + params['n_trials'] * (1 + params['tr_per_bar'] * params['n_bars'])
+
+
+# 4. Bar positions
+# Margins, starting positions and jump distances, as in section 6 of rsvp_sweep.py
+def get_positions(params):
+    image_h = params['stim_bounds'][1] / 6
+    l_marg = -1 * params['stim_bounds'][0] / 2 + image_h / 2
+    r_marg = params['stim_bounds'][0] / 2 - image_h / 2
+    t_marg = params['stim_bounds'][1] / 2 - image_h / 2
+    b_marg = -1 * params['stim_bounds'][1] / 2 + image_h / 2
+    spacing = np.array([2.5, 1.5, 0.5, -0.5, -1.5, -2.5]) * image_h
+    lr_dist = (r_marg - l_marg) / (params['n_bars'] - 1)
+    tb_dist = (t_marg - b_marg) / (params['n_bars'] - 1)
+    start = {'L2R': np.stack([np.full(6, l_marg), spacing], axis = 1),
+             'R2L': np.stack([np.full(6, r_marg), spacing], axis = 1),
+             'T2B': np.stack([spacing, np.full(6, t_marg)], axis = 1),
+             'B2T': np.stack([spacing, np.full(6, b_marg)], axis = 1)}
+    speed = {'L2R': np.array([lr_dist, 0]),
+             'R2L': np.array([-1 * lr_dist, 0]),
+             'T2B': np.array([0, -1 * tb_dist]),
+             'B2T': np.array([0, tb_dist])}
+    return {'image_h': image_h, 'l_marg': l_marg, 'r_marg': r_marg, 't_marg': t_marg, 'b_marg': b_marg,
+            'start': start, 'speed': speed}
+
+# Slot positions for every bar of a sweep; shape (n_bars, 6, 2)
+def get_bar_positions(params, direct):
+    pos = get_positions(params)
+    bars = np.arange(params['n_bars'])[:, None, None]
+    return pos['start'][direct][None, :, :] + bars * pos['speed'][direct][None, None, :]
+
+
+# 5. Nominal set plan
+# Every set of a run as the experiment schedules it, in the same layout as read_stimlog().
+# Onsets are relative to TR 0 (see get_sweep_onset); image numbers are unknown (-1).
+def get_set_plan(params, dur_idx, fps = None):
+    timing = get_sweep_timing(params, dur_idx, fps = fps)
+    n_sets = timing['total_sets']
+    set_timings = np.array(timing['set_timings'][0:n_sets])
+    bar_idx = np.array(timing['set_bar_num'][0:n_sets]) - 1
+    sweep_period = params['tr'] + timing['sweep_dur']
+    plan = {'trial': [], 'bar': [], 'barOnset': [], 'imageOnset': [], 'direct': [], 'x': [], 'y': [], 't': []}
+    for sweep in list(range(0, params['n_trials'])):
+        direct = types[sweep % 4]
+        positions = get_bar_positions(params, direct)[bar_idx]
+        onset = get_sweep_onset(params, sweep)
+        image_onset = onset + set_timings
+        plan['trial'].append(np.full(n_sets, sweep + 1))
+        plan['bar'].append(bar_idx + 1)
+        plan['barOnset'].append(onset + bar_idx * params['tr_per_bar'] * params['tr'])
+        plan['imageOnset'].append(image_onset)
+        plan['direct'].append(np.full(n_sets, direct))
+        plan['x'].append(positions[:, :, 0])
+        plan['y'].append(positions[:, :, 1])
+        plan['t'].append(set_timings + sweep * sweep_period)
+    plan = {key: np.concatenate(plan[key]) for key in plan}
+    plan['img'] = np.full(plan['x'].shape, -1)
+    plan['stim_dur'] = np.full(len(plan['trial']), timing['stim_dur'])
+    return plan
+
+
+# 6. Read stimlog files
+# Returns a dict of column arrays; the six image slots are gathered into (n, 6) arrays img, x and y.
+# The RT column is free text that may itself contain commas, so each row is split at most 26 times.
+# filename may also be an open text file, e.g. a member of a packed session's zip archive.
+def read_stimlog(filename):
+    with (open(filename) if isinstance(filename, str) else filename) as stim_log:
+        header = stim_log.readline()
+        rows = [line.rstrip('\n').split(',', 26) for line in stim_log if line.strip()]
+    if header != stimlog_header:
+        raise Exception('Error: %s is not an rsvp_sweep stimlog' % getattr(filename, 'name', filename))
+    if len(rows) == 0:
+        fields = np.zeros((0, 27), dtype = object)
+    else:
+        for row in rows:
+            row.extend([''] * (27 - len(row)))
+        fields = np.array(rows, dtype = object)
+    slots = fields[:, 4:22].reshape(-1, 6, 3)
+    return {'trial': fields[:, 0].astype(int),
+            'barOnset': fields[:, 1].astype(float),
+            'imageOnset': fields[:, 2].astype(float),
+            'direct': fields[:, 3].astype(str),
+            'img': slots[:, :, 0].astype(int),
+            'x': slots[:, :, 1].astype(float),
+            'y': slots[:, :, 2].astype(float),
+            't': fields[:, 22].astype(float),
+            'targ_here': fields[:, 23] == 'True',
+            'targ_img': fields[:, 24].astype(int),
+            'targ_slot': fields[:, 25].astype(int),
+            'RT': fields[:, 26].astype(str)}
+
+
+# 7. Target presentation
+# Targeting rules of sweep() per direction: slots a target may take on masked bars and which bars count as masked
+target_rules = {'L2R': {'max_slot': 5, 'mask_bar': lambda n_bars: [1, n_bars]},
+                'T2B': {'max_slot': 4, 'mask_bar': lambda n_bars: [1, n_bars + 1]},
+                'R2L': {'max_slot': 5, 'mask_bar': lambda n_bars: [1, n_bars]},
+                'B2T': {'max_slot': 4, 'mask_bar': lambda n_bars: [n_bars, n_bars]}}
+
+# Steps through the frame loop of sweep() without drawing, to find the order in which image sets are generated
+# and which of them reach the screen. Returns, per generated set index: the buffer ('a' or 'b') it is loaded into
+# and whether it is drawn; plus the set left in the hidden buffer when the bar leaves the stimulus bounds (sweep()
+# takes its target back out of `total`), or None if the loop ends without that break.
+# frame_rate is the display rate the bar frames are built from (the measured rate in rsvp_sweep.py).
+def get_set_schedule(params, dur_idx, direct, fps = None, frame_rate = None):
+    if fps is None:
+        fps = params.get('refresh_rate', 60)
+    if frame_rate is None:
+        frame_rate = fps
+    n_bars = params['n_bars']
+    bar_dur = params['tr_per_bar'] * params['tr']
+    timing = get_sweep_timing(params, dur_idx, fps = fps)
+    frames_per_set = timing['refresh_rate']
+    sets_per_bar = timing['sets_per_bar']
+    pos = get_positions(params)
+    a1_pos = pos['start'][direct][0].copy()
+    bar_frames = get_bar_frames(bar_dur, n_bars, frame_rate)
+    buffers = {'a': 0, 'b': 1}
+    schedule = [{'buffer': 'a', 'drawn': False}, {'buffer': 'b', 'drawn': False}]
+    show_buffer = False
+    loop_count = 1
+    next_set_idx = 1
+    bar_counter = 1
+    hidden_at_break = None
+    sweep_frame = 0
+    while sweep_frame < bar_frames[-1]:
+        bar_len = bar_frames[bar_counter] - bar_frames[bar_counter - 1]
+        frame = sweep_frame - bar_frames[bar_counter - 1] + 1
+        if frame % frames_per_set == 0 and loop_count <= sets_per_bar:
+            next_set_idx += 1
+            loop_count += 1
+            buffer = 'a' if show_buffer else 'b'
+            buffers[buffer] = next_set_idx
+            schedule.append({'buffer': buffer, 'drawn': False})
+        if frame == bar_len:
+            bar_counter += 1
+            a1_pos += pos['speed'][direct]
+        if (a1_pos[0] > pos['r_marg'] or a1_pos[0] < pos['l_marg'] or
+            a1_pos[1] < pos['b_marg'] or a1_pos[1] > pos['t_marg']):
+            hidden_at_break = buffers['a'] if show_buffer else buffers['b']
+            break
+        if loop_count <= sets_per_bar:
+            schedule[buffers['b'] if show_buffer else buffers['a']]['drawn'] = True
+        elif frame == bar_len:
+            loop_count = 1
+        if (frame + 1) % frames_per_set == 0 and loop_count <= sets_per_bar:
+            show_buffer = not show_buffer
+        sweep_frame += 1
+    return schedule, hidden_at_break
+
+# Runs the target logic of sweep() for n_sweeps sweeps of one direction at once, one generated set at a time
+# across all sweeps: the 1 / targ_rate draw, the targ_cooldown check against set_timings (from set 0 until the
+# first target), the bore_mask slot restrictions and the end-of-sweep correction of `total`.
+# Returns (n_sweeps, n_sets) arrays shown (a target was put in the set), slot (-1 without one) and drawn
+# (shown and reached the screen), the per-sweep `total` sweep() divides accuracy by, and the set timing.
+def simulate_targets(params, dur_idx, direct, n_sweeps, rng = None, bore_mask = None, fps = None, frame_rate = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    if bore_mask is None:
+        bore_mask = params['bore_mask']
+    timing = get_sweep_timing(params, dur_idx, fps = fps)
+    set_timings = timing['set_timings']
+    set_bar_num = timing['set_bar_num']
+    schedule, hidden_at_break = get_set_schedule(params, dur_idx, direct, fps = fps, frame_rate = frame_rate)
+    max_slot = target_rules[direct]['max_slot']
+    mask_bar = target_rules[direct]['mask_bar'](params['n_bars'])
+    n_sets = len(schedule)
+    shown = np.zeros((n_sweeps, n_sets), dtype = bool)
+    slot = np.full((n_sweeps, n_sets), -1, dtype = int)
+    last_targ_idx = np.zeros(n_sweeps, dtype = int)
+    timings = np.array(set_timings + [np.inf] * max(0, n_sets - len(set_timings)))
+    for k in list(range(0, n_sets)):
+        if k >= len(set_timings):
+            break
+        if k == 0:
+            eligible = np.ones(n_sweeps, dtype = bool)
+            masked = bore_mask and direct in ['L2R', 'T2B', 'R2L']
+        else:
+            if k == 1:
+                eligible = np.full(n_sweeps, timing['stim_dur'] > params['targ_cooldown']) | ~shown[:, 0]
+            else:
+                eligible = timings[k] - timings[last_targ_idx] > params['targ_cooldown']
+            masked = bore_mask and (set_bar_num[k] == mask_bar[0] or set_bar_num[k] >= mask_bar[1])
+        hit = eligible & (rng.integers(1, params['targ_rate'] + 1, n_sweeps) == 1)
+        if masked:
+            top = max_slot if schedule[k]['buffer'] == 'a' else 4
+            slots = rng.integers(1, top + 1, n_sweeps)
+        else:
+            slots = rng.integers(0, 6, n_sweeps)
+        shown[:, k] = hit
+        slot[:, k] = np.where(hit, slots, -1)
+        last_targ_idx = np.where(hit, k, last_targ_idx)
+    drawn = shown & np.array([entry['drawn'] for entry in schedule])[None, :]
+    total = shown.sum(axis = 1)
+    if hidden_at_break is not None:
+        total -= shown[:, hidden_at_break]
+    return {'shown': shown, 'slot': slot, 'drawn': drawn, 'total': total, 'set_timings': timings,
+            'set_bar_num': np.array(set_bar_num + [-1] * max(0, n_sets - len(set_bar_num))),
+            'schedule': schedule, 'hidden_at_break': hidden_at_break}
+
+
+# 8. Staircase
+# The rule in the main loop of rsvp_sweep.py: a sweep below stair_lower accuracy lengthens the stimulus duration by
+# one step, one at or above stair_upper shortens it. Takes and returns arrays of dur_idx, one per observer;
+# a nan accuracy (a sweep without counted targets, where sweep() raises ZeroDivisionError) leaves dur_idx unchanged.
+def update_staircase(dur_idx, accuracy, n_durations, stair_lower, stair_upper):
+    dur_idx = np.asarray(dur_idx)
+    accuracy = np.asarray(accuracy)
+    longer = (dur_idx < n_durations - 1) & (accuracy < stair_lower)
+    shorter = ~longer & (dur_idx > 0) & (accuracy >= stair_upper)
+    return dur_idx + longer.astype(int) - shorter.astype(int)
+
+
+# 9. Checkerboard bars
+# Every texture a checkerboard sweep shows, made once: shape (2 phases, 6 * size, size), a vertical bar of six image
+# slots with `checks` square checks across each slot, in psychopy's -1 (black) to 1 (white) range. Phase 1 is phase 0
+# with contrast reversed, so flicker is a swap between the two; horizontal bars are the transposes.
+def get_checker_bank(size, checks = 2, contrast = 1.0):
+    size = int(round(size))
+    rows, cols = np.indices((6 * size, size))
+    check = (rows * checks // size + cols * checks // size) % 2
+    phase = np.where(check == 1, contrast, -1 * contrast).astype(np.float32)
+    return np.stack([phase, -1 * phase])
+
+# Contrast reversals per second as a number of frames per phase, at least one
+def get_reversal_frames(frame_rate, checker_hz):
+    return max(1, int(round(frame_rate / checker_hz)))
+
+
+# 10. Static overlay
+feedback_color = [-1, 0.004, -1]        # psychopy's 'green' (0, 128, 0)
+
+# Fraction of each pixel (centres at `centers`) inside [low, high] along one axis
+def box_coverage(centers, low, high):
+    return np.clip(np.minimum(high, centers + 0.5) - np.maximum(low, centers - 0.5), 0, 1)
+
+# The fixation target of rsvp_sweep.py (circle, cross and dot, drawn in that order) and, with bore_mask, both bore
+# masks, as one texture the size of stim_bounds centred on the screen. Returns rgb (h, w, 3) and alpha (h, w) with
+# rows from the bottom up, as psychopy uploads numpy textures. Shapes keep the 1.5 px outline psychopy draws around
+# them (in the background colour, or fix_color for the dot); circles are supersampled ss x ss per pixel.
+def get_overlay(stim_bounds, image_h, fix_size, fix_color, background_color, bore_mask = False, feedback = False, ss = 4):
+    width, height = int(stim_bounds[0]), int(stim_bounds[1])
+    xs = np.arange(width) - width / 2 + 0.5
+    ys = np.arange(height) - height / 2 + 0.5
+    premult = np.zeros((height, width, 3))
+    alpha = np.zeros((height, width))
+    def layer(region, cover, color):
+        rows, cols = region
+        premult[rows, cols] = np.array(color)[None, None, :] * cover[..., None] + premult[rows, cols] * (1 - cover[..., None])
+        alpha[rows, cols] = cover + alpha[rows, cols] * (1 - cover)
+    line = 0.75                                                 # Half of psychopy's default lineWidth
+    if bore_mask:
+        half = image_h / 2 + line
+        for x in [-1 * width / 2 + image_h / 2, width / 2 - image_h / 2]:
+            cover = box_coverage(ys, height / 2 - image_h / 2 - half, height / 2 - image_h / 2 + half)[:, None] * box_coverage(xs, x - half, x + half)[None, :]
+            layer((slice(0, height), slice(0, width)), cover, background_color)
+    # Fixation on a patch around the centre, supersampled
+    size = image_h * fix_size
+    radius = int(np.ceil(size / 2 + 2))
+    rows = slice(max(0, height // 2 - radius), min(height, height // 2 + radius))
+    cols = slice(max(0, width // 2 - radius), min(width, width // 2 + radius))
+    sub_x = (xs[cols][:, None] + (np.arange(ss) + 0.5) / ss - 0.5).ravel()
+    sub_y = (ys[rows][:, None] + (np.arange(ss) + 0.5) / ss - 0.5).ravel()
+    dist = np.sqrt(sub_x[None, :] ** 2 + sub_y[:, None] ** 2)
+    def cover(inside):
+        return inside.reshape(len(sub_y) // ss, ss, len(sub_x) // ss, ss).mean(axis = (1, 3))
+    ax, ay = np.abs(sub_x[None, :]), np.abs(sub_y[:, None])
+    cross = ((ax <= 0.1 * size + line) & (ay <= 0.5 * size + line)) | ((ay <= 0.1 * size + line) & (ax <= 0.5 * size + line))
+    layer((rows, cols), cover(dist <= size / 2 - line), feedback_color if feedback else fix_color)
+    layer((rows, cols), cover(np.abs(dist - size / 2) <= line), background_color)
+    layer((rows, cols), cover(cross), background_color)
+    layer((rows, cols), cover(dist <= size / 8 + line), fix_color)
+    rgb = np.where(alpha[..., None] > 0, premult / np.maximum(alpha, 1e-9)[..., None], 0)
+    return rgb.astype(np.float32), alpha.astype(np.float32)
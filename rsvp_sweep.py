@@ -15,6 +15,14 @@
 # 10. Target presentation & peripheral calibration
 # 11. Instructions
 # 12. Run sweeps
+# Sections 10-12 repeat for every run of a session; the window, iohub, eyetracker and decoded stimuli are kept
+# Stimuli are decoded and the iohub/eyetracker modules imported while the session dialog is open; iohub is launched
+# once the stimuli are created and the refresh rate is measured. Startup phase timings are printed and saved to the summary.
+# The profile param subscribes psy_profile collectors to the stages of the sweep frame loop (nothing by default).
+# The operator_console param publishes the run state to Accessory/operator_console.py through shared memory.
+# The realtime param holds off garbage collection during sweeps, raises priority, pins cores and locks memory.
+# stim_mode = checkerboard shows contrast-reversing checkerboard bars, with only the target images, instead of object images; Slots without an image are logged as -1.
+# Image uploads, stimlog rows and status updates are deferred to the time left before each flip (psy_timing.SlackScheduler).
 #
 # Created: 2/21/20
 # Updated: 7/26/21
@@ -31,20 +39,19 @@
 # 6. turn waitBlanking = False in visual_win. won't wait for next frame if frame dropped
 # 7. save empirical timing data
 # 8. add experiment starting time and each bar/set duration as input
-# 9. Note that in testing mode, will take extra time to run RunTimeInfo
 # >------------------------------------------------------------<
 
 
 # 0. Load modules
 from __future__ import division, print_function
+import time
+tLaunch = time.perf_counter()                   # Start of the startup phase timings, before the heavy imports
 from psychopy import logging, core, visual, gui, event
-from psychopy.core import StaticPeriod, CountdownTimer
-from psychopy.iohub import launchHubServer
-from psychopy.info import RunTimeInfo
+from psychopy.core import StaticPeriod
 from datetime import datetime
 from inspect import getsourcefile
 from os.path import abspath
-import pylink
+from PIL import Image
 import os.path
 import platform
 import glob
@@ -52,8 +59,19 @@ import numpy as np
 import math
 import random
 import os
+import subprocess
+import sys
 import psy_utility as psyut
-import time
+import psy_input
+import psy_et
+import psy_journal
+import psy_profile
+import psy_status
+import psy_timing
+import rsvp_design
+import threading
+startup = psy_timing.PhaseTimer(tLaunch)
+startup.mark('imports')
 
 # 1. Load experiment parameters from rsvp_params.txt
 params = psyut.get_params(params_filename = 'rsvp_params.txt')
@@ -63,6 +81,9 @@ params['screen_res'] = [int(i) for i in params['screen_res']]
 params['stim_bounds'] = [int(j) for j in params['stim_bounds']]
 if params['constrained_set'] == ['']: params['constrained_set'] = []
 else: params['constrained_set'] = [int(k) for k in params['constrained_set']]
+if params['profile'] == ['']: params['profile'] = []
+if params['realtime_cores'] == ['']: params['realtime_cores'] = []
+else: params['realtime_cores'] = [int(c) for c in params['realtime_cores']]
 params['background_color'] = [int(l) for l in params['background_color']]
 params['text_color'] = [int(m) for m in params['text_color']]
 params['fix_color'] = [int(n) for n in params['fix_color']]
@@ -78,6 +99,7 @@ n_bars = params['n_bars']
 targ_cooldown = params['targ_cooldown']
 testing = params['testing']
 response_period = params['response_period']
+response_delay = params['response_delay']
 show_feedback = params['show_feedback']
 feedback_frames = params['feedback_frames']
 save_log = params['save_log']
@@ -86,11 +108,40 @@ stair_upper = params['stair_upper']
 targ_rate = params['targ_rate']
 response_key = params['response_key']
 bore_mask = params['bore_mask']
+fix_tolerance = params['fix_tolerance']
+checkerboard = params['stim_mode'] == 'checkerboard'
+no_image = -1                                   # Logged for checkerboard slots that show no image
 
-fps = 60                                        # Frame rate of display computer. Should be set to 60
+fps = params['refresh_rate']                    # Expected refresh rate of the display computer; replaced by the measured rate in section 5
 # Check that specified parameters make sense
 if params['response_period'] > params['targ_cooldown']:
     raise Exception('Error: response_period must not be greater than targ_cooldown. Please check rsvp_params.txt and try again.')
+if params['stim_mode'] not in ['objects', 'checkerboard']:
+    raise Exception('Error: stim_mode must be objects or checkerboard. Please check rsvp_params.txt and try again.')
+startup.mark('params')
+
+# Decode stimuli and import the iohub and eyetracker modules in the background while the session dialog is open
+path = os.path.dirname(abspath(getsourcefile(lambda:0))) + os.sep
+stim_path = path + 'Stimuli'
+if not os.path.isdir(stim_path):
+    raise Exception('Error: There is no stimuli folder in the current directory')
+# Images come from Stimuli/px<image size> when Accessory/rsvp_stim_prep.py made that size for this stim_bounds, so they are
+# shown at their own pixel size; otherwise from the 200x200 Stimuli/*.jpg. Either way in the order of Stimuli/*.jpg.
+def load_stimuli(stim_path):
+    image_fns = glob.glob(os.path.join(stim_path, '*.jpg'))
+    size_path = os.path.join(stim_path, 'px' + str(int(round(params['stim_bounds'][1] / 6))))
+    size_fns = [os.path.join(size_path, os.path.basename(fn)) for fn in image_fns]
+    if os.path.isdir(size_path) and all([os.path.isfile(fn) for fn in size_fns]):
+        image_fns = size_fns
+    return image_fns, [Image.open(fn).convert('RGB') for fn in image_fns]
+def import_services():
+    import psychopy.iohub.client
+    try:
+        import psychopy.iohub.devices.eyetracker.hw.sr_research.eyelink       # Imports pylink; only needed with the eyetracker
+    except ImportError:
+        pass
+stim_task = psyut.BackgroundTask(load_stimuli, stim_path)
+import_task = psyut.BackgroundTask(import_services)
 
 
 # 2. Enter session info; Initialize data file
@@ -98,12 +149,14 @@ subinfo = gui.Dlg(title='RSVP Sweep', screen=1)
 subinfo.addText('Session Info')
 subinfo.addField('Subject Initials')
 subinfo.addField('Run Number')
-subinfo.addField('Stimuli Duration', choices=[150,166,183,200,216,233,250,266,283,300,316,333,350,366,383,400,416,433,450,466,483,500,516,533,550,566,583,600])
+subinfo.addField('Stimuli Duration', choices=rsvp_design.get_frame_tables(fps, params['tr_per_bar'] * params['tr'])[2])
 subinfo.addField('Eyetracker', False)
 subinfo.addField('MRI', False)
 subinfo.addField('Fullscreen', False)
 subinfo.addField('Use Second Monitor', False)
+subinfo.addField('Runs in Session', 1)
 sub_data = subinfo.show()
+startup.mark('session dialog')
 if subinfo.OK:
     print('\n\n')
     print('>-----------Start-Run-----------< \n')
@@ -114,6 +167,7 @@ if subinfo.OK:
     print('Response Period:  ' + str(math.trunc(params['response_period'] * 1000)) + ' ms')
     print('Eyetracking:      ' + str(sub_data[3]))
     print('MRI:              ' + str(sub_data[4]))
+    print('Runs in Session:  ' + str(sub_data[7]))
     print('\n')
 else:
     raise Exception('Error: User cancelled')
@@ -128,6 +182,12 @@ if sub_data[6]:
     which_screen = 1
 else:
     which_screen = 0
+session_runs = int(sub_data[7])
+if session_runs > 1:
+    try:
+        first_run = int(run_number)                 # Session runs are numbered on from the first, e.g. 03, 04, 05
+    except ValueError:
+        raise Exception('Error: Run Number must be a number to run more than one run in a session')
 
 # Configure system
 run_info = {'fullscreen': fullscreen,
@@ -138,26 +198,33 @@ filename, edf_filename, mac = psyut.config_sys(exp_name = 'RSVP pRF', run_info=r
 
 
 # 3. Check for Data/Stimuli folders; Initialize data file
-path = abspath(getsourcefile(lambda:0))
-if mac:
-    sep_loc = path.rfind('/')
-else:
-    sep_loc = path.rfind('\\')
-path = path[0:sep_loc + 1]
-stim_path = path + 'Stimuli'
-if not os.path.isdir(stim_path):
-    raise Exception('Error: There is no stimuli folder in the current directory')
 data_path = path + 'Data'
 if not os.path.isdir(data_path):
     os.mkdir(data_path)
-if mac:
-    stim_path += '/*.jpg'
-    filename = data_path + '/' + sub_name + '_run' + run_number + '_' + date + '_' + 'rsvp_sweep_' + 'summary'
-else:
-    stim_path += '\\*.jpg'
-    filename = data_path + '\\' + sub_name + '_run' + run_number + '_' + date + '_' + 'rsvp_sweep_' + 'summary'
-datafile = open(filename + '.csv', 'w')
-datafile.write('Trial_Number,Sweep_Onset,Sweep_Duration,Sweep_Direction,Refresh_Rate,Stim_Duration,Accuracy,Correct,Total,Mean_RT,False_Positives\n')
+
+# Open the summary and stimlog files of one run; With save_journal, everything written to them is also
+# journaled to <summary>.journal, which Accessory/recover_journal.py turns back into csv files after a crash
+def open_run_files(run_number):
+    date = datetime.now().strftime('%m-%d-%Y_hr%H_min%M_sec%S')
+    if mac:
+        filename = data_path + '/' + sub_name + '_run' + run_number + '_' + date + '_' + 'rsvp_sweep_' + 'summary'
+    else:
+        filename = data_path + '\\' + sub_name + '_run' + run_number + '_' + date + '_' + 'rsvp_sweep_' + 'summary'
+    datafile = open(filename + '.csv', 'w')
+    journal = None
+    if params['save_journal']:
+        journal = psy_journal.Journal(filename + '.journal')
+        datafile = psy_journal.JournaledFile(datafile, journal, psy_journal.SUMMARY)
+    datafile.write('Trial_Number,Sweep_Onset,Sweep_Duration,Sweep_Direction,Refresh_Rate,Stim_Duration,Accuracy,Correct,Total,Mean_RT,False_Positives\n')
+    stim_log = None
+    if params['save_log']:
+        stim_log = open(filename + '_stimlog.csv', 'w')
+        if journal is not None:
+            stim_log = psy_journal.JournaledFile(stim_log, journal, psy_journal.STIMLOG)
+        stim_log.write('trial,barOnset,imageOnset,direct,i1img,i1x,i1y,i2img,i2x,i2y,i3img,i3x,i3y,i4img,i4x,i4y,i5img,i5x,i5y,i6img,i6x,i6y,t,targ_here,targ_img,targ_slot,RT\n')
+    return filename, datafile, stim_log, journal
+
+filename, datafile, stim_log, journal = open_run_files(run_number)
 if len(sub_name) < 4:
     edf_filename = sub_name + '_R' + str(run_number)
     long_edf_name = False
@@ -166,9 +233,6 @@ else:
     long_edf_filename = sub_name + '_R' + str(run_number)
     long_edf_name = True
 #edf_filename = sub_name + '_R' + str(run_number)
-if params['save_log']:
-    stim_log = open(filename + '_stimlog.csv', 'w')
-    stim_log.write('trial,barOnset,imageOnset,direct,i1img,i1x,i1y,i2img,i2x,i2y,i3img,i3x,i3y,i4img,i4x,i4y,i5img,i5x,i5y,i6img,i6x,i6y,t,targ_here,targ_img,targ_slot,RT\n')
 
 # 4. Automatically configure remaining parameters
 if scanning:
@@ -179,17 +243,6 @@ else:
     resp_key_text = 'space'
     bore_mask = False
 bar_dur = params['tr_per_bar'] * params['tr']   # Duration of each bar step, in seconds
-sweep_rate = bar_dur * fps                      # Rate at which bar moves, in frames
-frames_per_set = []
-set_list = []
-time_list = []
-min_frames_per_set=int(150/(1000/fps))
-max_frames_per_set=int(600/(1000/fps))
-for i in list(range(min_frames_per_set,max_frames_per_set+1)):
-    frames_per_set.append(i)
-    set_list.append(math.trunc(sweep_rate / i))
-    time_list.append(math.trunc(i*1000/fps))
-dur_idx = time_list.index(stim_dur)
 image_h = params['stim_bounds'][1] / 6                                                                      # Size of each image
 params['screen_width'] = params['screen_height'] * params['screen_res'][0] / params['screen_res'][1]        # Screen width in cm
 params['screen_h_deg'] = 180 / math.pi * np.arctan(params['screen_height'] / (2 * params['view_dist']))     # Screen height in degrees
@@ -197,6 +250,11 @@ params['screen_w_deg'] = 180 / math.pi * np.arctan(params['screen_width'] / (2 *
 params['ppd'] = params['screen_res'][1] / params['screen_h_deg']                                            # Pixels per degree
 params['fix_size']  /= 100
 
+import_task.result()
+from psychopy.iohub import launchHubServer
+from psychopy.iohub.constants import EventConstants
+startup.mark('iohub import (wait)')
+
 # 5. Load all images; Create stimuli; Test parameters
 win = visual.Window(params['screen_res'],
                     fullscr = fullscreen,
@@ -207,7 +265,10 @@ win = visual.Window(params['screen_res'],
                     units = 'pix',
                     colorSpace = 'rgb',
                     color = color)
-image_fns = glob.glob(stim_path)
+startup.mark('window')
+image_fns, stim_images = stim_task.result()                                                                                 # Every image decoded once; sweeps set images from memory
+startup.mark('stimuli (wait)')
+params['stim_folder'] = os.path.basename(os.path.dirname(image_fns[0])) if image_fns else ''           # px<size> if no rescaling is needed
 a1 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                                   # Create image 1
 a2 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                                   # Create image 2
 a3 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                                   # Create image 3
@@ -221,28 +282,59 @@ b4 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')
 b5 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                                   # Create buffer image 5
 b6 = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                                   # Create buffer image 6
 targ_image = visual.ImageStim(win=win, size = (image_h, image_h), units = 'pix')                                           # Create target image
-fix_cross = visual.ShapeStim(win=win, vertices = 'cross', fillColor = color, lineColor = color, size = (image_h * params['fix_size']))    # Create fixation cross
-fix_circle = visual.Circle(win=win, fillColor = fix_color, lineColor = color, size = (image_h * params['fix_size']))                      # Create fixation circle
-fix_dot = visual.Circle(win=win, fillColor = fix_color, lineColor = fix_color, size = (image_h * params['fix_size'] / 4))                 # Create fixation dot
-bore_mask_L = visual.Rect(win=win, fillColor = color, lineColor = color, size = image_h * 1)                                    # Create left bore mask
-bore_mask_R = visual.Rect(win=win, fillColor = color, lineColor = color, size = image_h * 1)                                    # Create right bore mask
+# Static overlay: the fixation target (circle, cross and dot) and bore masks rendered once into textures, one stim per
+# combination of bore masks and feedback colour, so a frame draws one texture instead of up to five shapes
+overlays = {}
+for masked in ([False, True] if bore_mask else [False]):
+    for feedback in [False, True]:
+        overlay_rgb, overlay_alpha = rsvp_design.get_overlay(params['stim_bounds'], image_h, params['fix_size'], fix_color, color,
+                                                             bore_mask = masked, feedback = feedback)
+        overlays[(masked, feedback)] = visual.ImageStim(win=win, image = overlay_rgb, mask = overlay_alpha * 2 - 1,
+                                                        size = params['stim_bounds'], units = 'pix')
+fixation = overlays[(False, False)]                                                                                          # Fixation only
+# Checkerboard bars: one stim per orientation and contrast phase, textures uploaded once here, so flicker is picking the other stim
+checker_bars = {}
+if checkerboard:
+    checker_bank = rsvp_design.get_checker_bank(image_h, params['checker_count'])
+    checker_bars['V'] = [visual.ImageStim(win=win, image = tex, size = (image_h, image_h * 6), units = 'pix') for tex in checker_bank]
+    checker_bars['H'] = [visual.ImageStim(win=win, image = np.ascontiguousarray(tex.T), size = (image_h * 6, image_h), units = 'pix') for tex in checker_bank]
 
 
-# Test parameters
+# Measure the refresh rate; Build frame and stimulus duration tables from it
 if testing:
     logging.console.setLevel(logging.WARNING)
-    runtime_info = RunTimeInfo(win=win, refreshTest = True)
-    desired_msPerFrame = 1000 / fps
-    actual_msPerFrame = runtime_info['windowRefreshTimeAvg_ms']
-    actual_fps = 1000 / actual_msPerFrame
-    print(actual_fps)
-    if abs(desired_msPerFrame - actual_msPerFrame) > 1:
-        win.close()
-        core.quit()
-        frame_error_msg = 'Error: The frame rate of the display computer does not match the desired frame rate.\n\n\
-                        Desired frames per second: {:d} \n\
-                        Actual frames per second:  {:.2f} \n'.format(fps, actual_fps)
-        raise Exception(frame_error_msg)
+fps, frame_rate = psy_timing.measure_refresh_rate(win)
+if fps is None:
+    win.close()
+    frame_error_msg = 'Error: The refresh rate of the display computer is not supported.\n\n\
+                    Supported frames per second: {} \n\
+                    Actual frames per second:    {} \n'.format(psy_timing.supported_rates, frame_rate)
+    raise Exception(frame_error_msg)
+print('Refresh Rate:     %.2f Hz (%i Hz tables)' % (frame_rate, fps))
+startup.mark('refresh rate')
+frames_per_set, set_list, time_list = rsvp_design.get_frame_tables(fps, bar_dur)
+table_errors = rsvp_design.check_frame_tables(params, fps, frame_rate)
+if table_errors:
+    win.close()
+    raise Exception('Error: At %.2f Hz, the sets of these stimulus durations do not fit in the shortest bar: %s' % (frame_rate,
+                    ', '.join(['%i ms (%i of %i frames)' % (time_list[i], needed, bar) for (i, bar, needed) in table_errors])))
+if stim_dur in time_list:
+    dur_idx = time_list.index(stim_dur)
+else:
+    dur_idx = int(np.argmin(np.abs(np.array(time_list) - stim_dur)))
+    print('Stim Duration:    %i ms is not available at %i Hz, using %i ms' % (stim_dur, fps, time_list[dur_idx]))
+feedback_frames = int(round(params['feedback_frames'] * fps / 60))
+params['refresh_rate'] = fps
+params['measured_refresh_rate'] = round(frame_rate, 3)
+frame_clock = psy_timing.FrameScheduler(win, frame_rate)                                                                    # Schedule sweep frames on flip timestamps
+reversal_frames = rsvp_design.get_reversal_frames(frame_rate, params['checker_hz']) if checkerboard else 0                  # Frames per checkerboard phase
+# Launch iohub now the refresh rate is measured, so its process spawn and handshake do not compete with the stimulus
+# uploads or the measurement; iohub takes its display settings from the window (window = win) and registers it for keyboard events
+if eye_tracking:
+    tracker_config = psyut.config_et(params, edf_filename, mac)
+    io_task = psyut.BackgroundTask(lambda: launchHubServer(window = win, **tracker_config))
+else:
+    io_task = psyut.BackgroundTask(lambda: launchHubServer(window = win))
 
 
 # 6. Set position and speed for left-to-right, right-to-left, top-to-bottom, and bottom-to-top
@@ -257,8 +349,6 @@ B2T_pos = []
 spacing = [image_h * 2.5, image_h * 1.5, image_h * 0.5, image_h * -0.5, image_h * -1.5, image_h * -2.5]
 types = ['L2R', 'T2B', 'R2L', 'B2T']
 n_stim_set = len(image_fns)
-trial = 1
-real_resp_time = params['response_period'] - params['response_delay']
 # Set initial position for each image
 for j in list(range(0,6)):
     L2R_pos.append((l_marg, spacing[j]))
@@ -269,24 +359,25 @@ lr_dist = r_marg - l_marg
 lr_dist = lr_dist / (params['n_bars'] - 1)
 tb_dist = t_marg - b_marg
 tb_dist = tb_dist / (params['n_bars'] - 1)
-bore_mask_L.pos = (l_marg, t_marg)
-bore_mask_R.pos = (r_marg, t_marg)
 # Set jump distance for each sweep direction
 L2R_speed = (lr_dist, 0)
 R2L_speed = (-1 * lr_dist, 0)
 T2B_speed = (0, -1 * tb_dist)
 B2T_speed = (0, tb_dist)
-# Set fixed target
+# Set fixed target for a run
 image_set = list(range(0,n_stim_set))
-if bool(params['constrained_set']):
-    targ = random.choice(params['constrained_set'])
-else:
-    targ = random.choice(image_set)
+def choose_target():
+    if bool(params['constrained_set']):
+        return random.choice(params['constrained_set'])
+    return random.choice(image_set)
+targ = choose_target()
 
 
 # 7. Generate set of images to be presented
-# Same distractor items cannot be presented in the same set
+# Same distractor items cannot be presented in the same set; Checkerboard sets have no distractors, only no_image slots
 def gen_set(targ, last_set):
+    if checkerboard:
+        return [no_image] * 6
     image_set = list(range(0,n_stim_set))
     if len(last_set) > 0:
         for l in last_set:
@@ -299,15 +390,46 @@ def gen_set(targ, last_set):
     current_set = random.sample(image_set, k = 6)
     return current_set
 
+# Move MRI pulses drained by the input pump into the pulse log
+def log_pulses():
+    for pulse_time in input_pump.read(psy_input.PULSE):
+        pulse_log.add(pulse_time + clock_offset)
+
+# Re-anchor a planned bar onset to the MRI pulses; Log the correction and return the part applied, in seconds.
+# Corrections over a quarter TR point to missed or extra pulses and are logged but not applied.
+def pulse_correction(trial, bar, t_planned):
+    correction = pulse_log.correction(t_planned)
+    if correction is None:
+        return 0
+    applied = abs(correction) <= tr / 4
+    pulse_corrections.append((trial, bar, round(1000 * correction, 2), applied))
+    if applied:
+        return correction
+    return 0
+
+# Deferred work of the sweep frame loop, run by the slack scheduler in the time left before each flip
+def set_image(stim, image_idx):
+    stim.image = stim_images[image_idx]
+
+def write_set_row(trial, tStartBar, tStartImage, direct, image_set, positions, t, targ_here, targ, targ_slot, set_rt):
+    row = [trial, tStartBar, tStartImage, direct]
+    for image_idx, (x, y) in zip(image_set, positions):
+        row += [image_idx, x, y]
+    stim_log.write(('%i,%f,%f,%s,' + '%i,%i,%i,' * 6 + '%f,%s,%i,%i,%s\n') % tuple(row + [t, targ_here, targ, targ_slot, str(set_rt)[1:-2]]))
+
 
 # 8. Define sweep function ====================================================================================================================<
-def sweep(tStartExp, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=targ_rate, sweep_rate=sweep_rate,
+def sweep(tStartExp, tOnset, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=targ_rate,
           a1=a1, a2=a2, a3=a3, a4=a4, a5=a5, a6=a6, b1=b1, b2=b2, b3=b3, b4=b4, b5=b5, b6=b6):
-    # Initialize target cooldown timer; Start static period to load sweep
+    # Initialize target cooldown timer; Start static period to load sweep, ending one frame before the planned sweep onset
     if eye_tracking:
-        et.sendMessage('xDAT 1')
+        et_messages.send('xDAT 1')
     static = StaticPeriod(screenHz = fps)
-    static.start(tr)
+    static.start(max(0, tOnset - frame_clock.period - frame_clock.now()))
+    if realtime is not None:
+        realtime.sweep_start()                              # Collect garbage now; no collections until the sweep ends
+    fixation.autoDraw = False                               # Frames draw the overlay themselves
+
 
     # Initialize variables
     a_targ_here = False
@@ -316,17 +438,17 @@ def sweep(tStartExp, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=
     show_buffer = False
     break_out = False
     loop_count = 1
-    next_frame_ref = 1
     next_set_idx = 1
     feedback_frames_rem = 0
+    feedback_on = False
     last_targ_idx = 0
-    ref_counter = 0
     bar_counter = 1
     false_pos = 0
     correct = 0
     total = 0
     rt = []
     start_rt = None
+    bar_gaze_start = None
 
     # Set sweep timing
     refresh_rate = frames_per_set[dur_idx]
@@ -378,6 +500,10 @@ def sweep(tStartExp, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=
         each.pos = position[z]                              # Set starting position for each image in set A
     for z, each in enumerate(b_images, start = 0):
         each.pos = position[z]                              # Set starting position for each image in set B
+    if checkerboard:
+        bar_stims = checker_bars['V' if direct in ['L2R', 'R2L'] else 'H']
+        for each in bar_stims:
+            each.pos = np.mean(position, axis = 0)          # Bar centred on its six slots
 
     # Generate and load initial image sets
     a_show_targ = random.randint(1, targ_rate)              # Randomize if target is presented
@@ -405,228 +531,285 @@ def sweep(tStartExp, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=
         total += 1
         last_targ_idx = 1
     for x, each in enumerate(a_images, start = 0):
-        each.image = image_fns[a_set[x]]                # Load each image in set A
+        if not checkerboard or a_set[x] == targ:
+            each.image = stim_images[a_set[x]]            # Load each image in set A; only the target is shown on checkerboards
     for x, each in enumerate(b_images, start = 0):
-        each.image = image_fns[b_set[x]]                # Load each image in set B
+        if not checkerboard or b_set[x] == targ:
+            each.image = stim_images[b_set[x]]            # Load each image in set B
 
     # End static period to load stimuli
     static.complete()
-    if mac: keypress = iokeyboard.getPresses(keys = [response_key])
-    else: keypress = event.getKeys(keyList = [response_key])
-    start_rt = core.MonotonicClock()
+    input_pump.clear()
+    log_pulses()
+    if pulse_lock:
+        tOnset += pulse_correction(trial, 1, tOnset)
+    start_rt = core.getTime()
     if eye_tracking:
-        et.sendMessage('xDAT 2')
+        et_messages.send('xDAT 2')
+    telemetry_frames = int(round(frame_rate / 10))          # Status updates may wait up to 100 ms for spare time
+    if status_board is not None:
+        status_board.publish(state = 'sweep', trial = trial, direct = direct, dur_idx = dur_idx, stim_ms = time_list[dur_idx],
+                             bar = 1, correct = 0, total = total, false_pos = 0)
     if testing:
         test = [0,0]
         win.recordFrameIntervals = True
     this_rt = []
-    if targ_here:
-        response_timer = CountdownTimer(response_period)
-    else:
-        response_timer = CountdownTimer(0)
 
-    tStartSweep=time.time()-tStartExp
-    print('%ss sweep starts'%tStartSweep)
-    tStartImage=tStartSweep
-    sweeptimer = CountdownTimer(sweep_dur)
+    # Schedule every frame of the sweep on flip timestamps: bar b starts on flip bar_frames[b] after tOnset.
+    # Frames whose flip has already passed (dropped frames) run their logic without drawing, so a drop
+    # is caught up instead of delaying everything after it. With pulse_lock, each bar onset is moved to the
+    # MRI pulses just before it and the frames after it are held or skipped to match.
+    bar_frames = rsvp_design.get_bar_frames(bar_dur, n_bars, frame_rate)
+    frame_clock.start(tOnset)
+    dropped_start = frame_clock.dropped
+    frame_clock.flip_log = []
+    sweep_frame = 0                     # Frames since the sweep onset, rendered or not
+    tStartSweep = tOnset - tStartExp
+    tStartImage = tStartSweep
+    # Profiling hooks around each stage of the frame loop; prof is False unless the profile param subscribes collectors
+    prof = hooks.active
+    if prof: hooks.sweep_start(trial)
     # Start sweep (24TRs)
-    while sweeptimer.getTime()>0:
-        # e.g., for every 157 frames in 2TRs 2.6s
-        # can change to use bartimer to control bar presentation time
-        # but may add extra time acculumated through the whole run
-        # in addition, at high speed will notice the gap between bars unsmooth sweep
-        # bartimer = CountdownTimer(bar_dur)
-        for frame in range(1, int(sweep_rate) + 1):
-            # Check response time period
-            if feedback_frames_rem == 0:
-                fix_circle.fillColor = fix_color
-                feedback_frames_rem -= 1
-            elif feedback_frames_rem > 0:
-                feedback_frames_rem -= 1
-
-            # Check key resonses for accuracy; Give feedback
-            if response_timer.getTime() <= 0: targ_here = False
-            if response_key in keypress:
-                if mac: keypress = iokeyboard.getPresses(keys = [response_key])
-                else: keypress = event.getKeys(keyList = [response_key])
-                if targ_here == True and response_timer.getTime() < real_resp_time and response_timer.getTime() > 0:               # Check for hits
-                    this_rt.append(start_rt.getTime())
-                    rt.append(this_rt[-1])
-                    if show_feedback: fix_circle.fillColor = 'green'
-                    feedback_frames_rem = feedback_frames
-                    correct += 1
-                    targ_here = False
-                else: 
-                    false_pos += 1
-
-            # Refresh images on proper frame
-            if frame % refresh_rate == 0:
-                if testing:
-                    print('Dropping frames?')
-                next_set_idx += 1
-                loop_count += 1
-                if mac: keypress = iokeyboard.getPresses(keys = [response_key])
-                else: keypress = event.getKeys(keyList = [response_key])
-                if show_buffer:
-                    a_set = gen_set(targ=targ, last_set=b_set)                                                                      # Randomly generate new set of distractor images
-                    if set_timings[next_set_idx] - set_timings[last_targ_idx] > targ_cooldown:                                      # Prevent next set from showing target if target cooldown has not reset after showing target in previous sets
-                        a_show_targ = random.randint(1, targ_rate)                                                                  # Randomize if target is presented
-                        if bore_mask and (set_bar_num[next_set_idx] == mask_bar[0] or set_bar_num[next_set_idx] >= mask_bar[1]):    # Prevent next target from being displayed in masked slot
-                            a_targ_slot = random.randint(1, max_slot)                                                               # Randomize position if target is presented
-                        else:
-                            a_targ_slot = random.randint(0, 5)
-                        a_targ_here = False
-                        if a_show_targ == 1:
-                            a_set[a_targ_slot] = targ
-                            a_targ_here = True
-                            total += 1
-                            last_targ_idx = next_set_idx
-                        else:
-                            a_targ_here = False
+    while sweep_frame < bar_frames[-1]:
+        bar_len = bar_frames[bar_counter] - bar_frames[bar_counter - 1]     # Frames in the current bar
+        frame = sweep_frame - bar_frames[bar_counter - 1] + 1               # Frame within the current bar, from 1
+        render = sweep_frame > frame_clock.frame
+        # Check response time period
+        if feedback_frames_rem == 0:
+            feedback_on = False
+            feedback_frames_rem -= 1
+        elif feedback_frames_rem > 0:
+            feedback_frames_rem -= 1
+
+        # Drain key presses once per frame; Check responses for accuracy at their own timestamps; Give feedback
+        if prof: hooks.begin('input polling')
+        input_pump.poll()
+        log_pulses()
+        for press_time in input_pump.read(psy_input.RESPONSE):
+            press_rt = press_time - start_rt
+            if targ_here == True and press_rt > response_delay and press_rt < response_period:               # Check for hits
+                this_rt.append(press_rt)
+                rt.append(this_rt[-1])
+                if show_feedback: feedback_on = True
+                feedback_frames_rem = feedback_frames
+                correct += 1
+                targ_here = False
+                if status_board is not None:
+                    slack.submit(sweep_frame + telemetry_frames, 'telemetry', status_board.publish, correct = correct, last_rt = press_rt)
+            else: 
+                false_pos += 1
+                if status_board is not None:
+                    slack.submit(sweep_frame + telemetry_frames, 'telemetry', status_board.publish, false_pos = false_pos)
+        if core.getTime() - start_rt >= response_period: targ_here = False
+        if prof: hooks.end()
+
+        # Refresh images on proper frame
+        if prof: hooks.begin('set generation')
+        new_set = frame % refresh_rate == 0 and loop_count <= sets_per_bar       # No more than sets_per_bar sets in a bar, however long it is
+        if new_set:
+            if testing:
+                print('Dropping frames?')
+            next_set_idx += 1
+            loop_count += 1
+            if show_buffer:
+                a_set = gen_set(targ=targ, last_set=b_set)                                                                      # Randomly generate new set of distractor images
+                if set_timings[next_set_idx] - set_timings[last_targ_idx] > targ_cooldown:                                      # Prevent next set from showing target if target cooldown has not reset after showing target in previous sets
+                    a_show_targ = random.randint(1, targ_rate)                                                                  # Randomize if target is presented
+                    if bore_mask and (set_bar_num[next_set_idx] == mask_bar[0] or set_bar_num[next_set_idx] >= mask_bar[1]):    # Prevent next target from being displayed in masked slot
+                        a_targ_slot = random.randint(1, max_slot)                                                               # Randomize position if target is presented
+                    else:
+                        a_targ_slot = random.randint(0, 5)
+                    a_targ_here = False
+                    if a_show_targ == 1:
+                        a_set[a_targ_slot] = targ
+                        a_targ_here = True
+                        total += 1
+                        last_targ_idx = next_set_idx
                     else:
                         a_targ_here = False
                 else:
-                    b_set = gen_set(targ=targ, last_set=a_set)                                                                      # Randomly generate new set of distractor images
-                    if set_timings[next_set_idx] - set_timings[last_targ_idx] > targ_cooldown:                                      # Prevent next set from showing target if target cooldown has not reset after showing target in previous sets
-                        b_show_targ = random.randint(1, targ_rate)                                                                  # Randomize if target is presented
-                        if bore_mask and (set_bar_num[next_set_idx] == mask_bar[0] or set_bar_num[next_set_idx] >= mask_bar[1]):    # Prevent next target from being displayed in masked slot
-                            b_targ_slot = random.randint(1, 4)                                                                      # Randomize position if target is presented
-                        else:
-                            b_targ_slot = random.randint(0, 5)
-                        b_targ_here = False
-                        if b_show_targ == 1:
-                            b_set[b_targ_slot] = targ
-                            b_targ_here = True
-                            total += 1
-                            last_targ_idx = next_set_idx
-                        else:
-                            b_targ_here = False
+                    a_targ_here = False
+            else:
+                b_set = gen_set(targ=targ, last_set=a_set)                                                                      # Randomly generate new set of distractor images
+                if set_timings[next_set_idx] - set_timings[last_targ_idx] > targ_cooldown:                                      # Prevent next set from showing target if target cooldown has not reset after showing target in previous sets
+                    b_show_targ = random.randint(1, targ_rate)                                                                  # Randomize if target is presented
+                    if bore_mask and (set_bar_num[next_set_idx] == mask_bar[0] or set_bar_num[next_set_idx] >= mask_bar[1]):    # Prevent next target from being displayed in masked slot
+                        b_targ_slot = random.randint(1, 4)                                                                      # Randomize position if target is presented
+                    else:
+                        b_targ_slot = random.randint(0, 5)
+                    b_targ_here = False
+                    if b_show_targ == 1:
+                        b_set[b_targ_slot] = targ
+                        b_targ_here = True
+                        total += 1
+                        last_targ_idx = next_set_idx
                     else:
                         b_targ_here = False
-                if frame == sweep_rate:
-                    next_frame_ref = 1
                 else:
-                    next_frame_ref = frame + 1
+                    b_targ_here = False
+        if prof: hooks.end()
 
-            # Update image set a or b depending on which is not displayed
-            if frame % next_frame_ref == 0 and ref_counter < 6:
-                if show_buffer:
-                    a_images[ref_counter].image = image_fns[a_set[ref_counter]]
-                else:
-                    b_images[ref_counter].image = image_fns[b_set[ref_counter]]
-                ref_counter += 1
-                next_frame_ref += 1
-                if frame == sweep_rate:
-                    next_frame_ref = 1
-            elif ref_counter >= 6:
-                ref_counter = 0
-                next_frame_ref = math.pi
-
-            # Check key response
-            if mac: keypress = iokeyboard.getPresses(keys = [response_key])
-            else: keypress = event.getKeys(keyList = [response_key])
-
-            # Check key response for escape to quit experiment
-            if mac: quit_key = iokeyboard.getPresses(keys = ['escape'])
-            else: quit_key = event.getKeys(keyList = ['escape'])
-            if 'escape' in quit_key:
-                win.close()
-                core.quit()
-                raise Exception('User quit experiment with escape key')
-
-            # Update bar location on proper frame
-            if frame % sweep_rate == 0:
-                bar_counter += 1
-                for each in a_images:
-                    each.pos += speed
-                for each in b_images:
-                    each.pos += speed
+        # Queue image updates for set a or b depending on which is not displayed; They run in spare frame time and
+        # all are done by the last frame before the set is shown
+        if prof: hooks.begin('image assignment')
+        if new_set:
+            if show_buffer:
+                hidden_images, hidden_set = a_images, a_set
+            else:
+                hidden_images, hidden_set = b_images, b_set
+            for slot in list(range(0, 6)):
+                if not checkerboard or hidden_set[slot] == targ:
+                    slack.submit(sweep_frame + refresh_rate - 1, 'image', set_image, hidden_images[slot], hidden_set[slot])
+        if prof: hooks.end()
 
-            # Stop bar at edge of screen
-            if (a1.pos[0] > r_marg or     # Right edge
-                a1.pos[0] < l_marg or     # Left edge
-                a1.pos[1] < b_marg or     # Bottom edge
-                a1.pos[1] > t_marg):      # Top edge
-                # Remove last target addition if not displayed
-                if a_targ_here and show_buffer:
-                    total -= 1
-                elif b_targ_here and not show_buffer:
-                    total -= 1
-                break_out = True
-                break
-
-            # Show each updated image
-            if loop_count <= set_list[dur_idx]:
-                if not show_buffer:
-                    for each in a_images:
-                        each.draw()
-                elif show_buffer:
-                    for each in b_images:
-                        each.draw()
-            elif frame % sweep_rate == 0:
-                loop_count = 1
-            if bore_mask:
-                if bar_counter == 1 or bar_counter == n_bars:
-                    bore_mask_L.draw()
-                    bore_mask_R.draw()
-            fix_circle.draw()
-            fix_cross.draw()
-            fix_dot.draw()
-            win.flip()
-            # record bar starts time
-            if frame ==1:
-                tStartBar=time.time()-tStartExp
-            if (frame-1) % refresh_rate == 0:
-                tStartImage = time.time()-tStartExp
-                            
-            # Alternate between sets a and b; Save stimuli info to log
-            if (frame + 1) % refresh_rate == 0:
-                string_rt = str(this_rt)[1:-2]
-                if show_buffer:
-                    if save_log:
-                        stim_log.write('%i,%f,%f,%s,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%f,%s,%i,%i,%s\n'
-                                       %(trial,tStartBar,tStartImage,direct,b_set[0],b1.pos[0],b1.pos[1],b_set[1],b2.pos[0],b2.pos[1],b_set[2],b3.pos[0],b3.pos[1],b_set[3],b4.pos[0],b4.pos[1],b_set[4],b5.pos[0],b5.pos[1],b_set[5],
-                                         b6.pos[0],b6.pos[1],(set_timings[next_set_idx - 1] + ((sweep_dur + tr) * (trial - 1))),b_targ_here,targ,b_targ_slot,string_rt))
-                    show_buffer = False
-                    if a_targ_here:
-                        targ_here = True
-                        response_timer.reset(response_period)
-                        start_rt = core.MonotonicClock()
-                    elif response_timer.getTime() <= 0: targ_here = False
-                else:
-                    if save_log:
-                        stim_log.write('%i,%f,%f,%s,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%i,%f,%s,%i,%i,%s\n'
-                                       %(trial,tStartBar,tStartImage,direct,a_set[0],a1.pos[0],a1.pos[1],a_set[1],a2.pos[0],a2.pos[1],a_set[2],a3.pos[0],a3.pos[1],a_set[3],a4.pos[0],a4.pos[1],a_set[4],a5.pos[0],a5.pos[1],a_set[5],
-                                         a6.pos[0],a6.pos[1],(set_timings[next_set_idx - 1] + ((sweep_dur + tr) * (trial - 1))),a_targ_here,targ,a_targ_slot,string_rt))
-                    show_buffer = True
-                    if b_targ_here:
-                        targ_here = True
-                        response_timer.reset(response_period)
-                        start_rt = core.MonotonicClock()
-                    elif response_timer.getTime() <= 0: targ_here = False
-                this_rt = []
+        # Check key response for escape to quit experiment
+        if input_pump.quit:
+            win.close()
+            core.quit()
+            raise Exception('User quit experiment with escape key')
 
-            if testing:
-                test.append(win.nDroppedFrames)
-                if test[-1] > test[-2]:
-                    print('Overall, %i frames were dropped.' % win.nDroppedFrames)
-                    print('Frame: %i' % frame)
-        # while bartimer.getTime()>0:
-        #     win.flip()
-        if break_out:
-            # wait to meet the sweep duration
-            fix_circle.fillColor = fix_color
-            fix_circle.draw()
-            fix_cross.draw()
-            fix_dot.draw()
-            while sweeptimer.getTime() > 0:
-                win.flip()
+        # Update bar location on proper frame
+        if prof: hooks.begin('edge check')
+        if frame == bar_len:
+            if pulse_lock and bar_counter < n_bars:
+                frame_clock.shift(pulse_correction(trial, bar_counter + 1, frame_clock.time_of(bar_frames[bar_counter])))
+            bar_counter += 1
+            if status_board is not None:
+                slack.submit(sweep_frame + telemetry_frames, 'telemetry', status_board.publish, bar = min(bar_counter, n_bars), total = total,
+                             dropped = frame_clock.dropped - run_dropped_start, pulses = len(pulse_log.times), run_time = frame_clock.now() - tStartExp)
+            for each in a_images:
+                each.pos += speed
+            for each in b_images:
+                each.pos += speed
+            if checkerboard:
+                for each in bar_stims:
+                    each.pos += speed
+
+        # Stop bar at edge of screen
+        if (a1.pos[0] > r_marg or     # Right edge
+            a1.pos[0] < l_marg or     # Left edge
+            a1.pos[1] < b_marg or     # Bottom edge
+            a1.pos[1] > t_marg):      # Top edge
+            # Remove last target addition if not displayed
+            if a_targ_here and show_buffer:
+                total -= 1
+            elif b_targ_here and not show_buffer:
+                total -= 1
+            break_out = True
+            if prof: hooks.end()
             break
-    tSweepEnd = time.time()-tStartExp
-    win.flip()
+        if prof: hooks.end()
+
+        # Show each updated image; Frames that were dropped are not drawn
+        if prof: hooks.begin('draw')
+        if loop_count <= set_list[dur_idx]:
+            if render and checkerboard:
+                bar_stims[(sweep_frame // reversal_frames) % 2].draw()                 # Contrast reversal: the other phase's stim
+                if not show_buffer and a_targ_here:
+                    a_images[a_targ_slot].draw()
+                elif show_buffer and b_targ_here:
+                    b_images[b_targ_slot].draw()
+            elif render and not show_buffer:
+                for each in a_images:
+                    each.draw()
+            elif render and show_buffer:
+                for each in b_images:
+                    each.draw()
+        elif frame == bar_len:
+            loop_count = 1
+        if render:
+            overlays[(bore_mask and (bar_counter == 1 or bar_counter == n_bars), feedback_on)].draw()
+            if prof: hooks.end()
+            if prof: hooks.begin('deferred')
+            slack.run(sweep_frame)
+            if prof: hooks.end()
+            if prof: hooks.begin('wait')
+            frame_clock.pace(sweep_frame)
+            if prof: hooks.end()
+            if prof: hooks.begin('flip')
+            tFrame = frame_clock.flip() - tStartExp
+            if prof: hooks.end()
+            if sweep_frame == 0:
+                tStartSweep = tFrame
+                sweep_onset_error.append(1000 * (frame_clock.t0 - tOnset))
+                if status_board is None:
+                    print('%ss sweep starts'%tStartSweep)
+        else:
+            if prof: hooks.end()
+            slack.run(sweep_frame)                              # Frame was dropped: only the jobs that are due
+            tFrame = frame_clock.time_of(sweep_frame) - tStartExp
+        # record bar starts time; Summarize fixation over the previous bar
+        if frame ==1:
+            tStartBar=tFrame
+            if eye_tracking:
+                if bar_gaze_start is not None:
+                    bar_fix.append(gaze_monitor.fixation_stats(bar_gaze_start, core.getTime(), params['ppd'], fix_tolerance))
+                bar_gaze_start = core.getTime()
+        if (frame-1) % refresh_rate == 0:
+            tStartImage = tFrame
+                        
+        # Alternate between sets a and b; Queue stimuli info for the log, written in spare frame time
+        if prof: hooks.begin('log write')
+        if (frame + 1) % refresh_rate == 0 and loop_count <= sets_per_bar:
+            if show_buffer:
+                if save_log:
+                    slack.submit(sweep_frame + refresh_rate, 'log', write_set_row, trial, tStartBar, tStartImage, direct, list(b_set),
+                                 [(each.pos[0], each.pos[1]) for each in b_images], (set_timings[next_set_idx - 1] + ((sweep_dur + tr) * (trial - 1))),
+                                 b_targ_here, targ, b_targ_slot, this_rt)
+                show_buffer = False
+                if a_targ_here:
+                    targ_here = True
+                    start_rt = core.getTime()
+                elif core.getTime() - start_rt >= response_period: targ_here = False
+            else:
+                if save_log:
+                    slack.submit(sweep_frame + refresh_rate, 'log', write_set_row, trial, tStartBar, tStartImage, direct, list(a_set),
+                                 [(each.pos[0], each.pos[1]) for each in a_images], (set_timings[next_set_idx - 1] + ((sweep_dur + tr) * (trial - 1))),
+                                 a_targ_here, targ, a_targ_slot, this_rt)
+                show_buffer = True
+                if b_targ_here:
+                    targ_here = True
+                    start_rt = core.getTime()
+                elif core.getTime() - start_rt >= response_period: targ_here = False
+            this_rt = []
+        if prof: hooks.end()
+
+        if testing:
+            test.append(win.nDroppedFrames)
+            if test[-1] > test[-2]:
+                print('Overall, %i frames were dropped.' % win.nDroppedFrames)
+                print('Frame: %i' % frame)
+        sweep_frame += 1
+    if prof: hooks.sweep_end()
+    slack.flush()                                           # Log rows and status updates still queued
+    if break_out:
+        if eye_tracking and bar_gaze_start is not None:
+            bar_fix.append(gaze_monitor.fixation_stats(bar_gaze_start, core.getTime(), params['ppd'], fix_tolerance))
+            bar_gaze_start = None
+        # wait to meet the sweep duration
+        fixation.draw()
+        frame_clock.flip()
+    # Fill the rest of the sweep with a low-CPU wait instead of flipping
+    frame_clock.wait_until(frame_clock.time_of(bar_frames[-1]))
+    fixation.autoDraw = True
+    tSweepEnd = frame_clock.now()-tStartExp
+    frame_clock.flip()
+    sweep_drops.append(frame_clock.dropped - dropped_start)
+    sweep_jitter.append(psy_timing.jitter_stats(frame_clock.flip_log, frame_clock.period))
+    frame_clock.flip_log = None
+    if realtime is not None:
+        realtime.sweep_end()
+    if eye_tracking and bar_gaze_start is not None:
+        bar_fix.append(gaze_monitor.fixation_stats(bar_gaze_start, core.getTime(), params['ppd'], fix_tolerance))
     accuracy = 100 * correct / total
-    print('Direction: %s'%direct)
-    print('Accuracy: %d%%' % accuracy)
+    if status_board is not None:
+        status_board.publish(state = 'between', total = total, correct = correct, last_accuracy = accuracy,
+                             dropped = frame_clock.dropped - run_dropped_start, run_time = frame_clock.now() - tStartExp)
+    else:
+        print('Direction: %s'%direct)
+        print('Accuracy: %d%%' % accuracy)
+    if eye_tracking and status_board is None:
+        print('Fixation: %d%% of samples within %.1f deg' % (np.nanmean([b['within_pct'] for b in bar_fix[-n_bars:]]), fix_tolerance))
     mean_rt = np.average(rt)
     datafile.write('%i,%f,%f,%s,%i,%f,%f,%i,%i,%f,%i\n' %(trial, tStartSweep, tSweepEnd-tStartSweep, direct, refresh_rate, stim_dur, accuracy, correct, total, mean_rt, false_pos))
 
@@ -637,134 +820,252 @@ def sweep(tStartExp, bar_dur, direct, refresh_rate, trial, targ=targ, targ_rate=
 # 9. Set up Eyetracker
 if eye_tracking:
     # Configure eyetracker
-    tracker_config = psyut.config_et(params, edf_filename, mac)
-    if mac: io = launchHubServer(window=win, **tracker_config)
-    else: io = launchHubServer(**tracker_config)
+    io = io_task.result()
+    startup.mark('iohub launch (wait)')
     et = io.devices.tracker
     setup = et.runSetupProcedure()
+    startup.mark('eyetracker setup')
     # Begin recording
     io.clearEvents()
     et.sendMessage('xDAT 101')
     et.setRecordingState(True)
 else:
-    io = launchHubServer()
+    io = io_task.result()
+    startup.mark('iohub launch (wait)')
+# Send eyetracker messages and stream gaze samples during the run from background threads;
+# the lock shares the iohub connection with the keyboard
+io_lock = threading.Lock()
+if eye_tracking:
+    et_messages = psy_et.MessageDispatcher(et, lock = io_lock)
+    gaze_monitor = psy_et.GazeMonitor(et, event_type = EventConstants.MONOCULAR_EYE_SAMPLE, lock = io_lock)
 # Setup ioHub keyboard method
 if mac: iokeyboard = io.devices.keyboard
+# Poll response, escape and MRI pulse keys once per frame during sweeps
+if mac: input_pump = psy_input.InputPump(response_key, pulse_key = pulse_cue, iokeyboard = iokeyboard, lock = io_lock)
+else: input_pump = psy_input.InputPump(response_key, pulse_key = pulse_cue)
+# Log every MRI pulse during the run on the frame clock; Key timestamps are in the core.getTime() time base
+clock_offset = frame_clock.now() - core.getTime()
+pulse_lock = params['pulse_lock'] and scanning
+
+# Wait for an MRI pulse; Returns its time on the frame clock
+def wait_pulse():
+    if mac: pulse_time = iokeyboard.waitForPresses(keys = [pulse_cue])[0].time
+    else: pulse_time = event.waitKeys(keyList = [pulse_cue], timeStamped = True)[0][1]
+    pulse_log.add(pulse_time + clock_offset)
+    return pulse_time + clock_offset
+
+# Report where the time before the first run went; (wait) phases only wait for work started in the background
+startup.print_phases()
+print('  Background: stimulus decoding %.3f s, iohub import %.3f s' % (stim_task.duration, import_task.duration))
+params['startup_phases'] = [(name, round(duration, 3)) for name, duration in startup.phases]
+
+# Operator console: live run state in shared memory instead of prints between frames
+status_board = None
+if params['operator_console']:
+    status_board = psy_status.StatusBoard()
+    console_script = path + 'Accessory' + os.sep + 'operator_console.py'
+    if platform.system() == 'Windows':
+        subprocess.Popen([sys.executable, console_script], creationflags = subprocess.CREATE_NEW_CONSOLE)
+    else:
+        print('Operator console: run  python %s  in another terminal' % console_script)
+
+# Real-time mode: measure frame jitter before and after raising priority, pinning cores and locking memory
+realtime = None
+if params['realtime']:
+    def draw_fixation():
+        fixation.draw()
+    realtime = psy_timing.RealTimeMode(cores = params['realtime_cores'])
+    jitter_before = psy_timing.measure_jitter(frame_clock, draw = draw_fixation)
+    realtime_status = realtime.enter()
+    realtime.sweep_start()
+    jitter_after = psy_timing.measure_jitter(frame_clock, draw = draw_fixation)
+    realtime.sweep_end()
+    print('Real-time mode: ' + ', '.join([key + ' ' + realtime_status[key] for key in realtime_status]))
+    print('Frame jitter (%i frames): SD %.3f -> %.3f ms, max %.3f -> %.3f ms, late %i -> %i'
+          % (jitter_after['n'], jitter_before['sd_ms'], jitter_after['sd_ms'], jitter_before['max_ms'], jitter_after['max_ms'],
+             jitter_before['late'], jitter_after['late']))
+    params['realtime_status'] = realtime_status
+    params['jitter_before'] = {key: round(jitter_before[key], 3) for key in jitter_before}
+    params['jitter_after'] = {key: round(jitter_after[key], 3) for key in jitter_after}
 
 
 inst_text = visual.TextStim(win = win, color = text_color, height = image_h / 4, wrapWidth = params['stim_bounds'][0])
-# 10. Target presentation & peripheral calibration
-if params['calibrate_targ']:
-    calib_x = [l_marg, 0, r_marg, 0]
-    calib_y = [0, t_marg, 0, b_marg]
-    calib_text = 'You will now be presented with the target so that you will have an idea of what the image looks like in your peripheral vision. Please press %s to indicate that you have seen the target in each location. Press %s to begin.' % (resp_key_text, resp_key_text)
-    inst_text.text = calib_text
-    inst_text.draw()
-    targ_image.image = image_fns[targ]
-    win.flip()
-    if mac: iokeyboard.waitForPresses(keys = [response_key])
-    else: event.waitKeys(keyList = [response_key])
-    targ_image.draw()
-    win.flip()
-    if mac: iokeyboard.waitForPresses(keys = [response_key])
-    else: event.waitKeys(keyList = [response_key])
-    for c in list(range(0, 4)):
-        targ_image.pos = (calib_x[c], calib_y[c])
+# Run every run of the session; Each run gets its own summary, stimlog and target, the staircase carries over
+if eye_tracking:
+    gaze_monitor.start()
+session_params = dict(params)                       # Parameters as set up for the session; each run adds its results to a fresh copy
+for run_idx in list(range(0, session_runs)):
+    params = dict(session_params)
+    if run_idx > 0:
+        run_number = str(first_run + run_idx).zfill(len(run_number))
+        filename, datafile, stim_log, journal = open_run_files(run_number)
+        targ = choose_target()
+        print('>-----------Start-Run-----------< \n')
+        print('Run:              ' + run_number)
+        print('Stim Duration:    ' + str(time_list[dur_idx]) + ' ms\n')
+    trial = 1
+    bar_fix = []                        # Fixation statistics per bar
+    sweep_drops = []                    # Dropped frames per sweep
+    sweep_jitter = []                   # Flip interval statistics per sweep
+    sweep_onset_error = []              # First flip of each sweep relative to its planned onset, in ms
+    pulse_log = psy_timing.PulseLog(tr)
+    pulse_corrections = []
+    hooks = psy_profile.get_hooks(params['profile'], frame_clock.period)
+    slack = psy_timing.SlackScheduler(frame_clock)                                  # Deferred work of the sweep frame loop
+    run_dropped_start = frame_clock.dropped
+    run_gc_start = len(realtime.gc_pauses) if realtime is not None else 0          # Collections before this run's sweeps
+    if status_board is not None:
+        status_board.publish(state = 'waiting', run = int(run_number) if run_number.isdigit() else 0, trial = 0, n_trials = n_trials,
+                             n_bars = n_bars, bar = 0, dropped = 0, pulses = 0, last_accuracy = float('nan'), last_rt = float('nan'))
+    if eye_tracking:
+        et_messages.send('run ' + run_number)
+    if journal is not None:
+        journal.write(psy_journal.PARAMS, ''.join([key + ',' + str(params[key]) + '\n' for key in params]))
+    # 10. Target presentation & peripheral calibration
+    if params['calibrate_targ']:
+        calib_x = [l_marg, 0, r_marg, 0]
+        calib_y = [0, t_marg, 0, b_marg]
+        calib_text = 'You will now be presented with the target so that you will have an idea of what the image looks like in your peripheral vision. Please press %s to indicate that you have seen the target in each location. Press %s to begin.' % (resp_key_text, resp_key_text)
+        inst_text.text = calib_text
+        inst_text.draw()
+        targ_image.image = stim_images[targ]
+        win.flip()
+        if mac: iokeyboard.waitForPresses(keys = [response_key])
+        else: event.waitKeys(keyList = [response_key])
         targ_image.draw()
-        fix_circle.draw()
-        fix_cross.draw()
-        fix_dot.draw()
         win.flip()
         if mac: iokeyboard.waitForPresses(keys = [response_key])
         else: event.waitKeys(keyList = [response_key])
-    win.flip()
-
+        for c in list(range(0, 4)):
+            targ_image.pos = (calib_x[c], calib_y[c])
+            targ_image.draw()
+            fixation.draw()
+            win.flip()
+            if mac: iokeyboard.waitForPresses(keys = [response_key])
+            else: event.waitKeys(keyList = [response_key])
+        win.flip()
 
-# 11. Instructions
-if not scanning:
-    inst_text.text = 'For each trial, you will be presented with a target. You should maintain fixation on the cross in the center of the screen. If you see the target image, press the spacebar. Press the spacebar to begin.'
-    inst_text.draw()
-    win.flip()
-    if mac: iokeyboard.waitForPresses(keys=[' '])
-    else: event.waitKeys(keyList = ['space'])
-    tStartExp = time.time()
-    win.flip()
 
-# 12. Run sweeps
-if scanning:
-    inst_text.text = 'Get ready!'
-    inst_text.draw()
-    if params['extended_start']:
+    # 11. Instructions
+    if not scanning:
+        inst_text.text = 'For each trial, you will be presented with a target. You should maintain fixation on the cross in the center of the screen. If you see the target image, press the spacebar. Press the spacebar to begin.'
+        inst_text.draw()
         win.flip()
-        if mac: iokeyboard.waitForPresses(keys = [' '])
+        if mac: iokeyboard.waitForPresses(keys=[' '])
         else: event.waitKeys(keyList = ['space'])
-        fix_circle.draw()
-        fix_cross.draw()
-        fix_dot.draw()
-        win.flip()
-        tStartExp = time.time()
-        if mac: iokeyboard.waitForPresses(keys = [pulse_cue])
-        else: event.waitKeys(keyList = [pulse_cue])
-        static = StaticPeriod(screenHz = fps)
-        static.start(9.5)
-        static.complete()
-        if mac: iokeyboard.waitForPresses(keys = [pulse_cue])
-        else: event.waitKeys(keyList = [pulse_cue])
-    else:
-        print('Subject is ready.')
-        if mac: iokeyboard.waitForPresses(keys = [pulse_cue])
-        else: event.waitKeys(keyList = [pulse_cue])
-        win.flip() # see 'Get Ready' experiment starts!
-        # et.sendMessage('xDAT 100')
-        tStartExp = time.time()
-        static = StaticPeriod(screenHz = fps)
-        static.start(tr)
-        static.complete()
-# Maintain fixation display across sweeps
-fix_circle.autoDraw = True
-fix_cross.autoDraw = True
-fix_dot.autoDraw = True
-
-# Run each sweep
-trialOnset = []
-trialDur = []
-for x in list(range(0, n_trials)):
+        tStartExp = frame_clock.flip()
+        tRunStart = tStartExp
+
+    # 12. Run sweeps
+    if scanning:
+        inst_text.text = 'Get ready!'
+        inst_text.draw()
+        if params['extended_start']:
+            win.flip()
+            if mac: iokeyboard.waitForPresses(keys = [' '])
+            else: event.waitKeys(keyList = ['space'])
+            fixation.draw()
+            tStartExp = frame_clock.flip()
+            pulse_log.set_reference(wait_pulse())
+            static = StaticPeriod(screenHz = fps)
+            static.start(9.5)
+            static.complete()
+            wait_pulse()
+            tRunStart = frame_clock.now()
+        else:
+            print('Subject is ready.')
+            pulse_log.set_reference(wait_pulse())
+            tStartExp = frame_clock.flip() # see 'Get Ready' experiment starts!
+            # et.sendMessage('xDAT 100')
+            tRunStart = tStartExp + tr
+            static = StaticPeriod(screenHz = fps)
+            static.start(tr)
+            static.complete()
+    # Maintain fixation display across sweeps
+    fixation.autoDraw = True
+
+    # Run each sweep; Sweep x is planned on the TR grid from the start of the run instead of from the end of the previous sweep,
+    # so late frames and slow loads do not accumulate across the run
+    trialOnset = []
+    trialDur = []
+    for x in list(range(0, n_trials)):
+        if eye_tracking:
+            eye_msg = 'trial ' + str(trial)
+            et_messages.send(eye_msg)
+        if status_board is None:
+            print('Sweep #%i' %(x+1))
+            print('Stimuli Duration: ' + str(time_list[dur_idx]) + ' ms')
+        tStartTrial = frame_clock.now()
+        tOnset = tRunStart + tr + x * (tr + n_bars * bar_dur)
+        accuracy = sweep(tStartExp=tStartExp, tOnset=tOnset, bar_dur=bar_dur, direct = types[x % 4], refresh_rate = set_list[dur_idx], trial=trial, targ=targ)
+        if status_board is None:
+            print('%ss sweep stops\n'%(frame_clock.now()-tStartExp))
+        trial += 1
+        # Staircase image refresh rate by indexing list of appropriate refresh rates
+        if hooks.active: hooks.begin('staircase update')
+        if dur_idx < len(set_list) - 1 and accuracy < stair_lower:
+                dur_idx += 1
+        elif dur_idx > 0 and accuracy >= stair_upper:
+                dur_idx -= 1
+        if hooks.active: hooks.end()
+        tTrialEnd = frame_clock.now()
+        trialOnset.append(tStartTrial-tStartExp)
+        trialDur.append(tTrialEnd-tStartTrial)
+        if journal is not None:
+            journal.write(psy_journal.TRIAL, '%f,%f' % (trialOnset[-1], trialDur[-1]))
+    # add 12s blank screen in the end
+    # fixation.draw()
+    frame_clock.flip()
+    frame_clock.wait_until(tRunStart + n_trials * (tr + n_bars * bar_dur) + 13)
+    expt_dur = frame_clock.now()-tStartExp
+    input_pump.poll()
+    log_pulses()
+    # Save parameters, Close CSV file & Eyetracker
+    params['expt_dur']=expt_dur
+    params['trial_onset']=trialOnset
+    params['trial_dur']=trialDur
+    params['sweep_dropped_frames'] = sweep_drops
+    params['sweep_jitter_sd_ms'] = [round(j['sd_ms'], 3) for j in sweep_jitter]
+    params['sweep_jitter_max_ms'] = [round(j['max_ms'], 3) for j in sweep_jitter]
+    if realtime is not None:
+        params['gc_pause_ms'] = round(1000 * max(realtime.gc_pauses[run_gc_start:], default = 0), 3)
+    params['sweep_onset_error_ms'] = [round(e, 2) for e in sweep_onset_error]
+    if scanning:
+        pulse_summary = pulse_log.summary()
+        print('MRI pulses: %i, missed: %i, scanner clock drift: %.1f ppm' % (pulse_summary['n_pulses'], pulse_summary['missed'], pulse_summary['drift_ppm']))
+        params['n_pulses'] = pulse_summary['n_pulses']
+        params['missed_pulses'] = pulse_summary['missed']
+        params['scanner_drift_ppm'] = round(pulse_summary['drift_ppm'], 1)
+        params['pulse_corrections'] = pulse_corrections
+        if save_log:
+            pulse_file = open(filename + '_pulses.csv', 'w')
+            pulse_file.write('pulse,time,tr\n')
+            for k, pulse_time in enumerate(pulse_log.times, start = 1):
+                pulse_file.write('%i,%f,%i\n' % (k, pulse_time - tStartExp, pulse_log.index_of(pulse_time)))
+            pulse_file.close()
     if eye_tracking:
-        eye_msg = 'trial ' + str(trial)
-        et.sendMessage(eye_msg)
-    print('Sweep #%i' %(x+1))
-    print('Stimuli Duration: ' + str(time_list[dur_idx]) + ' ms')
-    tStartTrial = time.time()
-    accuracy = sweep(tStartExp=tStartExp, bar_dur=bar_dur, direct = types[x % 4], refresh_rate = set_list[dur_idx], trial=trial)
-    print('%ss sweep stops\n'%(time.time()-tStartExp))
-    trial += 1
-    # Staircase image refresh rate by indexing list of appropriate refresh rates
-    if dur_idx < len(set_list) - 1 and accuracy < stair_lower:
-            dur_idx += 1
-    elif dur_idx > 0 and accuracy >= stair_upper:
-            dur_idx -= 1
-    tTrialEnd = time.time()
-    trialOnset.append(tStartTrial-tStartExp)
-    trialDur.append(tTrialEnd-tStartTrial)
-# add 12s blank screen in the end
-endtimer = CountdownTimer(13)
-# fix_circle.draw()
-# fix_cross.draw()
-# fix_dot.draw()
-while endtimer.getTime() > 0:
-    win.flip()
-expt_dur = time.time()-tStartExp
-# Save parameters, Close CSV file & Eyetracker
-params['expt_dur']=expt_dur
-params['trial_onset']=trialOnset
-params['trial_dur']=trialDur
-datafile.write('\n\n\n')
-for key in params:
-    datafile.write(key + ',' + str(params[key]) + '\n')
-datafile.close()
-if save_log:
-    stim_log.close()
+        params['fix_valid_pct'] = [round(b['valid_pct'], 1) for b in bar_fix]
+        params['fix_mean_dev'] = [round(b['mean_dev'], 3) for b in bar_fix]
+        params['fix_max_dev'] = [round(b['max_dev'], 3) for b in bar_fix]
+        params['fix_within_pct'] = [round(b['within_pct'], 1) for b in bar_fix]
+    params['deferred_jobs'] = slack.stats()
+    hooks.report(filename if save_log else None)
+    datafile.write('\n\n\n')
+    for key in params:
+        datafile.write(key + ',' + str(params[key]) + '\n')
+    datafile.close()
+    if save_log:
+        stim_log.close()
+    if journal is not None:
+        journal.write(psy_journal.END, '')
+        journal.close()
+    fixation.autoDraw = False
+    print('Run ' + str(run_number) + ' (' + str(expt_dur) + ' s)' + ' completed! \n')
+
 if eye_tracking:
+    gaze_monitor.stop()
+    et_messages.stop()
+    et_messages.print_stats()
     et.sendMessage('xDAT 111')
     et.setRecordingState(False)
     et.setConnectionState(False)
@@ -773,7 +1074,11 @@ if eye_tracking:
         os.rename(edf_filename, long_edf_filename)
 
 
-print('Run ' + str(run_number) + ' (' + str(expt_dur) + ' s)' + ' completed! \n')
 # print(expt_end-expt_start) = 1.3
+if status_board is not None:
+    status_board.publish(state = 'done')
+    status_board.close()
+if realtime is not None:
+    realtime.exit()
 win.close()
 core.quit()